@@ -0,0 +1,96 @@
+"""
+Benchmark of ADS API request throughput: bare requests.get calls (one connection
+per request) versus the pooled, keep-alive session used by xreport.utils._do_query
+
+A local mock server stands in for the ADS API, so the numbers reflect connection
+handling overhead rather than Solr query time.
+
+Usage:
+    python benchmarks/bench_api_client.py [--requests N] [--facet-data FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, proj_home)
+
+from xreport.utils import _do_query
+from xreport.utils import _reset_session
+
+
+def make_handler(payload):
+    class MockAPIHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1, so that clients can keep connections alive
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately; avoid delayed ACK stalls
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+    return MockAPIHandler
+
+
+def bare_requests(conf, params, n):
+    # This is what _do_query used to do for every query
+    headers = {
+        "Authorization": "Bearer:{}".format(conf['ADS_API_TOKEN']),
+        "Accept": "application/json"
+    }
+    url = "{}/search/query?{}".format(conf['ADS_API_URL'], urllib.parse.urlencode(params))
+    for i in range(n):
+        r = requests.get(url, headers=headers)
+        r.json()
+
+
+def pooled_requests(conf, params, n):
+    for i in range(n):
+        _do_query(conf, params)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500, dest='nreq')
+    parser.add_argument('--facet-data', dest='datafile',
+                        default='{0}/xreport/tests/data/FacetDataVolumeCount.json'.format(proj_home))
+    args = parser.parse_args()
+
+    with open(args.datafile, 'rb') as fh:
+        payload = fh.read()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(payload))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    conf = {
+        'ADS_API_URL': 'http://127.0.0.1:{0}'.format(server.server_address[1]),
+        'ADS_API_TOKEN': 'benchmark',
+        'API_POOL_SIZE': 10,
+    }
+    params = {'q': 'bibstem:"ApJ"', 'facet': 'on', 'facet.field': 'volume', 'rows': 1}
+    _reset_session()
+    for label, func in [('bare requests.get', bare_requests), ('pooled session', pooled_requests)]:
+        # Warm up
+        func(conf, params, 5)
+        start = time.perf_counter()
+        func(conf, params, args.nreq)
+        elapsed = time.perf_counter() - start
+        print('{0:<20} {1:>6} requests in {2:6.2f}s: {3:8.1f} requests/s'.format(label, args.nreq, elapsed, args.nreq / elapsed))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark of the citation total calculation (xreport.utils._get_citations): a year,citation_count
+pivot query (the sum of each citation value times its multiplicity) versus the Solr stats
+component (the sum of the citation counts), comparing response payload size and latency
+
+A local mock server stands in for the ADS API. It serves a synthetic pivot with the given number
+of years and distinct citation counts per year, and the corresponding stats.
+
+Usage:
+    python benchmarks/bench_citations.py [--years N] [--values N] [--requests N]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, proj_home)
+
+from xreport.utils import _do_query
+from xreport.utils import _get_citations
+from xreport.utils import _reset_session
+
+
+def make_payloads(nyears, nvalues):
+    pivots = []
+    total = 0
+    for year in range(2024 - nyears, 2024):
+        values = [{'field': 'citation_count', 'value': v, 'count': random.randint(1, 500)} for v in range(nvalues)]
+        total += sum([e['value']*e['count'] for e in values])
+        pivots.append({'field': 'year', 'value': year, 'count': sum([e['count'] for e in values]), 'pivot': values})
+    pivot = json.dumps({'facet_counts': {'facet_pivot': {'year,citation_count': pivots}}}).encode('utf-8')
+    stats = json.dumps({'response': {'numFound': 0, 'docs': []},
+                        'stats': {'stats_fields': {'citation_count': {'sum': float(total)}}}}).encode('utf-8')
+    return pivot, stats, total
+
+
+def make_handler(pivot, stats):
+    class MockAPIHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            payload = stats if 'stats.field' in params else pivot
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+    return MockAPIHandler
+
+
+def pivot_citations(conf, query_string):
+    # This is how citation totals used to be calculated
+    params = {
+            'facet': 'true',
+            'facet.limit': 2000,
+            'facet.minCount': '1',
+            'facet.pivot': 'year,citation_count',
+            'q': query_string,
+            'sort': 'citation_count desc'
+        }
+    query_data = _do_query(conf, params)
+    pivots_data = query_data['facet_counts']['facet_pivot'].get('year,citation_count')
+    data = [item for sublist in [p['pivot'] for p in pivots_data] for item in sublist]
+    return sum([e['count']*e['value'] for e in data])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=100)
+    parser.add_argument('--values', type=int, default=1500)
+    parser.add_argument('--requests', type=int, default=20, dest='nreq')
+    args = parser.parse_args()
+
+    random.seed(42)
+    pivot, stats, total = make_payloads(args.years, args.values)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(pivot, stats))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conf = {
+        'ADS_API_URL': 'http://127.0.0.1:{0}'.format(server.server_address[1]),
+        'ADS_API_TOKEN': 'benchmark',
+        'API_POOL_SIZE': 1,
+    }
+    _reset_session()
+
+    print('{0} years x {1} citation counts'.format(args.years, args.values))
+    timings = {}
+    for label, func, payload in [('pivot', pivot_citations, pivot), ('stats', _get_citations, stats)]:
+        # Warm up
+        assert func(conf, 'star') == total
+        start = time.perf_counter()
+        for i in range(args.nreq):
+            func(conf, 'star')
+        timings[label] = (time.perf_counter() - start) / args.nreq
+        print('{0:<6} payload {1:>12,} bytes, {2:8.1f} ms per query'.format(label, len(payload), 1000*timings[label]))
+    print('stats is {0:.0f}x faster'.format(timings['pivot'] / timings['stats']))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
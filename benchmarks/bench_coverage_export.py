@@ -0,0 +1,97 @@
+"""
+Benchmark of writing coverage grids (Report.save_report) to Excel: the pandas Styler with a
+per-cell CSS mapping function versus openpyxl with fills determined for the whole grid up front
+(xreport.utils._write_coverage_grid)
+
+Both spreadsheets are read back to confirm that they have the same values and cell colors.
+
+Usage:
+    python benchmarks/bench_coverage_export.py [--journals N] [--volumes N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import openpyxl
+import pandas as pd
+
+proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, proj_home)
+
+from xreport.utils import _write_coverage_grid
+
+
+def make_grid(njournals, nvolumes):
+    journals = ['J{0:04d}'.format(i) for i in range(njournals)]
+    rows = [['jrnl ->'] + journals, ['start vol ->'] + ['1']*njournals]
+    for vol in range(1, nvolumes + 1):
+        row = [str(vol)]
+        for j in journals:
+            # Not all journals have all volumes
+            row.append(round(random.uniform(0, 100), 1) if random.random() < 0.8 else '')
+        rows.append(row)
+    return rows
+
+
+def highlight_cells(val):
+    # The mapping function that was used to color the cells
+    try:
+        if val >= 90:
+            color = '#6aa84f'
+        elif val <= 60:
+            color = '#f4cccc'
+        elif val > 60 and val <=70:
+            color = '#ffe599'
+        else:
+            color = '#cfe2f3'
+    except:
+        color = '#ffffff'
+    return 'background-color: {}'.format(color)
+
+
+def styler_export(output_file, rows):
+    # This is how coverage grids used to be written
+    output_frame = pd.DataFrame(rows)
+    output_frame.style.applymap(highlight_cells).to_excel(output_file, engine='openpyxl', index=False, header=False, freeze_panes=(1,1))
+
+
+def read_back(output_file):
+    sheet = openpyxl.load_workbook(output_file).active
+    cells = [[(c.value, c.fill.fill_type, c.fill.fgColor.rgb) for c in row] for row in sheet.iter_rows()]
+    return sheet.freeze_panes, cells
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--journals', type=int, default=200)
+    parser.add_argument('--volumes', type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    rows = make_grid(args.journals, args.volumes)
+    tmpdir = tempfile.mkdtemp()
+    styler_file = os.path.join(tmpdir, 'styler.xlsx')
+    grid_file = os.path.join(tmpdir, 'grid.xlsx')
+
+    print('{0} journals x {1} volumes'.format(args.journals, args.volumes))
+    start = time.perf_counter()
+    styler_export(styler_file, rows)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _write_coverage_grid(grid_file, rows)
+    after = time.perf_counter() - start
+    assert read_back(grid_file) == read_back(styler_file)
+
+    print('Styler:       {0:8.2f}s'.format(before))
+    print('openpyxl:     {0:8.2f}s ({1:.0f}x faster)'.format(after, before / after))
+    os.remove(styler_file)
+    os.remove(grid_file)
+    os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark of the curator full text coverage calculation (FullTextReport._get_fulltext_data_classic)
+on a synthetic Classic full text index: one DataFrame query per journal, volume and source
+versus a single groupby aggregation of the index
+
+Usage:
+    python benchmarks/bench_fulltext_coverage.py [--lines N] [--journals N] [--volumes N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, proj_home)
+
+from xreport.reports import FullTextReport
+
+
+def make_links_file(path, journals, nlines, nvolumes):
+    sources = ['ARXIV', 'EDP', 'IOP', 'ELSEVIER', 'SPRINGER']
+    with open(path, 'w') as fh:
+        for i in range(nlines):
+            bibstem = journals[i % len(journals)]
+            volume = str(random.randint(1, nvolumes)).rjust(4, '.')
+            page = str(random.randint(1, 9999)).rjust(4, '.')
+            bibcode = '2020{0}{1}.{2}X'.format(bibstem, volume, page)
+            fh.write('{0}\t/path/to/fulltext/{1}.xml\t{2}\n'.format(bibcode, i, random.choice(sources)))
+
+
+def query_per_volume(report, ft_source):
+    # This is how coverage used to be calculated
+    for journal in report.journals:
+        cov_dict = {}
+        for volume in sorted(report.statsdata[journal]['pubdata'].keys()):
+            if ft_source == 'arxiv':
+                data = report.ft_index.query("bibstem=='{0}' and volume=={1} and source=='arxiv'".format(journal, volume))
+            else:
+                data = report.ft_index.query("bibstem=='{0}' and volume=={1} and source!='arxiv'".format(journal, volume))
+            frac = 100*float(len(data['source'].tolist()))/float(report.statsdata[journal]['pubdata'][volume])
+            cov_dict[volume] = round(frac, 1)
+        report.statsdata[journal][ft_source] = cov_dict
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=2000000)
+    parser.add_argument('--journals', type=int, default=10)
+    parser.add_argument('--volumes', type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(42)
+    journals = ['J{0:04d}'.format(i) for i in range(args.journals)]
+    tmpdir = tempfile.mkdtemp()
+    links_file = os.path.join(tmpdir, 'all.links')
+    make_links_file(links_file, journals, args.lines, args.volumes)
+
+    report = FullTextReport(config={'CLASSIC_FULLTEXT_INDEX': links_file, 'JOURNALS': {'BENCH': journals}})
+    report.journals = journals
+    report.skip_fulltext = {}
+    report.statsdata = {}
+    for journal in journals:
+        pubdata = {v: random.randint(100, 1000) for v in range(1, args.volumes + 1)}
+        report.statsdata[journal] = {'pubdata': pubdata, 'arxiv': {}, 'publisher': {}}
+
+    print('{0} index lines, {1} journals x {2} volumes'.format(args.lines, args.journals, args.volumes))
+    start = time.perf_counter()
+    for source in ['publisher', 'arxiv']:
+        query_per_volume(report, source)
+    before = time.perf_counter() - start
+    expected = {j: dict(report.statsdata[j]) for j in journals}
+
+    start = time.perf_counter()
+    for source in ['publisher', 'arxiv']:
+        report._get_fulltext_data_classic(source)
+    after = time.perf_counter() - start
+    for journal in journals:
+        for source in ['publisher', 'arxiv']:
+            assert report.statsdata[journal][source] == expected[journal][source]
+
+    print('query per volume: {0:8.2f}s'.format(before))
+    print('groupby:          {0:8.2f}s ({1:.0f}x faster)'.format(after, before / after))
+    os.remove(links_file)
+    os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,93 @@
 # ============================= LOGGING ======================================== #
 LOGGING_LEVEL = 'INFO'
 LOG_STDOUT = False
+# Also report (peak) memory use when profiling the loading of data (this slows things down)
+PROFILE_MEMORY = False
+# Write a performance manifest (JSON, with phase timings, API calls, bytes received, cache hits,
+# files scanned and peak memory use) next to the report for every run
+PERFORMANCE_MANIFEST = True
+# If set, the metrics of every run are also written to this file in the Prometheus text format
+# (e.g. for the textfile collector of the node exporter)
+PROMETHEUS_TEXTFILE = None
+# Profile complete runs (also with the --profile option of run.py). Profiles are written to
+# OUTPUT_DIRECTORY/profiles/<run>: sampled stacks (for flame graphs) or cProfile statistics,
+# depending on PROFILE_MODE ('sampling' or 'cprofile'), and the top memory allocation sites
+PROFILE_RUN = False
+PROFILE_MODE = 'sampling'
+PROFILE_SAMPLE_INTERVAL = 0.01
+PROFILE_TOP_ALLOCATIONS = 25
+# The number of frames stored for every traced memory allocation
+PROFILE_TRACE_FRAMES = 10
 # ============================= ADS ============================================ #
 ADS_API_TOKEN = "<secret>"
 ADS_API_URL = "https://ui.adsabs.harvard.edu/v1"
+# Settings for the (pooled) HTTP client used for ADS API requests
+API_POOL_SIZE = 10
+API_TIMEOUT = 60
+# Requests failing with these status codes (or with connection errors) are retried,
+# with exponential backoff (in seconds) unless the API sends a Retry-After header
+API_MAX_RETRIES = 5
+API_BACKOFF_FACTOR = 0.5
+API_BACKOFF_MAX = 60
+API_RETRY_STATUS = [429, 502, 503, 504]
+# The maximum number of ADS API requests that are allowed to run in parallel
+# (should not exceed API_POOL_SIZE)
+MAX_API_CONCURRENCY = 8
+# The maximum number of jobs (gathering collection data, making reports) that run in parallel
+# when creating reports in batch mode (run.py --batch). These jobs share MAX_API_CONCURRENCY
+BATCH_WORKERS = 4
+# Celery settings for distributed report creation (run.py --distributed): journal level work is
+# done by the workers of the xreport app, and a chord callback puts the reports together (which
+# needs a result backend). With CELERY_ALWAYS_EAGER all tasks run in the current process, which
+# allows testing without workers (with the in-memory broker and result backend)
+CELERY_INCLUDE = ['xreport.tasks']
+CELERY_BROKER = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+CELERY_ALWAYS_EAGER = False
+# The journals to build the Classic full text index for (by default, those of the collection being reported)
+FULLTEXT_INDEX_JOURNALS = None
+# When retrieving records page by page, retrieve the next page while the current one is processed
+RECORDS_PREFETCH = True
+# API responses can be cached on disk (in CACHE_DIRECTORY), so that repeated report runs do
+# not need to send the same requests again. Cached responses expire after a time to live
+# (in seconds) per endpoint, and the least recently used ones are removed when the cache
+# grows beyond API_CACHE_MAX_SIZE (in bytes). In offline mode, responses only come from the cache
+USE_API_CACHE = False
+API_OFFLINE = False
+API_CACHE_TTL = {
+    'search/query': 6*3600,
+    'journals/summary': 24*3600
+}
+API_CACHE_DEFAULT_TTL = 3600
+API_CACHE_MAX_SIZE = 1024**3
+# Per-volume and per-year counts are retrieved for chunks of this many journals at once,
+# via pivot queries on bibstem (a value of 1 means: one facet query per journal)
+PIVOT_CHUNK_SIZE = 25
+# Pivot queries return at most this many values per level; journals for which the results
+# may have been truncated are queried individually
+PIVOT_FACET_LIMIT = 2000
+# Journals are queried individually with facet queries returning at most this many values
+# (at least PIVOT_FACET_LIMIT)
+FACET_LIMIT = 10000
 CLASSIC_FULLTEXT_INDEX = "/tmp/all.links"
 CLASSIC_USAGE_INDEX = {
     'reads':'/tmp/reads.links',
     'downloads':'/tmp/downloads.links'
 }
+# The Classic full text index is parsed in chunks of this many lines
+FULLTEXT_INDEX_CHUNKSIZE = 500000
 ADS_REFERENCE_DATA = "/references/resolved"
+# The number of processes scanning reference resolver results files in parallel
+REFERENCE_SCAN_WORKERS = 4
 ADS_PUBLISHER_DATA = "/config/publisher_bibstem.dat"
 # The root of the output location
 OUTPUT_DIRECTORY = '/tmp/reports'
+# Format of the MISSING reports: spreadsheets ('xlsx') or CSV files ('csv')
+MISSING_OUTPUT_FORMAT = 'xlsx'
+# Parsed versions of the Classic index files are cached here (and are rebuilt automatically
+# when an index file changes)
+USE_INDEX_CACHE = True
+CACHE_DIRECTORY = '/tmp/reports/cache'
 # ============================= APPLICATION ==================================== #
 # 
 # Collections we are reporting on
@@ -93,9 +168,9 @@ SUMMARY_ROWS = {
     "PS recent sample":"Core Planetary Science collection including references and citations, filtered on entry date (entdate:[NOW-365DAYS TO *])",
     "PS_AST recent sample":"Planetary Science in Main Astronomy collection including references and citations, filtered on entry date (entdate:[NOW-365DAYS TO *])",
 }
-# For these collections we need to skip the calculation of usage
-# (because it would involve retrieving all bibcodes)
-SKIP_USAGE = ['HP_AST', 'PS_AST']
+# For these collections we skip the calculation of usage
+# (usage for filtered collections and recent samples requires retrieving all their bibcodes)
+SKIP_USAGE = []
 # For these publications (bibstem) the volume is treated as volume. This dictionary lists the start year
 YEAR_IS_VOL = {
     'JCAP':2003
@@ -5,6 +5,11 @@ import sys
 import os
 
 from xreport import tasks
+from xreport.cache import _purge_cache
+from xreport.cache import _response_cache_stats
+from xreport.utils import _write_manifest
+from xreport.utils import _write_prometheus_textfile
+from xreport.utils import _profile_run
 
 # ============================= INITIALIZATION ==================================== #
 
@@ -18,6 +23,40 @@ logger = setup_logging('run.py', proj_home=proj_home,
 
 # =============================== FUNCTIONS ======================================= #
 
+def write_performance_manifest(args, started, failed):
+    """
+    Write the performance manifest for this run (phase timings, counters and peak memory use)
+    next to the report(s), and update the Prometheus textfile (if PROMETHEUS_TEXTFILE is set)
+
+    param: args: the command line arguments
+    param: started: the start time of the run
+    param: failed: whether the run failed
+    """
+    finished = datetime.datetime.now()
+    run_info = {
+        'collection': args.collection,
+        'format': args.format,
+        'subject': args.subject,
+        'mode': 'batch' if args.batch else 'distributed' if args.distributed else 'single',
+        'started': started.isoformat(),
+        'finished': finished.isoformat(),
+        'seconds': round((finished - started).total_seconds(), 3),
+        'failed': failed
+    }
+    # Batch runs get one manifest for all reports
+    if args.batch:
+        outdir = config['OUTPUT_DIRECTORY']
+    else:
+        outdir = "{0}/{1}".format(config['OUTPUT_DIRECTORY'], args.format)
+    os.makedirs(outdir, exist_ok=True)
+    manifest_file = "{0}/performance_{1}_{2}_{3}.json".format(outdir, args.collection.replace(',', '+'),
+                                                              args.subject.replace(',', '+'), started.strftime('%Y%m%d'))
+    manifest = _write_manifest(manifest_file, run_info)
+    logger.info('Performance manifest written to {0}'.format(manifest_file))
+    if config.get('PROMETHEUS_TEXTFILE'):
+        labels = {'collection': args.collection, 'format': args.format, 'subject': args.subject}
+        _write_prometheus_textfile(config['PROMETHEUS_TEXTFILE'], manifest, labels=labels)
+
 
 if __name__ == '__main__':
 
@@ -28,16 +67,73 @@ if __name__ == '__main__':
                         help='Format of report')
     parser.add_argument('-s', '--subject', default='ALL', dest='subject',
                         help='Subject of the report')
+    parser.add_argument('--batch', default=False, action='store_true', dest='batch',
+                        help='Create reports for all combinations of collections, formats and subjects, specified as comma separated lists (e.g. -c AST,PS -f NASA,CURATORS)')
+    parser.add_argument('--distributed', default=False, action='store_true', dest='distributed',
+                        help='Have the journal level work done by Celery workers (see CELERY_BROKER)')
+    parser.add_argument('--profile', default=False, action='store_true', dest='profile',
+                        help='Profile the run (see PROFILE_MODE) and write the profile to OUTPUT_DIRECTORY/profiles')
+    parser.add_argument('--no-cache', default=False, action='store_true', dest='no_cache',
+                        help='Do not use (or update) cached versions of the Classic index files')
+    parser.add_argument('--purge-cache', default=False, action='store_true', dest='purge_cache',
+                        help='Remove all cached data before creating the report')
+    parser.add_argument('--api-cache', default=False, action='store_true', dest='api_cache',
+                        help='Serve ADS API requests from (and store responses in) the API response cache')
+    parser.add_argument('--offline', default=False, action='store_true', dest='offline',
+                        help='Serve all ADS API requests from the API response cache, without accessing the API')
     args = parser.parse_args()
 
-    if args.collection not in config.get('COLLECTIONS'):
+    if args.batch:
+        collections = args.collection.split(',')
+        formats = args.format.split(',')
+        subjects = args.subject.split(',')
+    else:
+        collections = [args.collection]
+        formats = [args.format]
+        subjects = [args.subject]
+    if [c for c in collections if c not in config.get('COLLECTIONS')]:
         sys.exit('Please specify one of the following values for the collection parameter: {}'.format(config.get('COLLECTIONS')))
-    if args.format not in config.get('FORMATS'):
+    if [f for f in formats if f not in config.get('FORMATS')]:
         sys.exit('Please specify one of the following values for the format parameter: {}'.format(config.get('FORMATS')))
-    if args.subject not in config.get('SUBJECTS'):
+    if [s for s in subjects if s not in config.get('SUBJECTS')]:
         sys.exit('Please specify one of the following values for the subject parameter: {}'.format(config.get('SUBJECTS')))
-    try:
-        report = tasks.create_report(collection=args.collection, format=args.format, subject=args.subject)
-    except Exception as error:
+    report_config = {}
+    if args.no_cache:
+        report_config['USE_INDEX_CACHE'] = False
+    if args.api_cache:
+        report_config['USE_API_CACHE'] = True
+    if args.offline:
+        report_config['API_OFFLINE'] = True
+    if args.purge_cache:
+        _purge_cache(config)
+    started = datetime.datetime.now()
+    failed = False
+    error = None
+    # Profiles of runs go into a directory of their own
+    profile_config = dict(config, PROFILE_RUN=args.profile or config.get('PROFILE_RUN', False))
+    profile_dir = "{0}/profiles/{1}_{2}_{3}_{4}".format(config['OUTPUT_DIRECTORY'], args.collection.replace(',', '+'), args.format.replace(',', '+'),
+                                                       args.subject.replace(',', '+'), started.strftime('%Y%m%d-%H%M%S'))
+    with _profile_run(profile_config, profile_dir):
+        if args.batch:
+            errors = tasks.create_reports(collections=collections, formats=formats, subjects=subjects, config=report_config)
+            if errors:
+                logger.error('{0} batch job(s) failed: {1}'.format(len(errors), list(errors.keys())))
+                failed = True
+        elif args.distributed:
+            try:
+                for result in tasks.create_report_distributed(collection=args.collection, format=args.format, subject=args.subject, config=report_config):
+                    result.get()
+            except Exception as err:
+                error = err
+        else:
+            try:
+                report = tasks.create_report(collection=args.collection, format=args.format, subject=args.subject, config=report_config)
+            except Exception as err:
+                error = err
+    if config.get('PERFORMANCE_MANIFEST', True):
+        write_performance_manifest(args, started, failed or error is not None)
+    if error is not None:
         logger.error('Creating "{0}" report for "{1}" on collection "{2}" failed: {3}'.format(args.subject, args.format, args.collection, error))
-        sys.exit('Creating "{0}" report for "{1}" on collection "{2}" failed: {3}'.format(args.subject, args.format, args.collection, error))
\ No newline at end of file
+        sys.exit('Creating "{0}" report for "{1}" on collection "{2}" failed: {3}'.format(args.subject, args.format, args.collection, error))
+    if args.api_cache or args.offline:
+        logger.info('API response cache: {0}'.format(", ".join(["{0}={1}".format(k, v) for k, v in _response_cache_stats.items()])))
@@ -1,5 +1,14 @@
 from adsputils import ADSCelery
 
 class xreport(ADSCelery):
+    def __init__(self, app_name, *args, **kwargs):
+        ADSCelery.__init__(self, app_name, *args, **kwargs)
+        # Settings for distributed report creation (see tasks.create_report_distributed) that
+        # are not taken from the configuration by ADSCelery itself
+        if self._config.get('CELERY_RESULT_BACKEND'):
+            self.conf.result_backend = self._config['CELERY_RESULT_BACKEND']
+        if 'CELERY_ALWAYS_EAGER' in self._config:
+            self.conf.task_always_eager = self._config['CELERY_ALWAYS_EAGER']
+
     def attempt_recovery(self, task, args=None, kwargs=None, einfo=None, retval=None):
         pass
\ No newline at end of file
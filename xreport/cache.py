@@ -0,0 +1,344 @@
+import os
+import glob
+import time
+import threading
+import urllib.parse
+import json
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import numpy as np
+from contextlib import closing
+import pandas as pd
+# ============================= INITIALIZATION ==================================== #
+
+from adsputils import setup_logging, load_config
+
+proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
+config = load_config(proj_home=proj_home)
+logger = setup_logging(__name__, proj_home=proj_home,
+                        level=config.get('LOGGING_LEVEL', 'INFO'),
+                        attach_stdout=config.get('LOG_STDOUT', False))
+# Bump this when the layout of cached data changes, to invalidate existing cache entries
+CACHE_VERSION = 2
+# =============================== INDEX CACHE ===================================== #
+# Parsed versions of (large) Classic index files are stored on disk, as a directory of
+# numpy (.npy) files per cache entry. The name of a cache entry is derived from the path,
+# size and modification time of the index file, so that an entry automatically becomes
+# obsolete when the index file changes.
+
+def _cache_directory(conf):
+    """
+    Return the location of the on-disk cache
+
+    param: conf: dictionary with configuration values
+    """
+    return conf.get('CACHE_DIRECTORY') or os.path.join(conf.get('OUTPUT_DIRECTORY', '/tmp'), 'cache')
+
+def _cache_entry(conf, name, source, extra=None):
+    """
+    Return the directory prefix (for all versions) and the directory (for the current version)
+    of the cache entry for a source file. Data cached with different extra parameters (e.g. the
+    full text index for different sets of journals) have different prefixes, so that they
+    can be cached side by side
+
+    param: conf: dictionary with configuration values
+    param: name: name of the type of data being cached
+    param: source: path of the source file
+    param: extra: anything else (JSON serializable) that determines the cached data
+    """
+    stat = os.stat(source)
+    source_id = hashlib.sha1(os.path.realpath(source).encode('utf-8')).hexdigest()[:12]
+    extra_id = hashlib.sha1(json.dumps(extra, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    key = json.dumps([CACHE_VERSION, stat.st_size, stat.st_mtime_ns], sort_keys=True)
+    prefix = os.path.join(_cache_directory(conf), '{0}_{1}_{2}_'.format(name, source_id, extra_id))
+    return prefix, prefix + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def _load_cached_arrays(conf, name, source, extra=None, mmap_mode=None):
+    """
+    Load cached data for a source file, if the cache is enabled and the data are up to date
+    Returns a dictionary of numpy arrays, or None
+
+    param: conf: dictionary with configuration values
+    param: name: name of the type of data being cached
+    param: source: path of the source file
+    param: extra: anything else (JSON serializable) that determines the cached data
+    param: mmap_mode: memory map the arrays instead of reading them in memory
+    """
+    if not conf.get('USE_INDEX_CACHE', False):
+        return None
+    try:
+        prefix, entry = _cache_entry(conf, name, source, extra)
+    except OSError:
+        return None
+    if not os.path.isdir(entry):
+        return None
+    arrays = {}
+    try:
+        for npyfile in glob.glob(os.path.join(entry, '*.npy')):
+            key = os.path.basename(npyfile)[:-4]
+            arrays[key] = np.load(npyfile, mmap_mode=mmap_mode, allow_pickle=False)
+    except Exception as err:
+        logger.warning("Unable to load cached {0} data for {1}: {2}".format(name, source, err))
+        return None
+    logger.info("Loaded {0} data for {1} from cache".format(name, source))
+    return arrays
+
+def _store_cached_arrays(conf, name, source, arrays, extra=None):
+    """
+    Store data for a source file in the cache (if enabled), replacing older versions
+    (for the same extra parameters)
+
+    param: conf: dictionary with configuration values
+    param: name: name of the type of data being cached
+    param: source: path of the source file
+    param: arrays: dictionary of numpy arrays
+    param: extra: anything else (JSON serializable) that determines the cached data
+    """
+    if not conf.get('USE_INDEX_CACHE', False):
+        return
+    try:
+        prefix, entry = _cache_entry(conf, name, source, extra)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Write to a temporary directory first, so that no incomplete entries are left behind
+        tmpdir = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp_')
+        for key, values in arrays.items():
+            np.save(os.path.join(tmpdir, '{0}.npy'.format(key)), values, allow_pickle=False)
+        try:
+            os.rename(tmpdir, entry)
+        except OSError:
+            if not os.path.isdir(entry):
+                raise
+            # The same data were stored in the meantime (e.g. by another report in a batch run),
+            # and may be in use already, so that entry is kept
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        # Remove obsolete versions of the data (for older versions of the source file)
+        for old_entry in glob.glob(prefix + '*'):
+            if old_entry != entry:
+                shutil.rmtree(old_entry, ignore_errors=True)
+    except Exception as err:
+        logger.warning("Unable to cache {0} data for {1}: {2}".format(name, source, err))
+
+def _frame_to_arrays(frame):
+    """
+    Turn a Pandas frame into a dictionary of numpy arrays that can be stored without pickling
+
+    param: frame: the Pandas frame
+    """
+    arrays = {}
+    for column in frame.columns:
+        values = frame[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays['{0}.codes'.format(column)] = values.cat.codes.to_numpy()
+            arrays['{0}.categories'.format(column)] = np.array(values.cat.categories, dtype=str)
+        elif values.dtype == object:
+            arrays[column] = np.array(values, dtype=str)
+        else:
+            arrays[column] = values.to_numpy()
+    arrays['_columns'] = np.array(frame.columns, dtype=str)
+    return arrays
+
+def _arrays_to_frame(arrays):
+    """
+    Turn a dictionary of numpy arrays created by _frame_to_arrays back into a Pandas frame
+
+    param: arrays: dictionary of numpy arrays
+    """
+    data = {}
+    for column in arrays['_columns']:
+        if column in arrays:
+            data[column] = arrays[column]
+        else:
+            data[column] = pd.Categorical.from_codes(arrays['{0}.codes'.format(column)],
+                                                     categories=arrays['{0}.categories'.format(column)])
+    return pd.DataFrame(data)
+
+# ========================== REFERENCE TALLY STORE ================================ #
+# Reference matching tallies are stored per reference data directory (and ApJL filter) in an
+# SQLite database in the cache directory, together with a signature of the results files they
+# were calculated from. Volumes whose results files did not change need not be read again.
+
+def _reference_store(conf):
+    """
+    Return the location of the database with reference matching tallies
+
+    param: conf: dictionary with configuration values
+    """
+    return os.path.join(_cache_directory(conf), 'reference_tallies_v{0}.sqlite'.format(CACHE_VERSION))
+
+def _load_reference_tallies(conf):
+    """
+    Load all stored reference matching tallies, if the cache is enabled
+    Returns a dictionary keyed on (directory, letter), with (signature, tallies) values
+
+    param: conf: dictionary with configuration values
+    """
+    store = _reference_store(conf)
+    if not conf.get('USE_INDEX_CACHE', False) or not os.path.exists(store):
+        return {}
+    try:
+        with closing(sqlite3.connect(store)) as db:
+            rows = db.execute('SELECT directory, letter, signature, publisher_ok, publisher_fail, '
+                              'crossref_ok, crossref_fail FROM reference_tallies').fetchall()
+    except sqlite3.Error as err:
+        logger.warning("Unable to load reference tallies from {0}: {1}".format(store, err))
+        return {}
+    tallies = {}
+    for directory, letter, signature, pub_ok, pub_fail, xref_ok, xref_fail in rows:
+        tallies[(directory, letter or None)] = (signature, {'publisher': [pub_ok, pub_fail],
+                                                            'crossref': [xref_ok, xref_fail]})
+    return tallies
+
+def _store_reference_tallies(conf, tallies):
+    """
+    Store (new or updated) reference matching tallies, if the cache is enabled
+
+    param: conf: dictionary with configuration values
+    param: tallies: dictionary keyed on (directory, letter), with (signature, tallies) values
+    """
+    if not conf.get('USE_INDEX_CACHE', False) or not tallies:
+        return
+    store = _reference_store(conf)
+    rows = []
+    for (directory, letter), (signature, counts) in tallies.items():
+        rows.append((directory, letter or '', signature, counts['publisher'][0], counts['publisher'][1],
+                     counts['crossref'][0], counts['crossref'][1]))
+    try:
+        os.makedirs(os.path.dirname(store), exist_ok=True)
+        with closing(sqlite3.connect(store)) as db:
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS reference_tallies (directory TEXT, letter TEXT, '
+                           'signature TEXT, publisher_ok INTEGER, publisher_fail INTEGER, crossref_ok INTEGER, '
+                           'crossref_fail INTEGER, PRIMARY KEY (directory, letter))')
+                db.executemany('INSERT OR REPLACE INTO reference_tallies VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    except sqlite3.Error as err:
+        logger.warning("Unable to store reference tallies in {0}: {1}".format(store, err))
+
+# ============================ API RESPONSE CACHE =================================== #
+# Responses of ADS API requests are stored in an SQLite database in the cache directory, keyed
+# on the endpoint and the (canonicalized) query parameters. Responses expire after a time to
+# live per endpoint, and the least recently used responses are removed when the total size
+# exceeds API_CACHE_MAX_SIZE. In offline mode, all responses come from the cache (expired or not).
+
+# Usage statistics for the response cache (for the current process)
+_response_cache_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+_response_cache_lock = threading.Lock()
+
+def _response_store(conf):
+    """
+    Return the location of the database with API responses
+
+    param: conf: dictionary with configuration values
+    """
+    return os.path.join(_cache_directory(conf), 'api_responses_v{0}.sqlite'.format(CACHE_VERSION))
+
+def _response_key(conf, endpoint, params):
+    """
+    Return the cache key for an API request: the API base URL and endpoint with the query
+    parameters in sorted order
+
+    param: conf: dictionary with configuration values
+    param: endpoint: the API endpoint
+    param: params: dictionary with query parameters (or a string appended to the endpoint)
+    """
+    url = "{0}/{1}".format((conf.get('ADS_API_URL') or '').rstrip('/'), endpoint)
+    if isinstance(params, str):
+        return "{0}/{1}".format(url, params)
+    return "{0}?{1}".format(url, urllib.parse.urlencode(sorted(params.items()), doseq=True))
+
+def _count_response(stat, n=1):
+    """
+    Update the usage statistics of the response cache
+
+    param: stat: the statistic to update
+    param: n: the amount to add
+    """
+    with _response_cache_lock:
+        _response_cache_stats[stat] += n
+
+def _get_cached_response(conf, endpoint, params):
+    """
+    Return the cached response for an API request, if the cache (or offline mode) is enabled and
+    there is a response that has not expired. Returns None otherwise
+
+    param: conf: dictionary with configuration values
+    param: endpoint: the API endpoint
+    param: params: dictionary with query parameters (or a string appended to the endpoint)
+    """
+    offline = conf.get('API_OFFLINE', False)
+    if not conf.get('USE_API_CACHE', False) and not offline:
+        return None
+    store = _response_store(conf)
+    key = _response_key(conf, endpoint, params)
+    row = None
+    if os.path.exists(store):
+        try:
+            with closing(sqlite3.connect(store, timeout=30)) as db:
+                row = db.execute('SELECT created, body FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    ttl = conf.get('API_CACHE_TTL', {}).get(endpoint, conf.get('API_CACHE_DEFAULT_TTL', 3600))
+                    if not offline and time.time() - row[0] > ttl:
+                        row = None
+                    else:
+                        with _response_cache_lock, db:
+                            db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.Error as err:
+            logger.warning("Unable to load cached API response for {0}: {1}".format(key, err))
+            row = None
+    if row is None:
+        _count_response('misses')
+        return None
+    _count_response('hits')
+    return json.loads(row[1])
+
+def _store_cached_response(conf, endpoint, params, data):
+    """
+    Store the response for an API request in the cache (if enabled), and remove the least
+    recently used responses if the cache has become too large
+
+    param: conf: dictionary with configuration values
+    param: endpoint: the API endpoint
+    param: params: dictionary with query parameters (or a string appended to the endpoint)
+    param: data: the (decoded JSON) response
+    """
+    if not conf.get('USE_API_CACHE', False):
+        return
+    store = _response_store(conf)
+    key = _response_key(conf, endpoint, params)
+    body = json.dumps(data)
+    max_size = conf.get('API_CACHE_MAX_SIZE', 1024**3)
+    now = time.time()
+    try:
+        os.makedirs(os.path.dirname(store), exist_ok=True)
+        with _response_cache_lock, closing(sqlite3.connect(store, timeout=30)) as db:
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, '
+                           'created REAL, accessed REAL, size INTEGER, body TEXT)')
+                db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                           (key, endpoint, now, now, len(body), body))
+                _response_cache_stats['stores'] += 1
+                total = db.execute('SELECT SUM(size) FROM responses').fetchone()[0] or 0
+                if total > max_size:
+                    # Remove the least recently used responses until the cache is small enough
+                    evict = []
+                    for old_key, size in db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+                        if total <= max_size:
+                            break
+                        evict.append((old_key,))
+                        total -= size
+                    db.executemany('DELETE FROM responses WHERE key = ?', evict)
+                    _response_cache_stats['evictions'] += len(evict)
+    except sqlite3.Error as err:
+        logger.warning("Unable to cache API response for {0}: {1}".format(key, err))
+
+def _purge_cache(conf):
+    """
+    Remove all cached data
+
+    param: conf: dictionary with configuration values
+    """
+    cache_dir = _cache_directory(conf)
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+        logger.info("Removed cache directory {0}".format(cache_dir))
@@ -1,24 +1,105 @@
 import pandas as pd
 import os
 import sys
-import glob
 from xreport.utils import _get_facet_data
-from xreport.utils import _get_citations
+from xreport.utils import _get_query_counts
+from xreport.utils import _get_pivot_data
 from xreport.utils import _get_usage
-from xreport.utils import _get_records
-from xreport.utils import _get_journal_coverage
+from xreport.utils import _get_usage_for_query
+from xreport.utils import _iter_records
+from xreport.utils import _write_rows
+from xreport.utils import _write_coverage_grid
+from xreport.utils import _get_journal_completeness
+from xreport.utils import _get_fulltext_index
 from xreport.utils import _string2list
+from xreport.utils import _fetch_concurrent
+from xreport.utils import _scan_concurrent
+from xreport.utils import _update_reference_matching
+from xreport.utils import _get_reference_directory
+from xreport.utils import _profiled
+from xreport.utils import _memo_claim
+from xreport.utils import _memo_settle
+from xreport.utils import _memo_collect
+from xreport.cache import _load_reference_tallies
+from xreport.cache import _store_reference_tallies
 from datetime import datetime
 from datetime import date
-from operator import itemgetter
+
+class CollectionContext(object):
+    """
+    Data that all reports for a collection have in common: the publishers of the journals,
+    the publication data per journal (records per volume, first and last years and volumes)
+    and the volumes to skip. These are gathered by the first report made with the context,
+    and reused by all subsequent reports for the same collection (and set of journals)
+    """
+    # The entries in the statistics data structure that are shared between reports
+    SHARED_STATS = ['pubdata', 'startyear', 'lastyear', 'startvol', 'lastvol']
+
+    def __init__(self, memo=None):
+        """
+        Initializes the class
+
+        param: memo: dictionary with journal level data, shared with the contexts of other collections
+        """
+        self.key = None
+        self.data = {}
+        # Journal level data (e.g. the number of records per volume) retrieved for one collection,
+        # and reused for all other collections containing the same journal
+        self.memo = memo if memo is not None else {}
+
+    def matches(self, collection, journals):
+        """
+        Check whether the context holds the data for a collection
+        
+        param: collection: the collection
+        param: journals: the journals (bibstems) in the collection
+        """
+        return self.key == (collection, tuple(journals))
+
+    def save(self, report, collection):
+        """
+        Keep the shared data gathered by a report
+        
+        param: report: a report for which make_report has gathered the data
+        param: collection: the collection the report was made for
+        """
+        self.key = (collection, tuple(report.journals))
+        self.data = {
+            'stem2publisher': report.stem2publisher,
+            'publisher': dict(report.publisher),
+            'statsdata': {j: {k: report.statsdata[j][k] for k in self.SHARED_STATS} for j in report.journals},
+            'fetch_errors': {j: list(e) for j, e in report.fetch_errors.items()},
+            'skip_fulltext': report.skip_fulltext,
+            'skip_references': report.skip_references,
+            'skip_metadata': report.skip_metadata
+        }
+
+    def restore(self, report):
+        """
+        Provide a report with the shared data. Every report gets its own copies of the data
+        structures it can modify
+        
+        param: report: the report to provide with the data
+        """
+        report.stem2publisher = self.data['stem2publisher']
+        report.publisher = dict(self.data['publisher'])
+        for journal, stats in self.data['statsdata'].items():
+            report.statsdata[journal].update(stats)
+        report.fetch_errors = {j: list(e) for j, e in self.data['fetch_errors'].items()}
+        report.skip_fulltext = self.data['skip_fulltext']
+        report.skip_references = self.data['skip_references']
+        report.skip_metadata = self.data['skip_metadata']
 
 class Report(object):
     """
 
     """
-    def __init__(self, config={}):
+    def __init__(self, config={}, context=None):
         """
         Initializes the class
+
+        param: config: configuration values overriding the defaults
+        param: context: a CollectionContext shared with other reports for the same collection
         """
         # ============================= INITIALIZATION ==================================== #
         from adsputils import setup_logging, load_config
@@ -31,6 +112,7 @@ class Report(object):
                                 attach_stdout=self.config.get('LOG_STDOUT', False))
         # The names of output files will have a date string in them
         self.dstring = datetime.today().strftime('%Y%m%d')
+        self.context = context
     # ============================= MAIN FUNCTIONALITY ================================ #
     def make_report(self, collection, report_type):
         """
@@ -46,8 +128,11 @@ class Report(object):
             msg = "Unable to find journals for collection: {} (Exception: {})".format(collection, err)
             self.logger.error(msg)
             raise
+        # Data shared with other reports for the same collection may have been gathered already
+        shared = self.context is not None and self.context.matches(collection, self.journals)
         # Get a map from bibstem to publisher
-        self._get_publishers()
+        if not shared:
+            self._get_publishers()
         # Initialize statistics and publisher data structure
         self.statsdata = {}
         self.publisher = {}
@@ -63,7 +148,8 @@ class Report(object):
                 'publisher':{},
                 'crossref':{}
             }
-            self.publisher[journal] = self.stem2publisher.get(journal,'NA')
+            if not shared:
+                self.publisher[journal] = self.stem2publisher.get(journal,'NA')
         # Initialize summary data structure
         self.summarydata = {}
         for collection in self.config['COLLECTIONS']:
@@ -98,12 +184,20 @@ class Report(object):
         self.missing = {}
         for journal in self.journals:
             self.missing[journal] = []
+        if shared:
+            self.context.restore(self)
+            return
+        # Journals for which data retrieval failed (with the associated error)
+        self.fetch_errors = {}
         # Update statistics data structure with general publication information
         self._get_publication_data()
         # Record all journals/volumes for which full text, references or metadata coverage
         # needs to be skipped
         self._get_skip_volumes()
+        if self.context is not None:
+            self.context.save(self, collection)
 
+    @_profiled
     def save_report(self, collection, report_type, subject):
         """
         Save the data created in the make_report method in Excel format
@@ -114,9 +208,8 @@ class Report(object):
         """
         # Where will the report(s) be written to
         outdir = "{0}/{1}".format(self.config['OUTPUT_DIRECTORY'], report_type)
-        # Make sure the directory exists
-        if not os.path.exists(outdir):
-            os.mkdir(outdir)
+        # Make sure the directory exists (reports may be saved in parallel, see tasks.create_reports)
+        os.makedirs(outdir, exist_ok=True)
         # Transform the data generated in the make_report method:
         # generate a data structure so that we can create a Pandas frame
         header = []
@@ -127,40 +220,107 @@ class Report(object):
         header.append(['last year ->'] + [str(self.statsdata[j]['lastyear']) for j in self.journals])
         header.append(['start vol ->'] + [str(self.statsdata[j]['startvol']) for j in self.journals])
         header.append(['last vol ->'] + [str(self.statsdata[j]['lastvol']) for j in self.journals])
-        #
+        # The statistics are reported per volume (rows) for each journal in the collection (columns)
         maxvol = max([e['lastvol'] for e in self.statsdata.values()])
+        volumes = range(1, maxvol+1)
         if report_type == 'NASA':
-            outputdata = []
-            outputdata += header
-            # Generate the name of the output file, including full path
-            output_file = "{0}/{1}_{2}_{3}.xlsx".format(outdir, subject.lower(), collection, self.dstring)
-            # Statistics are reported per volume for each journal in the collection
-            for vol in range(1, maxvol+1):
-                row = [str(vol)]
-                for jrnl in self.journals:
-                    if vol in self.statsdata[jrnl]['general']:
-                        row.append(self.statsdata[jrnl]['general'][vol])
-                    else:
-                        row.append("")
-                outputdata.append(row)
-            output_frame = pd.DataFrame(outputdata)
-            # Results are written to an Excel file with conditional formatting and first row and column frozen
-            output_frame.style.applymap(self._highlight_cells).to_excel(output_file, engine='openpyxl', index=False, header=False, freeze_panes=(1,1))
+            outputs = [('general', "{0}/{1}_{2}_{3}.xlsx".format(outdir, subject.lower(), collection, self.dstring))]
         else:
-            # For internal reporting we generate two reports, corresponding with 
+            # For internal reporting we generate two reports, corresponding with
             # the sources associated with the type data in the report
-            # For each of these sources the processing is the same as above
-            for source in self.config['SOURCES'][subject]:
-                outputdata = []
-                outputdata += header
-                output_file = "{0}/{1}_{2}_{3}_{4}.xlsx".format(outdir, subject.lower(), source, collection, self.dstring)
-                for vol in range(1, maxvol+1):
-                    row = [str(vol)] + [self.statsdata[j][source].get(vol,"") for j in self.journals]
-                    outputdata.append(row)
-                if outputdata:
-                    output_frame = pd.DataFrame(outputdata)
-                    output_frame.style.applymap(self._highlight_cells).to_excel(output_file, engine='openpyxl', index=False, header=False, freeze_panes=(1,1))
+            outputs = [(source, "{0}/{1}_{2}_{3}_{4}.xlsx".format(outdir, subject.lower(), source, collection, self.dstring))
+                       for source in self.config['SOURCES'][subject]]
+        table = self._get_stats_table([metric for metric, output_file in outputs])
+        for metric, output_file in outputs:
+            frame = self._get_coverage_frame(table, metric, volumes)
+            # Volumes without data for a journal are reported as empty cells
+            rows = frame.astype(object).where(frame.notna(), "").values.tolist()
+            outputdata = header + [[str(vol)] + row for vol, row in zip(volumes, rows)]
+            # Results are written to an Excel file with cells colored by value and first row and column frozen
+            _write_coverage_grid(output_file, outputdata)
+
+    def _get_stats_table(self, metrics):
+        """
+        Turn the per volume statistics into one table, with a row for every journal,
+        volume and metric (e.g. 'general' or 'arxiv') with a value. Note that this is a
+        view built when a report is saved: the statistics themselves are gathered and
+        kept in the statsdata dictionary (which the collection context, the journal
+        exports of distributed reports and the tests rely on), so this does not reduce
+        the memory used by a report
+
+        param: metrics: the entries in the statistics data structure to include
+        """
+        journals, volumes, names, values = [], [], [], []
+        for journal in dict.fromkeys(self.journals):
+            for metric in metrics:
+                data = self.statsdata[journal][metric]
+                journals += [journal]*len(data)
+                names += [metric]*len(data)
+                volumes += list(data.keys())
+                values += list(data.values())
+        return pd.DataFrame({
+            'journal': pd.Categorical(journals, categories=list(dict.fromkeys(self.journals))),
+            'volume': pd.Series(volumes, dtype='int64'),
+            'metric': pd.Categorical(names, categories=metrics),
+            'value': pd.Series(values, dtype='float64')
+        })
+
+    def _get_coverage_frame(self, table, metric, volumes):
+        """
+        Get the values of one metric from a statistics table (see _get_stats_table) as a
+        frame with a row for every volume and a column for every journal, in order. Values
+        that are not available are NaN
+
+        param: table: the statistics table
+        param: metric: the metric to get the values for
+        param: volumes: the volumes to include
+        """
+        data = table[table['metric'] == metric]
+        frame = data.pivot(index='volume', columns='journal', values='value')
+        return frame.reindex(index=volumes, columns=self.journals)
+
+    def _export_journal(self, journal):
+        """
+        Return the data gathered by make_report for one journal, in a form that can be sent
+        between processes as JSON (see tasks.task_journal_report)
+
+        param: journal: the journal to return the data for
+        """
+        stats = {}
+        for key, value in self.statsdata[journal].items():
+            # Statistics per volume are sent as lists of (volume, value) pairs, because JSON
+            # object keys are always strings
+            stats[key] = [[k, v] for k, v in value.items()] if isinstance(value, dict) else value
+        return {
+            'statsdata': stats,
+            'publisher': self.publisher.get(journal, 'NA'),
+            'missing': [list(row) for row in self.missing.get(journal, [])],
+            'fetch_errors': self.fetch_errors.get(journal, [])
+        }
+
+    def _import_journals(self, journals, results):
+        """
+        Put together the data for a collection from the data for its journals (as returned
+        by _export_journal), so that the report can be saved
+
+        param: journals: the journals in the collection
+        param: results: the data for every journal, in the same order
+        """
+        self.journals = journals
+        self.statsdata = {}
+        self.publisher = {}
+        self.missing = {}
+        self.fetch_errors = {}
+        for journal, data in zip(journals, results):
+            self.statsdata[journal] = {k: {int(e[0]): e[1] for e in v} if isinstance(v, list) else v
+                                       for k, v in data['statsdata'].items()}
+            self.publisher[journal] = data['publisher']
+            self.missing[journal] = data['missing']
+            if data['fetch_errors']:
+                self.fetch_errors[journal] = data['fetch_errors']
+
     #
+    @_profiled
     def save_missing(self, collection, report_type, subject):
         """
         Save publication data for publications that are missing for a specific collection and subject
@@ -174,34 +334,44 @@ class Report(object):
         # Make sure the directory exists
         if not os.path.exists(outdir):
             os.makedirs(outdir, exist_ok=True)
-        # Transform the data generated in the make_report method:
-        # generate a data structure so that we can create a Pandas frame
-        header = []
-        # Add header rows
-        header.append(['bibcode','DOI','volume','issue','first author','title'])
+        header = ['bibcode','DOI','volume','issue','first author','title']
+        # Missing publications are saved as spreadsheet (xlsx) or as CSV file (csv)
+        output_format = self.config.get('MISSING_OUTPUT_FORMAT', 'xlsx')
         for journal in self.journals:
-            if len((self.missing[journal])) == 0:
+            rows = self.missing[journal]
+            if len(rows) == 0:
                 continue
             # Generate the name of the output file, including full path
-            output_file = "{0}/{1}_{2}_{3}.xlsx".format(outdir, subject.lower(), journal.replace('.','').strip(), self.dstring)
-            outputdata = []
-            outputdata += header
+            output_file = "{0}/{1}_{2}_{3}.{4}".format(outdir, subject.lower(), journal.replace('.','').strip(), self.dstring, output_format)
+            # The missing publications are kept as rows already (see _missing_row), and are sorted in place
             try:
-                entries = sorted(self.missing[journal], key=lambda x: int(itemgetter('volume')(x)))
+                rows.sort(key=lambda x: int(x[2]))
             except:
-                entries = self.missing[journal]
-            for entry in entries:
-                row = []
-                row.append(entry.get('bibcode','NA'))
-                row.append(entry.get('doi',['NA'])[0])
-                row.append(entry.get('volume','NA'))
-                row.append(entry.get('issue','NA'))
-                row.append(entry.get('first_author_norm','NA'))
-                row.append(entry.get('title',['NA'])[0])
-                outputdata.append(row)
-            if outputdata:
-                output_frame = pd.DataFrame(outputdata)
-                output_frame.to_excel(output_file, engine='openpyxl', index=False, header=False)
+                pass
+            _write_rows(output_file, header, rows)
+
+    def _missing_row(self, entry):
+        """
+        Turn a record for a missing publication into a row for the MISSING report
+        
+        param: entry: the record (as returned by Solr)
+        """
+        return (entry.get('bibcode','NA'), entry.get('doi',['NA'])[0], entry.get('volume','NA'),
+                entry.get('issue','NA'), entry.get('first_author_norm','NA'), entry.get('title',['NA'])[0])
+
+    def _get_missing_rows(self, query, prefetch=True):
+        """
+        Retrieve the records for missing publications, and return them as (compact) rows for the
+        MISSING report. Records are converted page by page, so that just the rows are kept, but
+        all rows for a journal are kept until the report is saved
+        
+        param: query: the query for the missing publications
+        param: prefetch: retrieve the next page of records while the current one is converted
+                         (if RECORDS_PREFETCH is set)
+        """
+        fields = 'bibcode,doi,title,first_author_norm,volume,issue'
+        conf = self.config if prefetch else dict(self.config, RECORDS_PREFETCH=False)
+        return [self._missing_row(entry) for entry in _iter_records(conf, query, fields)]
 
     def _get_publishers(self):
         """
@@ -216,18 +386,23 @@ class Report(object):
                     continue
                 self.stem2publisher[bibstem.replace('.','')] = pname
 
+    @_profiled
     def _get_publication_data(self):
         """
         For a set of journals, get some basic publication data
         
         """
+        # The number of records per volume and per year are retrieved for all journals at once
+        query = 'bibstem:{0} doctype:(article OR inproceedings)'
+        art_data, art_errors = self._get_collection_facets(query, 'volume')
+        year_data, year_errors = self._get_collection_facets(query, 'year')
+        self._record_fetch_errors(art_errors, 'publication data (volumes)')
+        self._record_fetch_errors(year_errors, 'publication data (years)')
         for journal in self.journals:
-            # First get the number of records per volume
-            query = 'bibstem:"{0}" doctype:(article OR inproceedings)'.format(journal)
-            # Get the data using a facet query
-            art_dict = _get_facet_data(self.config, query, 'volume')
-            # Also, get the number of records per year
-            year_dict = _get_facet_data(self.config, query, 'year')
+            if journal in self.fetch_errors:
+                continue
+            art_dict = art_data[journal]
+            year_dict = year_data[journal]
             # Update journal statistics
             # The first and most recent publication years
             try:
@@ -244,6 +419,92 @@ class Report(object):
             # The number of publications per volume, to be used later
             # for normalization
             self.statsdata[journal]['pubdata'] = art_dict
+
+    def _get_collection_facets(self, query, facet):
+        """
+        For all journals in the collection, get the frequencies of a facet (e.g. the number
+        of records per volume). Journals are grouped in chunks, and data is retrieved for each
+        chunk with one pivot query on bibstem and the facet. Journals for which the pivot query
+        cannot give complete results are queried individually with a facet query.
+        
+        param: query: query string with a placeholder for the bibstem(s)
+        param: facet: the facet to return
+        """
+        # Journals for which the data have been retrieved (or are being retrieved) for another
+        # collection are not queried again
+        memo = self.context.memo if self.context is not None else {}
+        futures, claimed = _memo_claim(memo, [(query, facet, j) for j in self.journals])
+        journals = [j for j in self.journals if (query, facet, j) in claimed]
+        results = {}
+        errors = {}
+        try:
+            self._get_journal_facets(query, facet, journals, results, errors)
+        finally:
+            _memo_settle(memo, claimed, {(query, facet, j): v for j, v in results.items()},
+                         {(query, facet, j): e for j, e in errors.items()})
+        results, errors = _memo_collect(futures)
+        return {key[2]: v for key, v in results.items()}, {key[2]: e for key, e in errors.items()}
+
+    def _get_journal_facets(self, query, facet, journals, results, errors):
+        """
+        Get the frequencies of a facet for a set of journals (see _get_collection_facets)
+        
+        param: query: query string with a placeholder for the bibstem(s)
+        param: facet: the facet to return
+        param: journals: the journals (bibstems)
+        param: results: dictionary to store the frequencies in, keyed on journal
+        param: errors: dictionary to store exceptions in, keyed on journal
+        """
+        chunk_size = self.config.get('PIVOT_CHUNK_SIZE', 1)
+        limit = self.config.get('PIVOT_FACET_LIMIT', 1000)
+        single = list(journals)
+        if chunk_size > 1:
+            single = []
+            jobs = {}
+            for i in range(0, len(journals), chunk_size):
+                chunk = tuple(journals[i:i+chunk_size])
+                bibstems = '({0})'.format(" OR ".join(['"{0}"'.format(j) for j in chunk]))
+                jobs[chunk] = (_get_pivot_data, (self.config, query.format(bibstems), 'bibstem,{0}'.format(facet), limit))
+            pivot_results, pivot_errors = _fetch_concurrent(self.config, jobs)
+            for chunk in jobs.keys():
+                if chunk in pivot_errors:
+                    self.logger.info("Pivot query for {0} failed ({1}). Falling back to facet queries for: {2}".format(facet, pivot_errors[chunk], ", ".join(chunk)))
+                    single += list(chunk)
+                    continue
+                data = pivot_results[chunk]
+                # If the number of bibstems hit the limit, journals missing from the results
+                # may just have been cut off. Otherwise they should have no records, but since
+                # that may also point at a problem (e.g. a misspelled bibstem), they are checked
+                complete = len(data) < limit
+                for journal in chunk:
+                    if data.get(journal) is not None:
+                        results[journal] = data[journal]
+                        continue
+                    if journal not in data and complete:
+                        self.logger.warning("Journal {0} is missing from the {1} pivot results. Falling back to a facet query".format(journal, facet))
+                    single.append(journal)
+        # Whatever could not be retrieved via pivot queries (e.g. because the pivot for a journal
+        # may have been truncated), is retrieved per journal, with a limit at least as high
+        single_limit = max(self.config.get('FACET_LIMIT', limit), limit)
+        jobs = {}
+        for journal in single:
+            jobs[journal] = (_get_facet_data, (self.config, query.format('"{0}"'.format(journal)), facet, single_limit))
+        facet_results, facet_errors = _fetch_concurrent(self.config, jobs)
+        results.update(facet_results)
+        errors.update(facet_errors)
+
+    def _record_fetch_errors(self, errors, description):
+        """
+        Log and keep track of the journals for which data retrieval failed
+        
+        param: errors: dictionary of exceptions keyed on journal, or on (journal, ...) tuples
+        param: description: description of the data that was being retrieved
+        """
+        for key, err in errors.items():
+            journal = key[0] if isinstance(key, tuple) else key
+            msg = "Failed to retrieve {0} for journal {1}: {2}".format(description, journal, err)
+            self.logger.error(msg)
+            self.fetch_errors.setdefault(journal, []).append(msg)
     #
     def _get_skip_volumes(self):
         """
@@ -274,69 +535,45 @@ class Report(object):
                 self.skip_fulltext[jrnl] = _string2list(no_fulltext.get(jrnl,'0'))
         except:
             pass
-        
-    def _highlight_cells(self, val):
-        """
-        Mapping function for use in Pandas to apply conditional cell coloring
-        when writing data to Excel
-        """
-        try:
-            if val >= 90:
-                color = '#6aa84f'
-            elif val <= 60:
-                color = '#f4cccc'
-            elif val > 60 and val <=70:
-                color = '#ffe599'
-            else:
-                color = '#cfe2f3'
-        except:
-            color = '#ffffff'
-        return 'background-color: {}'.format(color)
 
 class FullTextReport(Report):
     """
     Main engine for gathering and processing data to create
     the full text coverage report 
     """
-    def __init__(self, config={}):
+    def __init__(self, config={}, context=None):
         """
-        Initializes the class and prepares a (temporary) lookup facility for
-        curators reporting. This lookup facility will be replaced by an API
-        query eventually
+        Initializes the class. The (temporary) lookup facility for curators reporting
+        is only prepared when it is needed (see ft_index). This lookup facility will be
+        replaced by an API query eventually
         """
-        super(FullTextReport, self).__init__(config=config)
+        super(FullTextReport, self).__init__(config=config, context=context)
         # ============================= AUGMENTATION of parent method ================================ #
-        fulltext_links = self.config.get("CLASSIC_FULLTEXT_INDEX")
-        # Compile a list of journals to generate the lookup facility for
-        include = [element for sublist in self.config.get("JOURNALS").values() for element in sublist]
-        # This variable will hold the data to generate the Pandas frame
-        data = []
-        # Gather all required data. The Pandas data frame will allow the following query:
-        # provide all full text sources for a given journal and volume combination, from which will
-        # follow how many records have full text from arXiv and how many from the publisher (which
-        # are the numbers we are after)
-        with open(fulltext_links) as fh:
-            for line in fh:
-                bibcode, ftfile, source = line.strip().split('\t')
-                bibstem = bibcode[4:9]
-                if bibstem not in include:
-                    continue
-                # Since we report per journal volume, we do not want tmp bibcodes
-                if bibcode[9:13].replace('.','') == 'tmp':
-                    continue
-                try:
-                    volume  = int(bibcode[9:13].replace('.',''))
-                except:
-                    self.logger.info("Processing Classic fulltext index. Cannot get volume for: {0}. Skipping...".format(bibcode))
-                    continue
-                if bibstem in self.config.get("YEAR_IS_VOL"):
-                    volume = int(bibcode[0:4])
-                letter  = bibcode[13]
-                if bibstem == 'ApJ..' and letter == 'L':
-                    bibstem = 'ApJL'
-                data.append([bibstem, volume, source.lower()])
-        # The lookup facility is a Pandas dataframe
-        self.ft_index = pd.DataFrame(data, columns=['bibstem','volume','source'])
+        self._ft_index = None
+        self._ft_index_journals = None
+        self.ft_counts = None
+
+    @property
+    def ft_index(self):
+        """
+        The lookup facility for curators reporting: a Pandas dataframe that allows the following
+        query: provide all full text sources for a given journal and volume combination, from which
+        will follow how many records have full text from arXiv and how many from the publisher (which
+        are the numbers we are after). It is built from the Classic full text index on first use,
+        for just the journals of the collection being reported (or for the journals of all
+        collections, before a report has been made), unless FULLTEXT_INDEX_JOURNALS specifies
+        the journals
+        """
+        journals = self.config.get('FULLTEXT_INDEX_JOURNALS') or getattr(self, 'journals', None)
+        if not journals:
+            journals = [element for sublist in self.config.get("JOURNALS").values() for element in sublist]
+        journals = sorted(set(journals))
+        if self._ft_index is None or self._ft_index_journals != journals:
+            self._ft_index = _get_fulltext_index(self.config, journals)
+            self._ft_index_journals = journals
+            # Any aggregated data was for another set of journals
+            self.ft_counts = None
+        return self._ft_index
 
     def make_report(self, collection, report_type):
         """
@@ -365,22 +602,27 @@ class FullTextReport(Report):
         """
         super(FullTextReport, self).save_report(collection, report_type, subject)
 
+    @_profiled
     def _get_fulltext_data_general(self):
         """
         For a set of journals, get full text data (the number of records with full text per volume)
 
         """
+        # The ADS query to retrieve all records with full text for a given journal
+        # Filters:
+        # fulltext_mtime --> get all records with full text indexed
+        # doctype:article --> remove all records indexed as non-articles
+        # author_count:[1 TO *] --> not a good idea (because some historical publications don't have an author)
+        # entdate:[* TO NOW-40DAYS] --> not a good idea in case records get re-indexed
+        query = 'bibstem:{0} fulltext_mtime:["1000-01-01t00:00:00.000Z" TO *] doctype:(article OR inproceedings)'
+        # The query populates a dictionary keyed on volume number, listing the number of records per volume
+        results, errors = self._get_collection_facets(query, 'volume')
+        self._record_fetch_errors(errors, 'full text data')
         # Determine if certain volumes need to be skipped:
         for journal in self.journals:
-            # The ADS query to retrieve all records with full text for a given journal
-            # Filters:
-            # fulltext_mtime --> get all records with full text indexed
-            # doctype:article --> remove all records indexed as non-articles
-            # author_count:[1 TO *] --> not a good idea (because some historical publications don't have an author)
-            # entdate:[* TO NOW-40DAYS] --> not a good idea in case records get re-indexed
-            query = 'bibstem:"{0}" fulltext_mtime:["1000-01-01t00:00:00.000Z" TO *] doctype:(article OR inproceedings)'.format(journal)
-            # The query populates a dictionary keyed on volume number, listing the number of records per volume
-            full_dict = _get_facet_data(self.config, query, 'volume')
+            if journal in errors:
+                continue
+            full_dict = results[journal]
             # Coverage data is stored in a dictionary
             cov_dict = {}
             # Collect volumes to be skipped, if any
@@ -401,6 +643,7 @@ class FullTextReport(Report):
             # Update the global statistics data structure
             self.statsdata[journal]['general'] = cov_dict
 
+    @_profiled
     def _get_fulltext_data_classic(self, ft_source):
         """
         For a set of journals, get full text data from Classic
@@ -408,6 +651,9 @@ class FullTextReport(Report):
         
         param: source: source of fulltext
         """
+        # The number of records with full text per journal, volume and source (arXiv or not)
+        ft_counts = self._get_fulltext_counts()
+        is_arxiv = ft_source == 'arxiv'
         for journal in self.journals:
             # Coverage data is stored in a dictionary
             cov_dict = {}
@@ -416,37 +662,53 @@ class FullTextReport(Report):
                 skip = self.skip_fulltext[journal]
             except:
                 skip = []
-            for volume in sorted(self.statsdata[journal]['pubdata'].keys()):
-                if volume in skip:
-                    continue
-                # For each volume of the journals in the collection we query the Pandas dataframe to retrieve the sources of full text
-                if ft_source == 'arxiv':
-                    # How many records are there with full text from arXiv?
-                    data = self.ft_index.query("bibstem=='{0}' and volume=={1} and source=='arxiv'".format(journal, volume))
-                else:
-                    data = self.ft_index.query("bibstem=='{0}' and volume=={1} and source!='arxiv'".format(journal, volume))
-                try:
-                    sources = data['source'].tolist()
-                except Exception as err:
-                    self.logger.error('Source lookup in Classic index blew up for journal {0}, volume {1}: {2}'.format(journal, volume, err))
-                    sources = []
-                try:
-                    frac = 100*float(len(sources))/float(self.statsdata[journal]['pubdata'][volume])
-                except:
-                    frac = 0.0
+            pubdata = pd.Series(self.statsdata[journal]['pubdata'], dtype='float64').sort_index()
+            pubdata = pubdata[~pubdata.index.isin(skip)]
+            # How many records are there with full text from this source, for every volume of the journal?
+            try:
+                ftdata = ft_counts.xs((journal, is_arxiv), level=['bibstem', 'is_arxiv'])
+            except KeyError:
+                ftdata = pd.Series(dtype='float64')
+            except Exception as err:
+                self.logger.error('Source lookup in Classic index blew up for journal {0}: {1}'.format(journal, err))
+                ftdata = pd.Series(dtype='float64')
+            ftdata = ftdata.reindex(pubdata.index, fill_value=0)
+            fracs = (100*ftdata/pubdata).replace([float('inf'), -float('inf')], float('nan')).fillna(0.0)
+            for volume, frac in fracs.items():
+                volume = int(volume)
                 if journal in self.config.get("YEAR_IS_VOL"):
                     volume = volume - self.config.get("YEAR_IS_VOL")[journal] + 1
-                cov_dict[volume] = round(frac,1)
+                cov_dict[volume] = round(float(frac),1)
             self.statsdata[journal][ft_source] = cov_dict
 
+    def _get_fulltext_counts(self):
+        """
+        Aggregate the Classic full text index into the number of records with full text
+        per journal, volume and source (arXiv or not). This is done once, so that coverage
+        for all volumes of a journal can be determined without scanning the index again
+        """
+        ft_index = self.ft_index
+        if getattr(self, 'ft_counts', None) is None:
+            is_arxiv = (ft_index['source'] == 'arxiv').rename('is_arxiv')
+            self.ft_counts = ft_index.groupby([ft_index['bibstem'], ft_index['volume'], is_arxiv], observed=True).size()
+        return self.ft_counts
+
+    @_profiled
     def _get_missing_publications(self):
         """
         For a set of journals, find the publications without fulltext
         """
+        # When journals are retrieved concurrently, requests already overlap, and prefetching
+        # pages would double the number of requests in flight
+        prefetch = self.config.get('MAX_API_CONCURRENCY', 1) <= 1 or len(self.journals) <= 1
+        jobs = {}
         for journal in self.journals:
             # The ADS query to retrieve all records without full text for a given journal
             query = 'bibstem:"{0}"  -fulltext_mtime:["1000-01-01t00:00:00.000Z" TO *] doctype:(article OR inproceedings)'.format(journal)
-            missing_pubs = _get_records(self.config, query, 'bibcode,doi,title,first_author_norm,volume,issue')
+            jobs[journal] = (self._get_missing_rows, (query, prefetch))
+        results, errors = _fetch_concurrent(self.config, jobs)
+        self._record_fetch_errors(errors, 'missing publications')
+        for journal, missing_pubs in results.items():
             self.missing[journal] = missing_pubs
 
 class ReferenceMatchingReport(Report):
@@ -458,11 +720,11 @@ class ReferenceMatchingReport(Report):
 	containing all the raw reference data; then the time has come
 	to revisit this reporting module.
     """
-    def __init__(self, config={}):
+    def __init__(self, config={}, context=None):
         """
         Initializes the class
         """
-        super(ReferenceMatchingReport, self).__init__(config=config)
+        super(ReferenceMatchingReport, self).__init__(config=config, context=context)
         #
     def make_report(self, collection, report_type):
         """
@@ -473,10 +735,10 @@ class ReferenceMatchingReport(Report):
         # ============================= AUGMENTATION of parent method ================================ #
         # Different report types result in different reports.
         if report_type == "NASA":
-            self._get_reference_data('general')
+            self._get_reference_data(['general'])
         elif report_type == "CURATORS":
-            self._get_reference_data('publisher')
-            self._get_reference_data('crossref')
+            # Publisher and Crossref statistics come from the same scan of the reference data
+            self._get_reference_data(['publisher', 'crossref'])
         else:
             sys.stderr.write('Report type {0} is currently not available for references\n'.format(report_type))
 
@@ -490,93 +752,72 @@ class ReferenceMatchingReport(Report):
         """
         super(ReferenceMatchingReport, self).save_report(collection, report_type, subject)
 
-    def _get_reference_data(self, rtype):
+    @_profiled
+    def _get_reference_data(self, rtypes):
         """
-        For a set of journals, get reference matching statistics
+        For a set of journals, get reference matching statistics. The volumes of all journals
+        are scanned in parallel (in REFERENCE_SCAN_WORKERS processes), and the results are
+        combined per journal in order of volume. Each volume is scanned once, for all sources.
+        Tallies are stored, so that in subsequent runs only volumes whose results files changed
+        need to be read again
         
-        param: rtype: determines whether Crossref reference data should be included
+        param: rtypes: the types of statistics to get: 'general' (all reference data), or
+                       per source ('publisher' and/or 'crossref')
         """
+        basedir = self.config['ADS_REFERENCE_DATA']
+        known = _load_reference_tallies(self.config)
+        jobs = {}
         for journal in self.journals:
-            cov_dict = {}
-            matched = unmatched = 0
-            # For each volume of the journals in the collection we retrieve that reference matching level
             for volume in sorted(self.statsdata[journal]['pubdata'].keys()):
-                try:
-                    ok, fail = self._process_one_volume(journal, volume, rtype)
-                except:
-                    ok = fail = 0
-                matched += ok
-                unmatched += fail
-                try:
-                    frac = 100*float(matched)/float(unmatched+matched)
-                except:
-                    frac = 0.0
-                if journal in self.config.get("YEAR_IS_VOL"):
-                    volume = volume - self.config.get("YEAR_IS_VOL")[journal] + 1
-                cov_dict[volume] = round(frac,1)
-            self.statsdata[journal][rtype] = cov_dict
-
-    def _process_one_volume(self, jrnl, volno, source):
-        """
-        For a particular volume of a given journal, find the results files generated
-        by the reference resolver and tally how many references were successfully and
-        not successfully matched to ADS records
-        
-        param: jrnl: bibstem
-        param: volno: journal volume number
-        param: source: source of reference data
-        """
-        # Root directory for reference data
-        basedir = self.config['ADS_REFERENCE_DATA']
-        # Transform journal bibstem to conform with reference data conventions
-        jrnl = jrnl.replace('.','').replace('&','+')
-        # Transform volume number to conform with reference data conventions
-        vol = str(volno).zfill(4)
-        # Some idiosyncracies for A&A reference data
-        if jrnl == 'A+A' and int(vol) < 317:
-            jrnl = 'A&A'
-        if jrnl == 'A+AS' and int(vol) < 121:
-            jrnl = 'A&AS'
-        # Where are reference data located?
-        voldir = "%s/%s/%s" % (basedir,jrnl,vol)
-        # Special treatment for ApJL
-        if jrnl == 'ApJL' and (int(vol) > 888 or int(vol) < 474):
-           voldir = "%s/ApJ/%s" % (basedir, vol)
-           resfiles = [f for f in glob.glob(voldir+'/*' + '.result') if os.path.basename(f)[13] == 'L']
-        else:
-           resfiles = glob.glob(voldir+'/*' + '.result')
-        if source == 'publisher':
-            resfiles = [f for f in resfiles if not f.endswith('.xref.xml.result')]
-        elif source == 'crossref':
-            resfiles = [f for f in resfiles if f.endswith('.xref.xml.result')]
-        fail = ok =  0
-        # Now go through all the resolver results files
-        # Every entry in the results files has a score of 0 or 5, if no match was found,
-        # or 1, if a match was found successfully
-        for resfile in resfiles:
-            with open(resfile) as refdata:
-                for line in refdata:
-                        try:
-                            score = str(line.strip()[0])
-                        except:
-                            continue
-                        if score in ['0','5']:
-                            fail += 1
-                        elif score == '1':
-                            ok += 1
-                        else:
-                            continue
-        return [ok, fail]
+                voldir = _get_reference_directory(basedir, journal, volume)
+                jobs[(journal, volume)] = (_update_reference_matching, (basedir, journal, volume, known.get(voldir)))
+        scans, errors = _scan_concurrent(self.config, jobs)
+        # Coverage is cumulative over volumes, so journals for which a volume could not be
+        # scanned are left out. Tallies are only stored for volumes that were scanned successfully
+        self._record_fetch_errors(errors, 'reference data')
+        failed = set([journal for (journal, volume) in errors.keys()])
+        results = {}
+        updates = {}
+        for (journal, volume), (signature, tallies) in scans.items():
+            results[(journal, volume)] = tallies
+            voldir = _get_reference_directory(basedir, journal, volume)
+            if known.get(voldir, (None,))[0] != signature:
+                updates[voldir] = (signature, tallies)
+        _store_reference_tallies(self.config, updates)
+        for rtype in rtypes:
+            for journal in self.journals:
+                if journal in failed:
+                    continue
+                cov_dict = {}
+                matched = unmatched = 0
+                # For each volume of the journals in the collection we retrieve that reference matching level
+                for volume in sorted(self.statsdata[journal]['pubdata'].keys()):
+                    tallies = results.get((journal, volume), {})
+                    if rtype == 'general':
+                        ok = sum([t[0] for t in tallies.values()])
+                        fail = sum([t[1] for t in tallies.values()])
+                    else:
+                        ok, fail = tallies.get(rtype, (0, 0))
+                    matched += ok
+                    unmatched += fail
+                    try:
+                        frac = 100*float(matched)/float(unmatched+matched)
+                    except:
+                        frac = 0.0
+                    if journal in self.config.get("YEAR_IS_VOL"):
+                        volume = volume - self.config.get("YEAR_IS_VOL")[journal] + 1
+                    cov_dict[volume] = round(frac,1)
+                self.statsdata[journal][rtype] = cov_dict
 
 class MetaDataReport(Report):
     """
     Create metadata completeness report 
     """
-    def __init__(self, config={}):
+    def __init__(self, config={}, context=None):
         """
         Initializes the class
         """
-        super(MetaDataReport, self).__init__(config=config)
+        super(MetaDataReport, self).__init__(config=config, context=context)
 
     def make_report(self, collection, report_type):
         """
@@ -597,46 +838,48 @@ class MetaDataReport(Report):
         """
         super(MetaDataReport, self).save_report(collection, report_type, subject)
 
+    @_profiled
     def _get_metadata_data(self):
         """
         For a set of journals, get coverage data from the Journals Database
 
         """
-        # Determine if certain volumes need to be skipped:
+        # ApJL volumes are listed with those of ApJ, with an 'L' appended to the volume
+        stems = {journal: 'ApJ' if journal == 'ApJL' else journal for journal in self.journals}
+        # The completeness data for all journals are retrieved concurrently (once per bibstem,
+        # and only if they have not been retrieved for another collection already)
+        memo = self.context.memo if self.context is not None else {}
+        futures, claimed = _memo_claim(memo, [('completeness', stem) for stem in dict.fromkeys(stems.values())])
+        jobs = {key: (_get_journal_completeness, (self.config, key[1])) for key in claimed}
+        results = errors = {}
+        try:
+            results, errors = _fetch_concurrent(self.config, jobs)
+        finally:
+            _memo_settle(memo, claimed, results, errors)
+        results, errors = _memo_collect(futures)
+        results = {key[1]: v for key, v in results.items()}
+        errors = {key[1]: e for key, e in errors.items()}
+        self._record_fetch_errors({j: errors[s] for j, s in stems.items() if s in errors}, 'metadata completeness data')
         for journal in self.journals:
-            # The query populates a dictionary keyed on volume number, listing the number of records per volume
-            letter = False
-            if journal == 'ApJL':
-                cov_data = _get_journal_coverage(self.config, 'ApJ')
-                letter = True
-            else:
-                cov_data = _get_journal_coverage(self.config, journal)
-            cov_dict = {}
-            jdata = {}
-            try:
-                cdata = eval(cov_data['summary']['master'].get('completeness_details',[]))
-            except:
-                cdata = {}
-            # Get the completeness stats from the results
-            for entry in cdata:
-                jdata[entry['volume']] = round(100*entry['completeness_fraction'], 1)
-            for volume in sorted(self.statsdata[journal]['pubdata'].keys()):
-                if letter:
-                    cov_dict[volume] = jdata.get(str(volume)+"L",0)
-                else:
-                    cov_dict[volume] = jdata.get(str(volume),0)
+            stem = stems[journal]
+            if stem in errors:
+                continue
+            suffix = 'L' if journal == 'ApJL' else ''
+            volumes = sorted(self.statsdata[journal]['pubdata'].keys())
+            # Volumes without completeness data have a completeness of 0
+            completeness = results[stem].reindex([str(v) + suffix for v in volumes]).fillna(0)
             # Coverage data is stored in a dictionary
-            self.statsdata[journal]['general'] = cov_dict
+            self.statsdata[journal]['general'] = dict(zip(volumes, completeness.tolist()))
 
 class SummaryReport(Report):
     """
     Create summary report for a specific target audience
     """
-    def __init__(self, config={}):
+    def __init__(self, config={}, context=None):
         """
         Initializes the class
         """
-        super(SummaryReport, self).__init__(config=config)
+        super(SummaryReport, self).__init__(config=config, context=context)
 
     def make_report(self, collection, report_type):
         """
@@ -648,6 +891,7 @@ class SummaryReport(Report):
         # ============================= AUGMENTATION of parent method ================================ #
         self._get_summary_stats(report_type)
 
+    @_profiled
     def save_report(self, collection, report_type, subject):
         """
         Save the data created in the make_report method in Excel format
@@ -658,9 +902,8 @@ class SummaryReport(Report):
         """
         # Where will the report(s) be written to
         outdir = "{0}/{1}".format(self.config['OUTPUT_DIRECTORY'], report_type)
-        # Make sure the directory exists
-        if not os.path.exists(outdir):
-            os.mkdir(outdir)
+        # Make sure the directory exists (reports may be saved in parallel, see tasks.create_reports)
+        os.makedirs(outdir, exist_ok=True)
         # Transform the data generated in the make_report method:
         # generate a data structure so that we can create a Pandas frame
         header = []
@@ -690,108 +933,106 @@ class SummaryReport(Report):
             # Results are written to an Excel file with conditional formatting and first row and column frozen
             output_frame.style.to_excel(output_file, engine='openpyxl', index=False, header=False, freeze_panes=(1,1))
 
+    @_profiled
     def _get_summary_stats(self, report_type):
         """
         For a set of journals, get some basic publication data
         
         param: report_type: specification of report type
         """
-        today = date.today()
+        # The queries for all collections and content queries are planned first, and then
+        # executed concurrently. For each query, the numbers of records with full text, that
+        # are Open Access, have data links or are refereed (as facet queries) and the total
+        # number of citations (via the stats component) are retrieved in the same API request
+        # as the total number of records
+        plan = self._plan_summary_queries()
+        jobs = {}
+        for label, (query, facet_queries) in plan.items():
+            # Identical queries (for different collections) are only executed once
+            counts_key = ('counts', query, tuple(facet_queries.items()))
+            jobs[counts_key] = (_get_query_counts, (self.config, query, facet_queries, True))
+            # The number of recent citations (i.e. current year)
+            recent = 'citations({0}) year:{1}'.format(query, date.today().year)
+            jobs[('recent_citnum', query)] = (_get_query_counts, (self.config, recent))
+        results, errors = _fetch_concurrent(self.config, jobs)
+        for key, err in errors.items():
+            msg = "Failed to retrieve summary data ({0}) for query {1}: {2}".format(key[0], key[1], err)
+            self.logger.error(msg)
+        if errors:
+            raise list(errors.values())[0]
+        for label, (query, facet_queries) in plan.items():
+            nrecs, counts = results[('counts', query, tuple(facet_queries.items()))]
+            self.summarydata[label]['nrecs'] = nrecs
+            self.summarydata[label].update(counts)
+            self.summarydata[label]['recent_citnum'] = results[('recent_citnum', query)][0]
+        for collection in self.config['COLLECTIONS']:
+            if collection == 'CORE' or collection in self.config['SKIP_USAGE']:
+                continue
+            # Get usage numbers (via Classic index files), first reads, then downloads
+            # (each usage file is aggregated per journal once, and then reused for all collections)
+            # For collections with a filter, only part of the journal content counts, so usage is
+            # looked up for the bibcodes of the records in the collection
+            journals = self.config['JOURNALS'][collection]
+            if self.config['COLLECTION_FILTERS'].get(collection, None):
+                usage = _get_usage_for_query(self.config, plan[collection][0])
+                reads, recent_reads = usage['reads']
+                downl, recent_downl = usage['downloads']
+            else:
+                reads, recent_reads = _get_usage(self.config, jrnls=journals)
+                downl, recent_downl = _get_usage(self.config, jrnls=journals, udata='downloads')
+            self.summarydata[collection]['reads'] = reads
+            self.summarydata[collection]['recent_reads'] = recent_reads
+            self.summarydata[collection]['downloads'] = downl
+            self.summarydata[collection]['recent_downloads'] = recent_downl
+        for collection in self.config['CONTENT_QUERIES'].keys():
+            if collection in self.config['SKIP_USAGE']:
+                continue
+            # Get usage numbers, by looking up the usage for the bibcodes of all records in the sample
+            label = "{0} recent sample".format(collection)
+            usage = _get_usage_for_query(self.config, plan[label][0])
+            self.summarydata[label]['reads'], self.summarydata[label]['recent_reads'] = usage['reads']
+            self.summarydata[label]['downloads'], self.summarydata[label]['recent_downloads'] = usage['downloads']
+
+    def _plan_summary_queries(self):
+        """
+        Determine the queries for the summary statistics: for every collection and every
+        "content query", the query for all its records and the facet queries for the
+        records with full text, Open Access records, records with data links and refereed
+        records, keyed on the label in the summary data
+        """
+        doctypes = 'doctype:(article OR inproceedings)'
+        filters = {
+            'ftrecs': 'fulltext_mtime:["1000-01-01t00:00:00.000Z" TO *]',
+            'oarecs': 'property:openaccess',
+            'dlrecs': 'property:data',
+            'refrecs': 'property:refereed'
+        }
+        plan = {}
         for collection in self.config['COLLECTIONS']:
             if collection == 'CORE':
                 continue
             # Retrieve the journals for the collection being processed
             journals = self.config['JOURNALS'][collection]
             # Construct the query to retrieve all records for these journals
-            query = 'bibstem:({0}) doctype:(article OR inproceedings)'.format(" OR ".join(journals))
+            query = 'bibstem:({0}) {1}'.format(" OR ".join(journals), doctypes)
             # Do we have an special filter for this collection?
             cfilter = self.config['COLLECTION_FILTERS'].get(collection, None)
             if cfilter:
                 query += " {0}".format(cfilter)
-            # Get the total number of citations (via pivot query)
-            citnum = _get_citations(self.config, query)
-            self.summarydata[collection]['citnum'] = citnum
-            # Get the number of recent citations (i.e. current year) via facet query
-            q = 'citations({0}) year:{1}'.format(query, today.year)
-            results = _get_facet_data(self.config, q, 'year')
-            self.summarydata[collection]['recent_citnum'] = results.get(today.year,0)
-            # Get usage numbers (via Classic index files), first reads, then downloads
-            if collection not in self.config['SKIP_USAGE']:
-                reads, recent_reads = _get_usage(self.config, jrnls=journals)
-                self.summarydata[collection]['reads'] = reads
-                self.summarydata[collection]['recent_reads'] = recent_reads
-                downl, recent_downl = _get_usage(self.config, jrnls=journals, udata='downloads')
-                self.summarydata[collection]['downloads'] = downl
-                self.summarydata[collection]['recent_downloads'] = recent_downl
-            # Get the total number of records via facet query on publication year
-            results = _get_facet_data(self.config, query, 'year')
-            self.summarydata[collection]['nrecs'] = sum(results.values())
-            # How many of these records have full text associated with them
-            query = 'bibstem:({0}) fulltext_mtime:["1000-01-01t00:00:00.000Z" TO *] doctype:(article OR inproceedings)'.format(" OR ".join(journals))
-            if cfilter:
-                query += " {0}".format(cfilter)
-            results = _get_facet_data(self.config, query, 'year')
-            self.summarydata[collection]['ftrecs'] = sum(results.values())
-            # How many of these records are Open Access
-            query = 'bibstem:({0}) property:openaccess doctype:(article OR inproceedings)'.format(" OR ".join(journals))
-            if cfilter:
-                query += " {0}".format(cfilter)
-            results = _get_facet_data(self.config, query, 'year')
-            self.summarydata[collection]['oarecs'] = sum(results.values())
-            # How many of these records have at least one data link
-            query = 'bibstem:({0}) property:data doctype:(article OR inproceedings)'.format(" OR ".join(journals))
-            if cfilter:
-                query += " {0}".format(cfilter)
-            results = _get_facet_data(self.config, query, 'year')
-            self.summarydata[collection]['dlrecs'] = sum(results.values())
-            # How many of these records are refereed
-            query = 'bibstem:({0}) property:refereed doctype:(article OR inproceedings)'.format(" OR ".join(journals))
-            if cfilter:
-                query += " {0}".format(cfilter)
-            results = _get_facet_data(self.config, query, 'year')
-            self.summarydata[collection]['refrecs'] = sum(results.values())
+            plan[collection] = (query, dict(filters))
         for collection in self.config['CONTENT_QUERIES'].keys():
             # Do the same as above for "content queries". These queries are supposed to retrieve
             # sets of recent records representative for each collection, but going beyond just the
             # journals
             journals = self.config['JOURNALS'][collection]
             label = "{0} recent sample".format(collection)
-            jq = 'bibstem:({0}) doctype:(article OR inproceedings)'.format(" OR ".join(journals))
+            jq = 'bibstem:({0}) {1}'.format(" OR ".join(journals), doctypes)
             # Do we have an special filter for this collection?
             cfilter = self.config['COLLECTION_FILTERS'].get(collection, None)
             if cfilter:
                 jq += " {0}".format(cfilter)
             cq = "({0} OR references({1}) OR citations({2}))".format(jq, jq, jq)
             query = self.config['CONTENT_QUERIES'][collection].format(cq)
-            # Get the citation numbers
-            citnum = _get_citations(self.config, query)
-            self.summarydata[label]['citnum'] = citnum
-            q = "citations({0}) year:{1}".format(query, today.year)
-            results = _get_facet_data(self.config, q, 'year')
-            self.summarydata[label]['recent_citnum'] = results.get(today.year,0)
-            # Get usage numbers
-            # Currently there is no efficient way to retrieve usage data for large sets
-            # of individual records
-            self.summarydata[label]['reads'] = "NA"
-            self.summarydata[label]['recent_reads'] = "NA"
-            self.summarydata[label]['downloads'] = "NA"
-            self.summarydata[label]['recent_downloads'] = "NA"
-            # Get the total number of records via facet query on publication year
-            results = _get_facet_data(self.config, query, 'year')
-            self.summarydata[label]['nrecs'] = sum(results.values())
-            # How many of these records have full text associated with them
-            q = '{0} fulltext_mtime:["1000-01-01t00:00:00.000Z" TO *] doctype:(article OR inproceedings)'.format(query)
-            results = _get_facet_data(self.config, q, 'year')
-            self.summarydata[label]['ftrecs'] = sum(results.values())
-            # How many of these records are Open Access
-            q = '{0} property:openaccess doctype:(article OR inproceedings)'.format(query)
-            results = _get_facet_data(self.config, q, 'year')
-            self.summarydata[label]['oarecs'] = sum(results.values())
-            # How many of these records have at least one data link
-            q = '{0} property:data doctype:(article OR inproceedings)'.format(query)
-            results = _get_facet_data(self.config, q, 'year')
-            self.summarydata[label]['dlrecs'] = sum(results.values())
-            # How many of these records are refereed
-            q = '{0} property:refereed doctype:(article OR inproceedings)'.format(query)
-            results = _get_facet_data(self.config, q, 'year')
-            self.summarydata[label]['refrecs'] = sum(results.values())
+            # The total covers all document types, but the other numbers only articles and proceedings
+            plan[label] = (query, {k: '{0} AND {1}'.format(v, doctypes) for k, v in filters.items()})
+        return plan
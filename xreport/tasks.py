@@ -7,6 +7,10 @@ from xreport.reports import FullTextReport
 from xreport.reports import ReferenceMatchingReport
 from xreport.reports import MetaDataReport
 from xreport.reports import SummaryReport
+from xreport.reports import Report
+from xreport.reports import CollectionContext
+from xreport.utils import _run_dag
+from celery import chord, group
 # ============================= INITIALIZATION ==================================== #
 
 from adsputils import setup_logging, load_config
@@ -23,10 +27,14 @@ def create_report(**args):
     collection = args['collection']
     # What report needs to be created
     subject = args['subject']
+    # Configuration values overriding the defaults (e.g. from the command line)
+    report_config = args.get('config', {})
+    # Publication data for the collection is gathered once, and shared by all reports
+    context = CollectionContext()
     #
     if subject in ['FULLTEXT', 'ALL']:
         # Initialize the class for full text reporting
-        ftreport = FullTextReport()
+        ftreport = FullTextReport(config=report_config, context=context)
         # The first step consists of retrieving and preparing the data to generate the report
         try:
             ftreport.make_report(collection, report_format)
@@ -44,7 +52,7 @@ def create_report(**args):
             logger.error(msg)
     if subject in ['REFERENCES', 'ALL']:
         # Initialize the class for reference matching reporting
-        rmreport = ReferenceMatchingReport()
+        rmreport = ReferenceMatchingReport(config=report_config, context=context)
         try:
             rmreport.make_report(collection, report_format)
         except Exception as err:
@@ -58,7 +66,7 @@ def create_report(**args):
             logger.error(msg)
     if subject in ['METADATA', 'ALL']:
         # Initialize the class for metadata reporting
-        mreport = MetaDataReport()
+        mreport = MetaDataReport(config=report_config, context=context)
         try:
             mreport.make_report(collection, report_format)
         except Exception as err:
@@ -72,7 +80,7 @@ def create_report(**args):
             logger.error(msg)
     if subject == 'SUMMARY':
         # Create a summarizing report
-        summary = SummaryReport()
+        summary = SummaryReport(config=report_config, context=context)
         try:
             summary.make_report(collection, report_format)
         except Exception as err:
@@ -85,3 +93,109 @@ def create_report(**args):
             logger.error(msg)
         
         
+
+# The report class for every subject, and the subjects making up 'ALL'
+REPORT_CLASSES = {
+    'FULLTEXT': FullTextReport,
+    'REFERENCES': ReferenceMatchingReport,
+    'METADATA': MetaDataReport,
+    'SUMMARY': SummaryReport
+}
+ALL_SUBJECTS = ['FULLTEXT', 'REFERENCES', 'METADATA']
+
+def _prepare_collection(collection, report_config, context):
+    # Gather the publication data for a collection, to be shared by all its reports
+    report = Report(config=report_config, context=context)
+    report.make_report(collection, 'NASA')
+    return report.fetch_errors
+
+def _run_report(collection, report_format, subject, report_config, context):
+    # Make and save one report
+    report = REPORT_CLASSES[subject](config=report_config, context=context)
+    report.make_report(collection, report_format)
+    if subject == 'FULLTEXT' and report_format == 'MISSING':
+        report.save_missing(collection, report_format, subject)
+    else:
+        report.save_report(collection, report_format, subject)
+
+def create_reports(**args):
+    # Create the reports for all combinations of a set of collections, formats and subjects in
+    # one run. The work is organized as a graph of jobs: the publication data for a collection are
+    # gathered first, after which all reports for that collection can be made (in parallel with
+    # those for other collections). Journal level data are retrieved once, and reused for all
+    # collections containing the journal
+    collections = args['collections']
+    formats = args['formats']
+    subjects = []
+    for subject in args['subjects']:
+        subjects += ALL_SUBJECTS if subject == 'ALL' else [subject]
+    subjects = list(dict.fromkeys(subjects))
+    report_config = args.get('config', {})
+    run_config = {**config, **report_config}
+    # The jobs running in parallel share the pool of API connections, so each of them gets its
+    # share of the API requests that are allowed to run in parallel
+    batch_workers = max(run_config.get('BATCH_WORKERS', 1), 1)
+    api_concurrency = max(run_config.get('MAX_API_CONCURRENCY', 1) // batch_workers, 1)
+    report_config = dict(report_config, MAX_API_CONCURRENCY=api_concurrency)
+    memo = {}
+    contexts = {collection: CollectionContext(memo=memo) for collection in collections}
+    jobs = {}
+    for collection in collections:
+        jobs[('prepare', collection)] = (_prepare_collection, (collection, report_config, contexts[collection]), [])
+    for report_format in formats:
+        for subject in subjects:
+            if subject == 'SUMMARY':
+                # The summary report covers all collections, so it is only made once per format
+                collection = collections[0]
+                jobs[(subject, report_format)] = (_run_report, (collection, report_format, subject, report_config, contexts[collection]), [('prepare', collection)])
+                continue
+            for collection in collections:
+                jobs[(collection, report_format, subject)] = (_run_report, (collection, report_format, subject, report_config, contexts[collection]), [('prepare', collection)])
+    results, errors = _run_dag(run_config, jobs)
+    for key, err in errors.items():
+        msg = "Error in batch job {0}: {1}".format(key, err)
+        logger.error(msg)
+    return errors
+
+@app.task(queue='journal-reports')
+def task_journal_report(collection, report_format, subject, journal, report_config):
+    # Make a report for just one journal of a collection, and return its data
+    journals = report_config.get('JOURNALS', config['JOURNALS'])
+    journal_config = {**report_config, 'JOURNALS': {**journals, collection: [journal]}}
+    if subject == 'FULLTEXT':
+        # The Classic full text index is built (and cached) for just this journal, so that
+        # workers without a warm, shared index cache do not parse it for the whole collection
+        journal_config['FULLTEXT_INDEX_JOURNALS'] = [journal]
+    report = REPORT_CLASSES[subject](config=journal_config)
+    report.make_report(collection, report_format)
+    return report._export_journal(journal)
+
+@app.task(queue='reports')
+def task_save_report(results, collection, report_format, subject, report_config):
+    # Put together the report for a collection from the data for its journals, and save it
+    report = REPORT_CLASSES[subject](config=report_config)
+    report._import_journals(report.config['JOURNALS'][collection], results)
+    if subject == 'FULLTEXT' and report_format == 'MISSING':
+        report.save_missing(collection, report_format, subject)
+    else:
+        report.save_report(collection, report_format, subject)
+
+def create_report_distributed(**args):
+    # Create reports with the journal level work (facet queries, reference directory scans,
+    # Journals Database lookups) done by Celery workers: for every subject, a chord of one task
+    # per journal, with a callback that puts the report together and saves it. The summary report
+    # is not made per journal, and is made locally
+    collection = args['collection']
+    report_format = args['format']
+    report_config = args.get('config', {})
+    subjects = ALL_SUBJECTS if args['subject'] == 'ALL' else [args['subject']]
+    journals = report_config.get('JOURNALS', config['JOURNALS'])[collection]
+    results = []
+    for subject in subjects:
+        if subject == 'SUMMARY':
+            _run_report(collection, report_format, subject, report_config, CollectionContext())
+            continue
+        header = group(task_journal_report.s(collection, report_format, subject, journal, report_config) for journal in journals)
+        results.append(chord(header)(task_save_report.s(collection, report_format, subject, report_config)))
+    return results
+
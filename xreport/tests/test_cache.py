@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from xreport.cache import _load_cached_arrays
+from xreport.cache import _store_cached_arrays
+from xreport.cache import _frame_to_arrays
+from xreport.cache import _arrays_to_frame
+from xreport.cache import _purge_cache
+from xreport.cache import _load_reference_tallies
+from xreport.cache import _store_reference_tallies
+from xreport.cache import _get_cached_response
+from xreport.cache import _store_cached_response
+from xreport.cache import _response_cache_stats
+from xreport.utils import _get_fulltext_index
+from xreport.utils import _update_reference_matching
+
+class TestMethods(unittest.TestCase):
+
+    '''Check if methods return expected results'''
+    def setUp(self):
+        from adsputils import load_config
+        self.proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../../'))
+        self.config = load_config(proj_home=self.proj_home)
+        self.tmpdir = tempfile.mkdtemp()
+        self.config['USE_INDEX_CACHE'] = True
+        self.config['CACHE_DIRECTORY'] = os.path.join(self.tmpdir, 'cache')
+        # A source file to cache data for
+        self.source = os.path.join(self.tmpdir, 'index.links')
+        with open(self.source, 'w') as fh:
+            fh.write('2020ApJ...900...30P\t1\t2\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_frame_roundtrip(self):
+        '''Test that frames survive being stored as arrays'''
+        frame = pd.DataFrame({
+            'bibstem': pd.Series(['ApJ..', 'ApJL', 'ApJ..'], dtype='category'),
+            'volume': pd.Series([900, 901, 902], dtype='int32'),
+            'source': ['iop', 'arxiv', 'iop']
+        })
+        restored = _arrays_to_frame(_frame_to_arrays(frame))
+        self.assertListEqual(list(restored.columns), ['bibstem', 'volume', 'source'])
+        self.assertEqual(str(restored['bibstem'].dtype), 'category')
+        self.assertEqual(str(restored['volume'].dtype), 'int32')
+        self.assertListEqual(restored.astype(str).values.tolist(), frame.astype(str).values.tolist())
+
+    def test_cache(self):
+        '''Test storing and retrieving cached data'''
+        arrays = {'bibcode': np.array([b'2020ApJ...900...30P']), 'total': np.array([3])}
+        # Nothing has been cached yet
+        self.assertIsNone(_load_cached_arrays(self.config, 'usage', self.source))
+        _store_cached_arrays(self.config, 'usage', self.source, arrays)
+        cached = _load_cached_arrays(self.config, 'usage', self.source)
+        self.assertListEqual(sorted(cached.keys()), ['bibcode', 'total'])
+        self.assertEqual(cached['total'][0], 3)
+        # Cached data can be memory mapped
+        cached = _load_cached_arrays(self.config, 'usage', self.source, mmap_mode='r')
+        self.assertIsInstance(cached['total'], np.memmap)
+        # Data cached with different parameters is not returned
+        self.assertIsNone(_load_cached_arrays(self.config, 'usage', self.source, extra=['ApJ']))
+        # When the source file changes, the cached data are obsolete
+        with open(self.source, 'a') as fh:
+            fh.write('2020ApJ...900...31Y\t1\t1\n')
+        self.assertIsNone(_load_cached_arrays(self.config, 'usage', self.source))
+        # Storing new data replaces the old entry
+        _store_cached_arrays(self.config, 'usage', self.source, arrays)
+        self.assertEqual(len(os.listdir(self.config['CACHE_DIRECTORY'])), 1)
+        # ... but not the data cached with different parameters
+        _store_cached_arrays(self.config, 'usage', self.source, arrays, extra=['ApJ'])
+        self.assertEqual(len(os.listdir(self.config['CACHE_DIRECTORY'])), 2)
+        self.assertIsNotNone(_load_cached_arrays(self.config, 'usage', self.source))
+        # Storing the same data again keeps the existing entry
+        _store_cached_arrays(self.config, 'usage', self.source, arrays, extra=['ApJ'])
+        self.assertEqual(len(os.listdir(self.config['CACHE_DIRECTORY'])), 2)
+        self.assertIsNotNone(_load_cached_arrays(self.config, 'usage', self.source, extra=['ApJ']))
+        # The cache can be bypassed
+        self.config['USE_INDEX_CACHE'] = False
+        self.assertIsNone(_load_cached_arrays(self.config, 'usage', self.source))
+        # ... and purged
+        self.config['USE_INDEX_CACHE'] = True
+        _purge_cache(self.config)
+        self.assertFalse(os.path.exists(self.config['CACHE_DIRECTORY']))
+        self.assertIsNone(_load_cached_arrays(self.config, 'usage', self.source))
+
+    def test_cached_fulltext_index(self):
+        '''Test that the full text index is the same when it comes from the cache'''
+        self.config['CLASSIC_FULLTEXT_INDEX'] = '{0}/xreport/tests/data/fulltext.links'.format(self.proj_home)
+        ft_index = _get_fulltext_index(self.config, ['ApJ..', 'MNRAS'])
+        profiles = []
+        self.config['PROFILE_HOOK'] = lambda label, stats: profiles.append(label)
+        cached_index = _get_fulltext_index(self.config, ['ApJ..', 'MNRAS'])
+        # The index file was not parsed again
+        self.assertListEqual(profiles, [])
+        pd.testing.assert_frame_equal(ft_index, cached_index)
+        # A different set of journals means the index file needs to be parsed again
+        _get_fulltext_index(self.config, ['MNRAS'])
+        self.assertListEqual(profiles, ['Classic full text index'])
+        # Both sets of journals stay cached
+        _get_fulltext_index(self.config, ['ApJ..', 'MNRAS'])
+        _get_fulltext_index(self.config, ['MNRAS'])
+        self.assertListEqual(profiles, ['Classic full text index'])
+
+    def test_reference_tallies(self):
+        '''Test storing reference matching tallies and only rescanning changed volumes'''
+        basedir = os.path.join(self.tmpdir, 'references')
+        voldir = os.path.join(basedir, 'ApJ', '0950')
+        os.makedirs(voldir)
+        resfile = os.path.join(voldir, '2023ApJ...950....1X.iopft.xml.result')
+        with open(resfile, 'w') as fh:
+            fh.write('1 a\n5 b\n')
+        self.assertDictEqual(_load_reference_tallies(self.config), {})
+        signature, tallies = _update_reference_matching(basedir, 'ApJ..', 950)
+        self.assertDictEqual(tallies, {'publisher': [1, 1], 'crossref': [0, 0]})
+        key = (voldir, None)
+        _store_reference_tallies(self.config, {key: (signature, tallies)})
+        known = _load_reference_tallies(self.config)
+        self.assertEqual(known[key], (signature, tallies))
+        # Unchanged volumes are not read again, so (made up) stored tallies are returned as they are
+        stored = {'publisher': [7, 0], 'crossref': [0, 0]}
+        self.assertEqual(_update_reference_matching(basedir, 'ApJ..', 950, (signature, stored)), (signature, stored))
+        # A changed results file means the volume is tallied again
+        with open(resfile, 'w') as fh:
+            fh.write('1 a\n1 b\n1 c\n')
+        new_signature, tallies = _update_reference_matching(basedir, 'ApJ..', 950, (signature, stored))
+        self.assertNotEqual(new_signature, signature)
+        self.assertDictEqual(tallies, {'publisher': [3, 0], 'crossref': [0, 0]})
+        # Nothing is stored or loaded when the cache is disabled
+        self.config['USE_INDEX_CACHE'] = False
+        self.assertDictEqual(_load_reference_tallies(self.config), {})
+
+    def test_response_cache(self):
+        '''Test caching API responses'''
+        self.config['USE_API_CACHE'] = True
+        self.config['API_CACHE_TTL'] = {'search/query': 3600}
+        params = {'q': 'star', 'rows': 10}
+        hits = _response_cache_stats['hits']
+        self.assertIsNone(_get_cached_response(self.config, 'search/query', params))
+        _store_cached_response(self.config, 'search/query', params, {'response': {'numFound': 1}})
+        # The order of the query parameters does not matter
+        cached = _get_cached_response(self.config, 'search/query', {'rows': 10, 'q': 'star'})
+        self.assertDictEqual(cached, {'response': {'numFound': 1}})
+        self.assertEqual(_response_cache_stats['hits'], hits + 1)
+        # Other endpoints are cached separately
+        self.assertIsNone(_get_cached_response(self.config, 'journals/summary', params))
+        # ... and so are responses from another API server
+        api_url = self.config.get('ADS_API_URL')
+        self.config['ADS_API_URL'] = 'https://api.example.org/v1'
+        self.assertIsNone(_get_cached_response(self.config, 'search/query', params))
+        self.config['ADS_API_URL'] = api_url
+        # Expired responses are only served in offline mode
+        self.config['API_CACHE_TTL'] = {'search/query': -1}
+        self.assertIsNone(_get_cached_response(self.config, 'search/query', params))
+        self.config['API_OFFLINE'] = True
+        self.assertIsNotNone(_get_cached_response(self.config, 'search/query', params))
+        # Nothing is served when neither the cache nor offline mode are enabled
+        self.config['USE_API_CACHE'] = False
+        self.config['API_OFFLINE'] = False
+        self.assertIsNone(_get_cached_response(self.config, 'search/query', params))
+
+    def test_response_cache_eviction(self):
+        '''Test that the least recently used responses are removed when the cache is full'''
+        self.config['USE_API_CACHE'] = True
+        data = {'response': {'docs': ['x'*100]}}
+        self.config['API_CACHE_MAX_SIZE'] = 2.5*len(str(data))
+        for q in ['a', 'b']:
+            _store_cached_response(self.config, 'search/query', {'q': q}, data)
+            time.sleep(0.01)
+        # Using 'a' makes 'b' the least recently used response
+        self.assertIsNotNone(_get_cached_response(self.config, 'search/query', {'q': 'a'}))
+        _store_cached_response(self.config, 'search/query', {'q': 'c'}, data)
+        self.assertIsNotNone(_get_cached_response(self.config, 'search/query', {'q': 'a'}))
+        self.assertIsNone(_get_cached_response(self.config, 'search/query', {'q': 'b'}))
+        self.assertIsNotNone(_get_cached_response(self.config, 'search/query', {'q': 'c'}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,8 @@ from xreport.reports import Report
 from xreport.reports import FullTextReport
 from xreport.reports import ReferenceMatchingReport
 from xreport.reports import SummaryReport
+from xreport.reports import MetaDataReport
+from xreport.reports import CollectionContext
 
 class TestMethods(unittest.TestCase):
 
@@ -29,7 +31,32 @@ class TestMethods(unittest.TestCase):
         # parameters in the header), we need a callback function to determine the appropriate data
         def request_callback(request, uri, response_headers):
             content_type = request.headers.get('Content-Type')
-            if uri.find('facet.field=volume') > -1:
+            if uri.find('fl=bibcode&') > -1:
+                # The query was for the bibcodes of a set of records
+                bibcodes = ['2022ApJ...924...44A', '2022A&A...660A..44K', '2022MNRAS.509...44W']
+                mockdata = {'response': {'numFound': len(bibcodes), 'docs': [{'bibcode': b} for b in bibcodes]}}
+                return [200, response_headers, json.dumps(mockdata)]
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(uri).query)
+            if params.get('rows') == ['0']:
+                # The query was for the number of records (and the numbers matching facet queries):
+                # all records in the year facet data, or just the ones for this year (recent citations)
+                with open('{0}/xreport/tests/data/FacetDataYearCount.json'.format(self.proj_home)) as mdata:
+                    years = json.load(mdata)['facet_counts']['facet_fields']['year']
+                years = dict(zip(years[::2], years[1::2]))
+                if params['q'][0].startswith('citations('):
+                    numFound = years.get(str(datetime.today().year), 0)
+                else:
+                    numFound = sum(years.values())
+                mockdata = {'response': {'numFound': numFound, 'docs': []},
+                            'facet_counts': {'facet_queries': {fq: numFound for fq in params.get('facet.query', [])}}}
+                if 'stats.field' in params:
+                    # The citation total: the sum of the citation counts in the pivot data
+                    with open('{0}/xreport/tests/data/PivotDataYearCitCount.json'.format(self.proj_home)) as mdata:
+                        pivots = json.load(mdata)['facet_counts']['facet_pivot']['year,citation_count']
+                    citnum = sum([e['count']*e['value'] for p in pivots for e in p['pivot']])
+                    mockdata['stats'] = {'stats_fields': {'citation_count': {'sum': float(citnum)}}}
+                return [200, response_headers, json.dumps(mockdata)]
+            elif uri.find('facet.field=volume') > -1:
                 # The query was for a facet query by volume
                 datafile = '{0}/xreport/tests/data/FacetDataVolumeCount.json'.format(self.proj_home)
             elif uri.find('facet.field=year') > -1:
@@ -66,10 +93,18 @@ class TestMethods(unittest.TestCase):
         # Confirm that the date string in the class is today's date
         self.assertEqual(r.dstring, datetime.today().strftime('%Y%m%d'))
         # We expect the following keys in the configuration dictionary
-        expected_config_keys = ['PROJ_HOME', 'ADS_API_TOKEN', 'ADS_API_URL', 'ADS_REFERENCE_DATA', 'CLASSIC_FULLTEXT_INDEX',
-                                'CLASSIC_USAGE_INDEX', 'COLLECTIONS', 'COLLECTION_FILTERS', 'CONTENT_QUERIES', 'FORMATS', 
-                                'JOURNALS', 'LOGGING_LEVEL', 'LOG_STDOUT', 'OUTPUT_DIRECTORY', 'SKIP_USAGE', 'SOURCES', 
-                                'SUBJECTS', 'YEAR_IS_VOL']
+        expected_config_keys = ['PROJ_HOME', 'ADS_API_TOKEN', 'ADS_API_URL', 'ADS_PUBLISHER_DATA', 'ADS_REFERENCE_DATA',
+                                'API_BACKOFF_FACTOR', 'API_BACKOFF_MAX', 'API_CACHE_DEFAULT_TTL', 'API_CACHE_MAX_SIZE',
+                                'API_CACHE_TTL', 'API_MAX_RETRIES', 'API_OFFLINE', 'API_POOL_SIZE', 'API_RETRY_STATUS',
+                                'API_TIMEOUT', 'BATCH_WORKERS', 'CACHE_DIRECTORY', 'CELERY_ALWAYS_EAGER', 'CELERY_BROKER',
+                                'CELERY_INCLUDE', 'CELERY_RESULT_BACKEND', 'CLASSIC_FULLTEXT_INDEX', 'CLASSIC_USAGE_INDEX',
+                                'COLLECTIONS', 'COLLECTION_FILTERS', 'CONTENT_QUERIES', 'FACET_LIMIT', 'FORMATS', 'FULLTEXT_INDEX_CHUNKSIZE',
+                                'FULLTEXT_INDEX_JOURNALS', 'JOURNALS', 'LOGGING_LEVEL', 'LOG_STDOUT', 'MAX_API_CONCURRENCY',
+                                'MISSING_OUTPUT_FORMAT', 'NO_FULLTEXT', 'OUTPUT_DIRECTORY', 'PERFORMANCE_MANIFEST',
+                                'PIVOT_CHUNK_SIZE', 'PIVOT_FACET_LIMIT', 'PROFILE_MEMORY', 'PROFILE_MODE', 'PROFILE_RUN',
+                                'PROFILE_SAMPLE_INTERVAL', 'PROFILE_TOP_ALLOCATIONS', 'PROFILE_TRACE_FRAMES',
+                                'PROMETHEUS_TEXTFILE', 'RECORDS_PREFETCH', 'REFERENCE_SCAN_WORKERS', 'SKIP_USAGE', 'SOURCES',
+                                'SUBJECTS', 'SUMMARY_COLUMNS', 'SUMMARY_ROWS', 'USE_API_CACHE', 'USE_INDEX_CACHE', 'YEAR_IS_VOL']
         self.assertListEqual(list(r.config.keys()), expected_config_keys)
         # The make_report method for the generic Report should contain just basic journal data
         r.make_report('AST', 'SUMMARY')
@@ -124,16 +159,13 @@ class TestMethods(unittest.TestCase):
             self.assertTrue(success)
             os.remove(output_file)
         os.rmdir(outdir)
-        # Test highlight function
-        values = [95, 55, 65, 75]
-        colors = [r._highlight_cells(v) for v in values]
-        expected_colors = ['background-color: #6aa84f', 'background-color: #f4cccc', 'background-color: #ffe599', 'background-color: #cfe2f3']
-        self.assertListEqual(colors, expected_colors)
 
         ######## TEST OF THE FULL TEXT REPORT CLASS ###############################
 
         # Now instantiate the Fulltext Report
         ftr = FullTextReport(config=config)
+        # The full text index is built (on first use) for the journals in the configuration
+        ftr.config['JOURNALS']['AST'] = ['ApJ..']
         try:
             data = ftr.ft_index.query("bibstem=='ApJ..' and source=='arxiv'")
         except:
@@ -141,7 +173,6 @@ class TestMethods(unittest.TestCase):
         # There are two entries that match the above criteria in the mock data
         self.assertEqual(len(data), 2)
         # Test make_report using this index
-        ftr.config['JOURNALS']['AST'] = ['ApJ..']
         try:
             ftr.make_report("AST", "CURATORS")
         except:
@@ -168,9 +199,26 @@ class TestMethods(unittest.TestCase):
         rmr = ReferenceMatchingReport(config=config)
         rmr.config['JOURNALS']['AST'] = ['ApJ..']
         # Create the report using mock data
-        rmr.make_report('AST', 'REFERENCES')
+        rmr.make_report('AST', 'CURATORS')
         self.assertEqual(rmr.statsdata['ApJ..']['publisher'][900], 96.7)
 
+        ######## TEST OF THE METADATA REPORT CLASS ###############################
+
+        # Completeness data from the Journals Database
+        details = [{'volume': '900', 'completeness_fraction': 0.9876}, {'volume': '904', 'completeness_fraction': 0.5}]
+        httpretty.register_uri(
+                    httpretty.GET,
+                    "{}/journals/summary/ApJ..".format(self.config['ADS_API_URL']),
+                    content_type='application/json',
+                    status=200,
+                    body=json.dumps({'summary': {'master': {'bibstem': 'ApJ..', 'completeness_details': json.dumps(details)}}}))
+        mdr = MetaDataReport()
+        mdr.config['JOURNALS']['AST'] = ['ApJ..']
+        mdr.make_report('AST', 'NASA')
+        # Volumes without completeness data have a completeness of 0
+        expected = {889: 0.0, 891: 0.0, 897: 0.0, 900: 98.8, 904: 50.0, 905: 0.0}
+        self.assertDictEqual(mdr.statsdata['ApJ..']['general'], expected)
+
         ######## TEST OF THE SUMMARY REPORT CLASS ###############################
         sr = SummaryReport()
         # Limit the context for the summary report
@@ -187,6 +235,227 @@ class TestMethods(unittest.TestCase):
                                     'dlrecs': 18584, 'citnum': 14338828, 'recent_citnum': 0, 'reads': 681, 
                                     'recent_reads': 271, 'downloads': 322, 'recent_downloads': 149}, 
                             'AST recent sample': {'nrecs': 18584, 'ftrecs': 18584, 'refrecs': 18584, 'oarecs': 18584, 
-                                    'dlrecs': 18584, 'citnum': 14338828, 'recent_citnum': 0, 'reads': 'NA', 
-                                    'recent_reads': 'NA', 'downloads': 'NA', 'recent_downloads': 'NA'}}
+                                    'dlrecs': 18584, 'citnum': 14338828, 'recent_citnum': 0, 'reads': 449, 
+                                    'recent_reads': 288, 'downloads': 242, 'recent_downloads': 167}}
         self.assertDictEqual(sr.summarydata, expected_summary)
+
+    def test_missing_publications(self):
+        '''Test retrieving rows for missing publications, with and without prefetching pages'''
+        records = [{'bibcode': '2020ApJ...900...31Y', 'volume': '900', 'title': ['Another title']},
+                   {'bibcode': '2020ApJ...900...30P', 'doi': ['10.3847/x'], 'volume': '900', 'issue': '1',
+                    'first_author_norm': 'P, A', 'title': ['A title']}]
+        prefetch = []
+        def iter_records(conf, query, fields):
+            prefetch.append(conf['RECORDS_PREFETCH'])
+            return iter(records)
+        ftr = FullTextReport(config={'RECORDS_PREFETCH': True})
+        ftr.missing = {}
+        expected = [('2020ApJ...900...31Y', 'NA', '900', 'NA', 'NA', 'Another title'),
+                    ('2020ApJ...900...30P', '10.3847/x', '900', '1', 'P, A', 'A title')]
+        with mock.patch('xreport.reports._iter_records', side_effect=iter_records):
+            for concurrency, journals, expected_prefetch in [(1, ['ApJ..', 'MNRAS'], True), (4, ['ApJ..'], True), (4, ['ApJ..', 'MNRAS'], False)]:
+                prefetch.clear()
+                ftr.config['MAX_API_CONCURRENCY'] = concurrency
+                ftr.journals = journals
+                ftr._get_missing_publications()
+                self.assertListEqual(ftr.missing['ApJ..'], expected)
+                # Pages are only prefetched when journals are not retrieved concurrently
+                self.assertListEqual(prefetch, [expected_prefetch]*len(journals))
+
+    def test_reference_scan_errors(self):
+        '''Journals for which reference data could not be scanned are left out (and the errors recorded)'''
+        import tempfile
+        from xreport.utils import _update_reference_matching
+        def scan(basedir, journal, volume, known):
+            if journal == 'MNRAS' and volume == 500:
+                raise OSError('Permission denied')
+            return _update_reference_matching(basedir, journal, volume, known)
+        config = {
+            'ADS_REFERENCE_DATA': '{0}/xreport/tests/data/references'.format(self.proj_home),
+            'REFERENCE_SCAN_WORKERS': 1,
+            'CACHE_DIRECTORY': tempfile.mkdtemp()
+        }
+        rmr = ReferenceMatchingReport(config=config)
+        rmr.journals = ['ApJ..', 'MNRAS']
+        rmr.statsdata = {j: {'pubdata': {900: 10, 500: 10}, 'publisher': {}, 'crossref': {}} for j in rmr.journals}
+        rmr.fetch_errors = {}
+        try:
+            with mock.patch('xreport.reports._update_reference_matching', side_effect=scan):
+                rmr._get_reference_data(['publisher', 'crossref'])
+            self.assertEqual(rmr.statsdata['ApJ..']['publisher'][900], 96.7)
+            self.assertDictEqual(rmr.statsdata['MNRAS']['publisher'], {})
+            self.assertListEqual(list(rmr.fetch_errors.keys()), ['MNRAS'])
+            self.assertIn('Permission denied', rmr.fetch_errors['MNRAS'][0])
+            # No tallies were stored for the volume that failed
+            from xreport.cache import _load_reference_tallies
+            from xreport.utils import _get_reference_directory
+            known = _load_reference_tallies(rmr.config)
+            self.assertNotIn(_get_reference_directory(config['ADS_REFERENCE_DATA'], 'MNRAS', 500), known)
+            self.assertIn(_get_reference_directory(config['ADS_REFERENCE_DATA'], 'MNRAS', 900), known)
+        finally:
+            import shutil
+            shutil.rmtree(config['CACHE_DIRECTORY'])
+
+    @httpretty.activate
+    def test_collection_facets(self):
+        # Pivot queries get pivot data back, facet queries the volume facet data
+        def request_callback(request, uri, response_headers):
+            if uri.find('facet.pivot=bibstem') > -1:
+                datafile = '{0}/xreport/tests/data/PivotDataBibstemVolume.json'.format(self.proj_home)
+            else:
+                datafile = '{0}/xreport/tests/data/FacetDataVolumeCount.json'.format(self.proj_home)
+            with open(datafile) as mdata:
+                mockdata = json.load(mdata)
+            return [200, response_headers, json.dumps(mockdata)]
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=request_callback)
+        r = Report(config={'PIVOT_CHUNK_SIZE': 2, 'PIVOT_FACET_LIMIT': 1000, 'MAX_API_CONCURRENCY': 1})
+        r.journals = ['ApJ', 'MNRAS', 'PASP']
+        query = 'bibstem:{0} doctype:(article OR inproceedings)'
+        with self.assertLogs(r.logger.name, level='WARNING') as logs:
+            results, errors = r._get_collection_facets(query, 'volume')
+        self.assertDictEqual(errors, {})
+        # Two chunks, so two pivot queries, and PASP is not in the pivot results, so it is
+        # queried individually
+        self.assertEqual(len(httpretty.latest_requests()), 3)
+        self.assertEqual(httpretty.last_request().querystring['q'], ['bibstem:"PASP" doctype:(article OR inproceedings)'])
+        self.assertIn('Journal PASP is missing from the volume pivot results', logs.output[0])
+        expected = {
+            'ApJ': {904: 201, 900: 196, 889: 189, 897: 186, 891: 182, 905: 129},
+            'MNRAS': {499: 412, 500: 398},
+            'PASP': {904: 201, 900: 196, 889: 189, 897: 186, 891: 182, 905: 129}
+        }
+        self.assertDictEqual(results, expected)
+        # When the pivot results may have been truncated, we fall back to facet queries
+        httpretty.reset()
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=request_callback)
+        r.config['PIVOT_FACET_LIMIT'] = 4
+        results, errors = r._get_collection_facets(query, 'volume')
+        self.assertDictEqual(errors, {})
+        # ApJ has as many volumes as the limit, so it was queried individually, as was PASP,
+        # because the second pivot query returned as many bibstems as the limit
+        self.assertEqual(len(httpretty.latest_requests()), 4)
+        self.assertEqual(httpretty.last_request().querystring['q'], ['bibstem:"PASP" doctype:(article OR inproceedings)'])
+        # The journals queried individually get (at least) FACET_LIMIT values
+        self.assertEqual(httpretty.last_request().querystring['facet.limit'], [str(r.config['FACET_LIMIT'])])
+        self.assertDictEqual(results['ApJ'], {904: 201, 900: 196, 889: 189, 897: 186, 891: 182, 905: 129})
+        self.assertDictEqual(results['MNRAS'], {499: 412, 500: 398})
+        self.assertDictEqual(results['PASP'], {904: 201, 900: 196, 889: 189, 897: 186, 891: 182, 905: 129})
+
+    @httpretty.activate
+    def test_collection_context(self):
+        # Volume and year facet data, depending on the facet requested
+        def request_callback(request, uri, response_headers):
+            if uri.find('facet.field=volume') > -1:
+                datafile = '{0}/xreport/tests/data/FacetDataVolumeCount.json'.format(self.proj_home)
+            else:
+                datafile = '{0}/xreport/tests/data/FacetDataYearCount.json'.format(self.proj_home)
+            with open(datafile) as mdata:
+                mockdata = json.load(mdata)
+            return [200, response_headers, json.dumps(mockdata)]
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=request_callback)
+        config = {'PIVOT_CHUNK_SIZE': 1, 'MAX_API_CONCURRENCY': 1,
+                  'ADS_REFERENCE_DATA': '{0}/xreport/tests/data/references'.format(self.proj_home)}
+        context = CollectionContext()
+        r = Report(config=config, context=context)
+        r.config['JOURNALS']['AST'] = ['ApJ..','MNRAS']
+        r.make_report('AST', 'NASA')
+        # Volume and year facet queries for both journals
+        self.assertEqual(len(httpretty.latest_requests()), 4)
+        # A second report for the same collection reuses the publication data
+        rmr = ReferenceMatchingReport(config=config, context=context)
+        rmr.config['JOURNALS']['AST'] = ['ApJ..','MNRAS']
+        rmr.make_report('AST', 'NASA')
+        self.assertEqual(len(httpretty.latest_requests()), 4)
+        self.assertDictEqual(rmr.statsdata['ApJ..']['pubdata'], r.statsdata['ApJ..']['pubdata'])
+        self.assertEqual(rmr.statsdata['MNRAS']['lastvol'], 905)
+        self.assertDictEqual(rmr.publisher, r.publisher)
+        # ... but has its own statistics
+        self.assertEqual(rmr.statsdata['ApJ..']['general'][900], 96.7)
+        self.assertDictEqual(r.statsdata['ApJ..']['general'], {})
+        # A different set of journals means the publication data is gathered again, but the
+        # data for journals that have been retrieved before are reused
+        r = Report(config=config, context=context)
+        r.config['JOURNALS']['AST'] = ['ApJ..']
+        r.make_report('AST', 'NASA')
+        self.assertEqual(len(httpretty.latest_requests()), 4)
+        self.assertEqual(r.statsdata['ApJ..']['lastvol'], 905)
+        # The context for another collection can reuse the journal level data as well
+        r = Report(config=config, context=CollectionContext(memo=context.memo))
+        r.config['JOURNALS']['PS'] = ['MNRAS', 'ApJ..', 'Icar']
+        r.make_report('PS', 'NASA')
+        # Only the volume and year facets for the journal that was not retrieved before
+        self.assertEqual(len(httpretty.latest_requests()), 6)
+        self.assertDictEqual(r.statsdata['MNRAS']['pubdata'], rmr.statsdata['MNRAS']['pubdata'])
+
+    def test_stats_table(self):
+        r = Report(config={})
+        r.journals = ['ApJ..', 'MNRAS']
+        r.statsdata = {
+            'ApJ..': {'general': {900: 95.0, 902: 60.5}, 'arxiv': {901: 10.0}},
+            'MNRAS': {'general': {901: 100.0}, 'arxiv': {}}
+        }
+        table = r._get_stats_table(['general', 'arxiv'])
+        self.assertListEqual(list(table.columns), ['journal', 'volume', 'metric', 'value'])
+        self.assertListEqual(table.values.tolist(), [['ApJ..', 900, 'general', 95.0], ['ApJ..', 902, 'general', 60.5],
+                                                     ['ApJ..', 901, 'arxiv', 10.0], ['MNRAS', 901, 'general', 100.0]])
+        # Volumes are aligned by reindexing: volumes without data for a journal get NaN values
+        frame = r._get_coverage_frame(table, 'general', range(899, 903))
+        self.assertListEqual(list(frame.columns), ['ApJ..', 'MNRAS'])
+        self.assertListEqual(frame.fillna(-1).values.tolist(), [[-1, -1], [95.0, -1], [-1, 100.0], [60.5, -1]])
+        # The journal order of the collection is kept, also for journals without any data
+        frame = r._get_coverage_frame(table, 'arxiv', range(900, 902))
+        self.assertListEqual(frame.fillna(-1).values.tolist(), [[-1, -1], [10.0, -1]])
+
+    def test_lazy_fulltext_index(self):
+        config = {'CLASSIC_FULLTEXT_INDEX': '{0}/xreport/tests/data/fulltext.links'.format(self.proj_home),
+                  'USE_INDEX_CACHE': False}
+        profiles = []
+        config['PROFILE_HOOK'] = lambda label, stats: profiles.append(label)
+        ftr = FullTextReport(config=config)
+        # The Classic full text index is not loaded until it is used
+        self.assertListEqual(profiles, [])
+        # ... and then just for the journals being reported
+        ftr.journals = ['MNRAS']
+        self.assertListEqual(ftr.ft_index['bibstem'].unique().tolist(), ['MNRAS'])
+        self.assertListEqual(profiles, ['Classic full text index'])
+        # The index is loaded once, unless the journals change
+        ftr.ft_index
+        self.assertEqual(len(profiles), 1)
+        ftr.journals = ['ApJ..', 'MNRAS']
+        bibstems = ftr.ft_index['bibstem'].unique().tolist()
+        self.assertTrue('ApJ..' in bibstems and 'MNRAS' in bibstems)
+        self.assertFalse('A&A..' in bibstems)
+        self.assertEqual(len(profiles), 2)
+
+    def test_export_journal(self):
+        r = Report(config={})
+        r.journals = ['ApJ..']
+        r.statsdata = {'ApJ..': {'pubdata': {900: 196, 904: 201}, 'startvol': 900, 'lastvol': 904, 'general': {900: 96.7}}}
+        r.publisher = {'ApJ..': 'IOP'}
+        r.missing = {'ApJ..': [('2020ApJ...900...30P', 'NA', '900', '1', 'Doe, J', 'A title')]}
+        r.fetch_errors = {}
+        # The data for a journal survive being sent as JSON (e.g. from a Celery worker)
+        data = json.loads(json.dumps(r._export_journal('ApJ..')))
+        s = Report(config={})
+        s._import_journals(['ApJ..'], [data])
+        self.assertDictEqual(s.statsdata, r.statsdata)
+        self.assertDictEqual(s.publisher, r.publisher)
+        self.assertListEqual(s.missing['ApJ..'], [list(row) for row in r.missing['ApJ..']])
+        self.assertDictEqual(s.fetch_errors, {})
@@ -0,0 +1,108 @@
+import os
+import unittest
+import httpretty
+import json
+import shutil
+import tempfile
+import urllib.parse
+
+from xreport import tasks
+
+class TestMethods(unittest.TestCase):
+
+    '''Check if report runs behave as expected'''
+    def setUp(self):
+        from adsputils import load_config
+        self.proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../../'))
+        self.config = load_config(proj_home=self.proj_home)
+        self.outdir = tempfile.mkdtemp()
+        self.report_config = {
+            'OUTPUT_DIRECTORY': self.outdir,
+            'CACHE_DIRECTORY': os.path.join(self.outdir, 'cache'),
+            'ADS_REFERENCE_DATA': '{0}/xreport/tests/data/references'.format(self.proj_home),
+            'CLASSIC_FULLTEXT_INDEX': '{0}/xreport/tests/data/fulltext.links'.format(self.proj_home),
+            'JOURNALS': {'AST': ['ApJ..', 'MNRAS'], 'PS': ['MNRAS', 'Icar.'], 'CORE': ['ApJ..', 'MNRAS', 'Icar.']},
+            # Which journals end up in which pivot query depends on the order in which collections
+            # are processed, so journals are queried individually
+            'PIVOT_CHUNK_SIZE': 1,
+            'REFERENCE_SCAN_WORKERS': 1
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def register_api(self):
+        # Facet queries get the volume or year facet data back
+        def request_callback(request, uri, response_headers):
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(uri).query)
+            if params.get('facet.field') == ['volume']:
+                datafile = '{0}/xreport/tests/data/FacetDataVolumeCount.json'.format(self.proj_home)
+            else:
+                datafile = '{0}/xreport/tests/data/FacetDataYearCount.json'.format(self.proj_home)
+            with open(datafile) as mdata:
+                return [200, response_headers, mdata.read()]
+        httpretty.register_uri(
+                    httpretty.GET,
+                    "{}/search/query".format(self.config['ADS_API_URL']),
+                    content_type='application/json',
+                    status=200,
+                    body=request_callback)
+
+    @httpretty.activate
+    def test_create_reports(self):
+        '''Journal level data are retrieved once in a batch run, also when reports are made in parallel'''
+        requests = {}
+        for workers in [1, 4]:
+            httpretty.reset()
+            httpretty.enable()
+            self.register_api()
+            self.report_config['BATCH_WORKERS'] = workers
+            errors = tasks.create_reports(collections=['AST', 'PS', 'CORE'], formats=['NASA'], subjects=['FULLTEXT', 'REFERENCES'],
+                                          config=self.report_config)
+            self.assertDictEqual(errors, {})
+            requests[workers] = sorted([r.url for r in httpretty.latest_requests()])
+            # One report per collection and subject
+            reports = os.listdir(os.path.join(self.outdir, 'NASA'))
+            self.assertEqual(len(reports), 6)
+            shutil.rmtree(os.path.join(self.outdir, 'NASA'))
+        self.assertListEqual(requests[4], requests[1])
+        # Every query is sent once
+        self.assertEqual(len(requests[4]), len(set(requests[4])))
+
+    @httpretty.activate
+    def test_create_report_distributed(self):
+        '''The reports put together from journal reports (in eager mode) are the same as those made locally'''
+        import openpyxl
+        self.register_api()
+        # Run the tasks in this process, without workers
+        eager = tasks.app.conf.task_always_eager
+        tasks.app.conf.task_always_eager = True
+        self.addCleanup(setattr, tasks.app.conf, 'task_always_eager', eager)
+        self.report_config['JOURNALS'] = {'AST': ['ApJ..', 'MNRAS']}
+        self.report_config['REFERENCE_SCAN_WORKERS'] = 1
+        sheets = {}
+        for mode in ['local', 'distributed']:
+            self.report_config['OUTPUT_DIRECTORY'] = os.path.join(self.outdir, mode)
+            if mode == 'local':
+                tasks.create_report(collection='AST', format='CURATORS', subject='FULLTEXT', config=self.report_config)
+                tasks.create_report(collection='AST', format='NASA', subject='REFERENCES', config=self.report_config)
+            else:
+                for subject, report_format in [('FULLTEXT', 'CURATORS'), ('REFERENCES', 'NASA')]:
+                    results = tasks.create_report_distributed(collection='AST', format=report_format, subject=subject, config=self.report_config)
+                    # One chord per subject
+                    self.assertEqual(len(results), 1)
+                    results[0].get()
+            for report_format in ['CURATORS', 'NASA']:
+                outdir = os.path.join(self.outdir, mode, report_format)
+                for filename in sorted(os.listdir(outdir)):
+                    sheet = openpyxl.load_workbook(os.path.join(outdir, filename)).active
+                    sheets.setdefault(mode, {})[filename] = [[c.value for c in row] for row in sheet.iter_rows()]
+        # Full text (arXiv and publisher) and reference reports
+        self.assertEqual(len(sheets['distributed']), 3)
+        self.assertDictEqual(sheets['distributed'], sheets['local'])
+        # Both journals are in the reports
+        for rows in sheets['distributed'].values():
+            self.assertListEqual(rows[0][1:], ['ApJ..', 'MNRAS'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,14 +2,44 @@ import os
 import sys
 import unittest
 import httpretty
+import mock
 import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
 import urllib.request, urllib.parse, urllib.error
 from xreport.utils import _group
 from xreport.utils import _make_dict
 from xreport.utils import _get_citations
+from xreport.utils import _get_citations_from_facet
 from xreport.utils import _get_usage
 from xreport.utils import _get_facet_data
+from xreport.utils import _get_query_counts
 from xreport.utils import _get_records
+from xreport.utils import _iter_records
+from xreport.utils import _write_rows
+from xreport.utils import _write_coverage_grid
+from xreport.utils import _do_query
+from xreport.utils import _retry_delay
+from xreport.utils import _fetch_concurrent
+from xreport.utils import _run_dag
+from xreport.utils import _get_journal_completeness
+from xreport.utils import _get_pivot_data
+from xreport.utils import _get_fulltext_index
+from xreport.utils import _get_usage_aggregate
+from xreport.utils import _get_usage_for_query
+from xreport.utils import _find_bibcodes
+from xreport.utils import _get_reference_matching
+from xreport.utils import _get_reference_directory
+from xreport.utils import _scan_concurrent
+from xreport.utils import _count
+from xreport.utils import _reset_metrics
+from xreport.utils import _run_metrics
+from xreport.utils import _profile_block
+from xreport.utils import _write_manifest
+from xreport.utils import _write_prometheus_textfile
+from xreport.utils import _profile_run
 
 class TestMethods(unittest.TestCase):
 
@@ -33,10 +63,9 @@ class TestMethods(unittest.TestCase):
     
     @httpretty.activate
     def test_get_citations(self):
-        # Get the mock data
-        datafile = '{0}/xreport/tests/data/PivotDataYearCitCount.json'.format(self.proj_home)
-        with open(datafile) as mdata:
-            mockdata = json.load(mdata)
+        # The citation total comes from the stats component
+        mockdata = {'response': {'numFound': 18584, 'docs': []},
+                    'stats': {'stats_fields': {'citation_count': {'count': 18584, 'sum': 14338828.0}}}}
         # The URL to mock
         query_url = "{}/search/query".format(self.config['ADS_API_URL'])
         # Register the URL and mock data
@@ -50,6 +79,38 @@ class TestMethods(unittest.TestCase):
         q = "star"
         expected = 14338828
         self.assertEqual( _get_citations(self.config, q), expected)
+        self.assertEqual(httpretty.last_request().querystring['stats.field'], ['citation_count'])
+
+    @httpretty.activate
+    def test_get_citations_from_facet(self):
+        # Get the mock data, and turn the year/citation count pivot into a citation count facet
+        datafile = '{0}/xreport/tests/data/PivotDataYearCitCount.json'.format(self.proj_home)
+        with open(datafile) as mdata:
+            pivots = json.load(mdata)['facet_counts']['facet_pivot']['year,citation_count']
+        facet = {}
+        for entry in [e for p in pivots for e in p['pivot']]:
+            facet[entry['value']] = facet.get(entry['value'], 0) + entry['count']
+        values = sorted(facet.items())
+        def request_callback(request, uri, response_headers):
+            params = request.querystring
+            if 'stats.field' in params:
+                # No stats available
+                return [200, response_headers, json.dumps({'response': {'numFound': 18584, 'docs': []}})]
+            offset = int(params['facet.offset'][0])
+            page = values[offset:offset + int(params['facet.limit'][0])]
+            mockdata = {'facet_counts': {'facet_fields': {'citation_count': [x for v in page for x in (str(v[0]), v[1])]}}}
+            return [200, response_headers, json.dumps(mockdata)]
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=request_callback)
+        expected = 14338828
+        # Without stats the facet is used, and the total does not depend on the page size
+        self.assertEqual(_get_citations(self.config, "star"), expected)
+        self.assertEqual(_get_citations_from_facet(self.config, "star", limit=50), expected)
 
     @httpretty.activate
     def test_get_citations_500(self):
@@ -129,6 +190,68 @@ class TestMethods(unittest.TestCase):
         q = "star"
         expected = {904: 201, 900: 196, 889: 189, 897: 186, 891: 182, 905: 129}
         self.assertEqual(_get_facet_data(self.config, q, 'volume'), expected)
+        self.assertEqual(httpretty.last_request().querystring['facet.limit'], ['1000'])
+        # Results reaching the limit may be incomplete
+        with self.assertLogs('xreport.utils', level='WARNING') as logs:
+            self.assertEqual(_get_facet_data(self.config, q, 'volume', limit=6), expected)
+        self.assertIn('may be incomplete', logs.output[0])
+
+    @httpretty.activate
+    def test_get_query_counts(self):
+        # Mock data for a query with two facet queries
+        mockdata = {'response': {'numFound': 120, 'docs': []},
+                    'facet_counts': {'facet_queries': {'property:refereed': 100, 'property:data': 7}}}
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=json.dumps(mockdata))
+        facet_queries = {'refrecs': 'property:refereed', 'dlrecs': 'property:data', 'oarecs': 'property:openaccess'}
+        nrecs, counts = _get_query_counts(self.config, 'star', facet_queries)
+        self.assertEqual(nrecs, 120)
+        # Facet queries missing from the response have no matching records
+        self.assertDictEqual(counts, {'refrecs': 100, 'dlrecs': 7, 'oarecs': 0})
+        # All facet queries are sent with the same request, and no records are retrieved
+        self.assertListEqual(httpretty.last_request().querystring['facet.query'], list(facet_queries.values()))
+        self.assertListEqual(httpretty.last_request().querystring['rows'], ['0'])
+        # The citation total is retrieved with the same request, via the stats component
+        mockdata['stats'] = {'stats_fields': {'citation_count': {'sum': 14338828.0}}}
+        httpretty.register_uri(httpretty.GET, query_url, content_type='application/json', status=200, body=json.dumps(mockdata))
+        requests = len(httpretty.latest_requests())
+        nrecs, counts = _get_query_counts(self.config, 'star', facet_queries, citations=True)
+        self.assertDictEqual(counts, {'refrecs': 100, 'dlrecs': 7, 'oarecs': 0, 'citnum': 14338828})
+        self.assertEqual(len(httpretty.latest_requests()), requests + 1)
+        self.assertListEqual(httpretty.last_request().querystring['stats.field'], ['citation_count'])
+
+    @httpretty.activate
+    def test_get_pivot_data(self):
+        # Get the mock data for testing volume counts per bibstem
+        datafile = '{0}/xreport/tests/data/PivotDataBibstemVolume.json'.format(self.proj_home)
+        with open(datafile) as mdata:
+            mockdata = json.load(mdata)
+        # The URL to mock
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        # Register the URL and mock data
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=json.dumps(mockdata))
+        # Do the query
+        q = 'bibstem:("ApJ" OR "MNRAS")'
+        results = _get_pivot_data(self.config, q, 'bibstem,volume')
+        self.assertEqual(results['ApJ'], {904: 201, 900: 196, 889: 189, 897: 186, 891: 182, 905: 129})
+        # Volume numbers beyond 2100 are dropped, like for facet queries
+        self.assertEqual(results['MNRAS'], {499: 412, 500: 398})
+        self.assertEqual(httpretty.last_request().querystring['facet.pivot'], ['bibstem,volume'])
+        # If a journal has as many volumes as the facet limit, its data may have been truncated
+        results = _get_pivot_data(self.config, q, 'bibstem,volume', limit=3)
+        self.assertIsNone(results['ApJ'])
+        self.assertIsNone(results['MNRAS'])
+        self.assertEqual(results['ApJ..904'], {904: 201})
 
     @httpretty.activate
     def test_get_records(self):
@@ -150,6 +273,216 @@ class TestMethods(unittest.TestCase):
         expected = {'author_norm': ['Kobayashi, C', 'Karakas, A', 'Lugaro, M'], 'bibcode': '2020ApJ...900..179K', 
                     'citation_count': 152, 'title': ['The Origin of Elements from Carbon to Uranium']}
         self.assertEqual(_get_records(self.config, q, 'bibcode')[0], expected)
+        # Records are retrieved with a cursor, sorted on id
+        self.assertEqual(httpretty.last_request().querystring['cursorMark'], ['*'])
+        self.assertEqual(httpretty.last_request().querystring['sort'], ['id asc'])
+
+    @httpretty.activate
+    def test_iter_records(self):
+        '''Test retrieving records page by page with a cursor'''
+        pages = {'*': (['a', 'b'], 'c1'), 'c1': (['c', 'd'], 'c2'), 'c2': ([], 'c2')}
+        def request_callback(request, uri, response_headers):
+            docs, next_cursor = pages[request.querystring['cursorMark'][0]]
+            mockdata = {'response': {'numFound': 4, 'docs': [{'bibcode': b} for b in docs]},
+                        'nextCursorMark': next_cursor}
+            return [200, response_headers, json.dumps(mockdata)]
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=request_callback)
+        for prefetch in [False, True]:
+            requests_done = len(httpretty.latest_requests())
+            self.config['RECORDS_PREFETCH'] = prefetch
+            records = [r['bibcode'] for r in _iter_records(self.config, 'star', 'bibcode', rows=2)]
+            self.assertListEqual(records, ['a', 'b', 'c', 'd'])
+            # The last request returns no more records
+            self.assertEqual(len(httpretty.latest_requests()) - requests_done, 3)
+
+    @httpretty.activate
+    def test_do_query_retry(self):
+        '''Test that rate limited and unavailable responses are retried'''
+        # No need to wait between retries when testing
+        self.config['API_BACKOFF_FACTOR'] = 0
+        # The URL to mock
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        # First we get rate limited, then the service is unavailable and then we get data
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    responses=[
+                        httpretty.Response(body='', status=429, adding_headers={'Retry-After': '0'}),
+                        httpretty.Response(body='', status=503),
+                        httpretty.Response(body=json.dumps({'foo': 'bar'}), status=200, content_type='application/json')
+                    ])
+        self.assertEqual(_do_query(self.config, {'q': 'star'}), {'foo': 'bar'})
+        self.assertEqual(len(httpretty.latest_requests()), 3)
+
+    @httpretty.activate
+    def test_do_query_retry_exhausted(self):
+        '''Test that we give up when the API keeps failing'''
+        self.config['API_BACKOFF_FACTOR'] = 0
+        self.config['API_MAX_RETRIES'] = 2
+        # The URL to mock
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    status=503,
+                    body='')
+        expected = "Search API request with error code '503'"
+        with self.assertRaises(Exception) as context:
+            _do_query(self.config, {'q': 'star'})
+        self.assertEqual(str(context.exception), expected)
+        # The original request plus two retries
+        self.assertEqual(len(httpretty.latest_requests()), 3)
+
+    @httpretty.activate
+    def test_do_query_cache(self):
+        '''Test serving API requests from the response cache, and replaying them offline'''
+        tmpdir = tempfile.mkdtemp()
+        self.config['CACHE_DIRECTORY'] = tmpdir
+        self.config['USE_API_CACHE'] = True
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=json.dumps({'foo': 'bar'}))
+        try:
+            self.assertDictEqual(_do_query(self.config, {'q': 'star'}), {'foo': 'bar'})
+            self.assertDictEqual(_do_query(self.config, {'q': 'star'}), {'foo': 'bar'})
+            # The second request was served from the cache
+            self.assertEqual(len(httpretty.latest_requests()), 1)
+            # In offline mode, requests are only served from the cache
+            self.config['USE_API_CACHE'] = False
+            self.config['API_OFFLINE'] = True
+            self.assertDictEqual(_do_query(self.config, {'q': 'star'}), {'foo': 'bar'})
+            with self.assertRaises(Exception):
+                _do_query(self.config, {'q': 'galaxy'})
+            self.assertEqual(len(httpretty.latest_requests()), 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_retry_delay(self):
+        '''Test the backoff delay calculation'''
+        response = mock.Mock()
+        # Retry-After header in seconds takes precedence
+        response.headers = {'Retry-After': '7'}
+        self.assertEqual(_retry_delay(self.config, 0, response=response), 7.0)
+        # ... but is capped
+        response.headers = {'Retry-After': '7200'}
+        self.assertEqual(_retry_delay(self.config, 0, response=response), self.config['API_BACKOFF_MAX'])
+        # Without Retry-After we get exponential backoff with jitter
+        response.headers = {}
+        for attempt in range(4):
+            delay = _retry_delay(self.config, attempt, response=response)
+            self.assertTrue(0 <= delay <= self.config['API_BACKOFF_FACTOR'] * 2**attempt)
+
+    def test_fetch_concurrent(self):
+        '''Test running jobs concurrently'''
+        def square(x):
+            if x == 3:
+                raise ValueError('no threes')
+            return x*x
+        jobs = {('j{0}'.format(i), 'volume'): (square, (i,)) for i in range(10)}
+        for concurrency in [1, 4]:
+            self.config['MAX_API_CONCURRENCY'] = concurrency
+            results, errors = _fetch_concurrent(self.config, jobs)
+            # Results come back in the order of the jobs
+            expected = [('j{0}'.format(i), 'volume') for i in range(10) if i != 3]
+            self.assertListEqual(list(results.keys()), expected)
+            self.assertEqual(results[('j9', 'volume')], 81)
+            # The failing job does not affect the others
+            self.assertListEqual(list(errors.keys()), [('j3', 'volume')])
+            self.assertEqual(str(errors[('j3', 'volume')]), 'no threes')
+
+    @httpretty.activate
+    def test_get_journal_completeness(self):
+        '''Test getting metadata completeness from the Journals Database'''
+        details = [{'volume': '950', 'completeness_fraction': 0.9876}, {'volume': '950L', 'completeness_fraction': 0.5}]
+        responses = {
+            # Completeness details as Python literal, as JSON and not at all
+            'ApJ': str(details),
+            'MNRAS': json.dumps(details),
+            'AJ': None
+        }
+        for stem, value in responses.items():
+            master = {'bibstem': stem}
+            if value is not None:
+                master['completeness_details'] = value
+            httpretty.register_uri(
+                        httpretty.GET,
+                        "{}/journals/summary/{}".format(self.config['ADS_API_URL'], stem),
+                        content_type='application/json',
+                        status=200,
+                        body=json.dumps({'summary': {'master': master}}))
+        for stem in ['ApJ', 'MNRAS']:
+            completeness = _get_journal_completeness(self.config, stem)
+            self.assertDictEqual(completeness.to_dict(), {'950': 98.8, '950L': 50.0})
+        self.assertEqual(len(_get_journal_completeness(self.config, 'AJ')), 0)
+
+    def test_run_dag(self):
+        '''Test running jobs that depend on each other'''
+        import threading
+        finished = []
+        lock = threading.Lock()
+        def job(name, fail=False):
+            if fail:
+                raise ValueError('{0} failed'.format(name))
+            with lock:
+                finished.append(name)
+            return name.upper()
+        jobs = {
+            'a': (job, ('a',), []),
+            'b': (job, ('b',), []),
+            'c': (job, ('c',), ['a', 'b']),
+            'd': (job, ('d', True), ['a']),
+            'e': (job, ('e',), ['d'])
+        }
+        for workers in [1, 3]:
+            self.config['BATCH_WORKERS'] = workers
+            finished[:] = []
+            results, errors = _run_dag(self.config, jobs)
+            self.assertDictEqual(results, {'a': 'A', 'b': 'B', 'c': 'C'})
+            # Jobs only start when the jobs they depend on have finished
+            self.assertTrue(finished.index('c') > max(finished.index('a'), finished.index('b')))
+            # A failing job means that the jobs depending on it are not run
+            self.assertListEqual(sorted(errors.keys()), ['d', 'e'])
+            self.assertEqual(str(errors['e']), 'd failed')
+            self.assertNotIn('e', finished)
+        # Dependencies need to exist, and cannot be circular
+        with self.assertRaises(ValueError):
+            _run_dag(self.config, {'a': (job, ('a',), ['x'])})
+        with self.assertRaises(ValueError):
+            _run_dag(self.config, {'a': (job, ('a',), ['b']), 'b': (job, ('b',), ['a'])})
+
+    def test_get_fulltext_index(self):
+        '''Test loading the Classic full text index'''
+        self.config['CLASSIC_FULLTEXT_INDEX'] = '{0}/xreport/tests/data/fulltext.links'.format(self.proj_home)
+        # Use small chunks, to make sure results are combined properly
+        self.config['FULLTEXT_INDEX_CHUNKSIZE'] = 1000
+        # Make sure the index file gets parsed
+        self.config['USE_INDEX_CACHE'] = False
+        profiles = []
+        self.config['PROFILE_HOOK'] = lambda label, stats: profiles.append((label, stats))
+        ft_index = _get_fulltext_index(self.config, ['ApJ..', 'MNRAS'])
+        self.assertListEqual(list(ft_index.columns), ['bibstem', 'volume', 'source'])
+        self.assertEqual(str(ft_index['bibstem'].dtype), 'category')
+        self.assertEqual(str(ft_index['source'].dtype), 'category')
+        self.assertEqual(str(ft_index['volume'].dtype), 'int32')
+        # ApJ Letters get their own bibstem and A&A records were not included
+        expected = {'ApJ..': 15769, 'ApJL': 3762, 'MNRAS': 1104}
+        self.assertDictEqual(ft_index['bibstem'].value_counts().to_dict(), expected)
+        # Sources are lower case
+        self.assertEqual(len(ft_index.query("bibstem=='ApJ..' and source=='arxiv'")), 2)
+        # The profiling hook was called with statistics for the index
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0][1]['lines'], 22792)
+        self.assertEqual(profiles[0][1]['rows'], 20635)
 
     def test_get_usage(self):
         '''Test getting usage data'''
@@ -171,5 +504,240 @@ class TestMethods(unittest.TestCase):
         self.assertEqual(_get_usage(self.config, jrnls=journals), expected_journals_reads)
         self.assertEqual(_get_usage(self.config, jrnls=journals, udata='downloads'), expected_journals_downloads)
 
+    def test_get_usage_aggregate(self):
+        '''Test the aggregation of usage data per journal'''
+        self.config['CLASSIC_USAGE_INDEX'] = {
+            'reads':'{0}/xreport/tests/data/reads.links'.format(self.proj_home),
+            'downloads':'{0}/xreport/tests/data/downloads.links'.format(self.proj_home)
+        }
+        expected = {'A&A..': (466, 353), 'ApJ..': (681, 271), 'ApJS.': (173, 113), 'MNRAS': (975, 483)}
+        aggregate = _get_usage_aggregate(self.config)
+        self.assertDictEqual(aggregate['journals'], expected)
+        # Subsequent requests use the same aggregate
+        self.assertIs(_get_usage_aggregate(self.config), aggregate)
+        # Usage for a set of journals is the sum over these journals
+        self.assertEqual(_get_usage(self.config, jrnls=['ApJ..', 'MNRAS', 'ApJS.']), (1829, 867))
+        self.assertEqual(_get_usage(self.config, jrnls=['ApJ..', 'foo']), (681, 271))
+        # Bibcodes can be combined with journals, and unknown bibcodes are ignored
+        bibcodes = ['2022ApJ...924...44A', '2022A&A...660A..44K', '2022MNRAS.509...44W', '2022Foo...1....1X']
+        self.assertEqual(_get_usage(self.config, jrnls=['A&A..'], bibcodes=bibcodes), (167, 167))
+        # Without journals or bibcodes we get the total usage
+        self.assertEqual(_get_usage(self.config), (2295, 1220))
+
+    def test_find_bibcodes(self):
+        '''Test the binary search for bibcodes in sorted usage data'''
+        usage = {'bibcode': np.array([b'2022A&A...657A..44C', b'2022ApJ...924...44A', b'2022ApJ...924...44A',
+                                      b'2022MNRAS.509...44W'], dtype='S')}
+        # Bibcodes occurring more than once get all their positions, unknown bibcodes are ignored
+        rows = _find_bibcodes(usage, ['2022MNRAS.509...44W', '2022ApJ...924...44A', '2022Foo...1....1X'])
+        self.assertListEqual(sorted(rows.tolist()), [1, 2, 3])
+        self.assertEqual(len(_find_bibcodes(usage, [])), 0)
+
+    @httpretty.activate
+    def test_get_usage_for_query(self):
+        '''Test getting usage data for the records returned by a query'''
+        self.config['CLASSIC_USAGE_INDEX'] = {
+            'reads':'{0}/xreport/tests/data/reads.links'.format(self.proj_home),
+            'downloads':'{0}/xreport/tests/data/downloads.links'.format(self.proj_home)
+        }
+        # Records are returned in two pages, with one bibcode occurring on both pages
+        pages = [['2022ApJ...924...44A', '2022A&A...660A..44K'], ['2022MNRAS.509...44W', '2022ApJ...924...44A']]
+        cursors = ['*', 'page2', 'page2']
+        def request_callback(request, uri, response_headers):
+            page = cursors.index(request.querystring['cursorMark'][0])
+            mockdata = {'response': {'numFound': 4, 'docs': [{'bibcode': b} for b in pages[page]]},
+                        'nextCursorMark': cursors[page+1]}
+            return [200, response_headers, json.dumps(mockdata)]
+        query_url = "{}/search/query".format(self.config['ADS_API_URL'])
+        httpretty.register_uri(
+                    httpretty.GET,
+                    query_url,
+                    content_type='application/json',
+                    status=200,
+                    body=request_callback)
+        usage = _get_usage_for_query(self.config, 'star', batch_size=2)
+        self.assertEqual(len(httpretty.latest_requests()), 2)
+        self.assertDictEqual(usage, {'reads': (449, 288), 'downloads': (242, 167)})
+
+    def test_get_reference_matching(self):
+        '''Test tallying reference resolver results per source'''
+        basedir = '{0}/xreport/tests/data/references'.format(self.proj_home)
+        expected = {'publisher': [609, 21], 'crossref': [0, 0]}
+        self.assertDictEqual(_get_reference_matching(basedir, 'ApJ..', 900), expected)
+        expected = {'publisher': [0, 0], 'crossref': [0, 0]}
+        self.assertDictEqual(_get_reference_matching(basedir, 'ApJ..', 901), expected)
+        # Scores may be preceded by whitespace, and lines without a score are ignored
+        tmpdir = tempfile.mkdtemp()
+        try:
+            voldir = os.path.join(tmpdir, 'ApJ', '0950')
+            os.makedirs(voldir)
+            with open(os.path.join(voldir, '2023ApJ...950L...1X.xref.xml.result'), 'w') as fh:
+                fh.write('---<2023ApJ...950L...1X>---\n1 a\n  5 b\n0 c\n\n3 d\n1 e')
+            with open(os.path.join(voldir, '2023ApJ...950....2X.iopft.xml.result'), 'w') as fh:
+                fh.write('1 a\n1 b\n5 c\n')
+            expected = {'publisher': [2, 1], 'crossref': [2, 2]}
+            self.assertDictEqual(_get_reference_matching(tmpdir, 'ApJ..', 950), expected)
+            # ApJ Letters are found in the ApJ directories
+            expected = {'publisher': [0, 0], 'crossref': [2, 2]}
+            self.assertDictEqual(_get_reference_matching(tmpdir, 'ApJL', 950), expected)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_reference_directory(self):
+        '''Test the conventions for reference data directories'''
+        self.assertEqual(_get_reference_directory('/refs', 'A&A..', 300), ('/refs/A&A/0300', None))
+        self.assertEqual(_get_reference_directory('/refs', 'A&A..', 600), ('/refs/A+A/0600', None))
+        self.assertEqual(_get_reference_directory('/refs', 'A&AS.', 100), ('/refs/A&AS/0100', None))
+        self.assertEqual(_get_reference_directory('/refs', 'ApJL', 900), ('/refs/ApJ/0900', 'L'))
+        self.assertEqual(_get_reference_directory('/refs', 'ApJL', 500), ('/refs/ApJL/0500', None))
+
+    def test_scan_concurrent(self):
+        '''Test scanning reference data in parallel processes'''
+        basedir = '{0}/xreport/tests/data/references'.format(self.proj_home)
+        jobs = {('ApJ..', v): (_get_reference_matching, (basedir, 'ApJ..', v)) for v in [899, 900, 901]}
+        for workers in [1, 2]:
+            self.config['REFERENCE_SCAN_WORKERS'] = workers
+            results, errors = _scan_concurrent(self.config, jobs)
+            self.assertListEqual(list(results.keys()), list(jobs.keys()))
+            self.assertListEqual(results[('ApJ..', 900)]['publisher'], [609, 21])
+            self.assertDictEqual(errors, {})
+        # With other threads running, worker processes are not forked but spawned
+        import threading
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            with mock.patch('multiprocessing.get_context', wraps=__import__('multiprocessing').get_context) as get_context:
+                results, errors = _scan_concurrent(self.config, jobs)
+            get_context.assert_called_with('spawn')
+            self.assertListEqual(results[('ApJ..', 900)]['publisher'], [609, 21])
+            self.assertDictEqual(errors, {})
+        finally:
+            stop.set()
+            thread.join()
+        # In a daemonic process (like a Celery worker), the jobs run in the process itself
+        with mock.patch('multiprocessing.current_process', return_value=mock.Mock(daemon=True)), \
+             mock.patch('xreport.utils.ProcessPoolExecutor') as executor:
+            results, errors = _scan_concurrent(self.config, jobs)
+        executor.assert_not_called()
+        self.assertListEqual(results[('ApJ..', 900)]['publisher'], [609, 21])
+        self.assertDictEqual(errors, {})
+
+    def test_write_rows(self):
+        '''Test writing rows to spreadsheet and CSV files'''
+        header = ['bibcode', 'volume', 'title']
+        rows = [('2020ApJ...900...30P', '900', 'A title'), ('2020ApJ...901...31Y', '901', 'Another title')]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for extension in ['xlsx', 'csv']:
+                output_file = os.path.join(tmpdir, 'missing.{0}'.format(extension))
+                _write_rows(output_file, header, iter(rows))
+                if extension == 'xlsx':
+                    frame = pd.read_excel(output_file, header=None, dtype=str)
+                else:
+                    frame = pd.read_csv(output_file, header=None, dtype=str)
+                self.assertListEqual(frame.values.tolist(), [header] + [list(r) for r in rows])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_write_coverage_grid(self):
+        '''Test writing a coverage grid with cells colored by value'''
+        import openpyxl
+        rows = [['jrnl ->', 'ApJ..', 'MNRAS'], ['1', 95.0, ''], ['2', 65, 55.5], ['3', 75.2, float('nan')]]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            output_file = os.path.join(tmpdir, 'coverage.xlsx')
+            _write_coverage_grid(output_file, rows)
+            sheet = openpyxl.load_workbook(output_file).active
+            self.assertEqual(sheet.freeze_panes, 'B2')
+            values = [[c.value for c in row] for row in sheet.iter_rows()]
+            self.assertListEqual(values, [['jrnl ->', 'ApJ..', 'MNRAS'], ['1', 95, None], ['2', 65, 55.5], ['3', 75.2, None]])
+            # Text and empty strings are white, NaN values blue
+            colors = [[c.fill.fgColor.rgb[2:] for c in row] for row in sheet.iter_rows()]
+            expected = [['FFFFFF', 'FFFFFF', 'FFFFFF'], ['FFFFFF', '6AA84F', 'FFFFFF'],
+                        ['FFFFFF', 'FFE599', 'F4CCCC'], ['FFFFFF', 'CFE2F3', 'CFE2F3']]
+            self.assertListEqual(colors, expected)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_performance_metrics(self):
+        '''Test phase timings, counters and the performance manifest'''
+        _reset_metrics()
+        _count('api_calls')
+        _count('api_bytes', 1024)
+        for i in range(2):
+            with _profile_block(self.config, 'phase'):
+                pass
+        self.assertDictEqual(_run_metrics['counters'], {'api_calls': 1, 'api_bytes': 1024})
+        self.assertEqual(_run_metrics['phases']['phase']['calls'], 2)
+        # Counters increased in worker processes are added to the ones of this process
+        basedir = '{0}/xreport/tests/data/references'.format(self.proj_home)
+        jobs = {('ApJ..', v): (_get_reference_matching, (basedir, 'ApJ..', v)) for v in [899, 900, 901]}
+        scanned = {}
+        for workers in [1, 2]:
+            _reset_metrics()
+            self.config['REFERENCE_SCAN_WORKERS'] = workers
+            _scan_concurrent(self.config, jobs)
+            scanned[workers] = dict(_run_metrics['counters'])
+        self.assertGreater(scanned[1]['reference_files'], 0)
+        self.assertDictEqual(scanned[1], scanned[2])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            manifest_file = os.path.join(tmpdir, 'performance.json')
+            manifest = _write_manifest(manifest_file, {'collection': 'AST'})
+            with open(manifest_file) as fh:
+                self.assertDictEqual(json.load(fh), manifest)
+            self.assertDictEqual(manifest['run'], {'collection': 'AST'})
+            self.assertDictEqual(manifest['counters'], scanned[2])
+            self.assertGreater(manifest['peak_rss']['self'], 0)
+            self.assertIn('hits', manifest['api_cache'])
+            prom_file = os.path.join(tmpdir, 'xreport.prom')
+            _write_prometheus_textfile(prom_file, manifest, labels={'collection': 'AST'})
+            with open(prom_file) as fh:
+                metrics = fh.read().splitlines()
+            self.assertIn('xreport_counter{{collection="AST",counter="reference_files"}} {0}'.format(scanned[2]['reference_files']), metrics)
+            # No temporary files are left behind
+            self.assertListEqual(sorted(os.listdir(tmpdir)), ['performance.json', 'xreport.prom'])
+        finally:
+            shutil.rmtree(tmpdir)
+        _reset_metrics()
+
+    def test_profile_run(self):
+        '''Test profiling a run with the sampling profiler and with cProfile'''
+        def busy():
+            return sum([len(str(i)) for i in range(50000)])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # Profiling is opt-in
+            self.config['PROFILE_RUN'] = False
+            with _profile_run(self.config, os.path.join(tmpdir, 'disabled')) as profile_dir:
+                busy()
+            self.assertIsNone(profile_dir)
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'disabled')))
+            self.config['PROFILE_RUN'] = True
+            self.config['PROFILE_SAMPLE_INTERVAL'] = 0.001
+            self.config['PROFILE_TRACE_FRAMES'] = 1
+            self.config['PROFILE_MODE'] = 'sampling'
+            with _profile_run(self.config, os.path.join(tmpdir, 'sampling')):
+                busy()
+            self.assertListEqual(sorted(os.listdir(os.path.join(tmpdir, 'sampling'))), ['allocations.txt', 'stacks.folded'])
+            with open(os.path.join(tmpdir, 'sampling', 'stacks.folded')) as fh:
+                stacks = [line.rsplit(' ', 1) for line in fh.read().splitlines()]
+            self.assertTrue(stacks)
+            self.assertTrue([s for s, n in stacks if 'test_profile_run (test_utils.py' in s and 'busy (test_utils.py' in s])
+            self.assertTrue(all([n.isdigit() for s, n in stacks]))
+            self.config['PROFILE_MODE'] = 'cprofile'
+            with _profile_run(self.config, os.path.join(tmpdir, 'cprofile')):
+                busy()
+            self.assertListEqual(sorted(os.listdir(os.path.join(tmpdir, 'cprofile'))), ['allocations.txt', 'profile.pstats', 'profile.txt'])
+            with open(os.path.join(tmpdir, 'cprofile', 'profile.txt')) as fh:
+                self.assertIn('busy', fh.read())
+            self.config['PROFILE_MODE'] = 'unknown'
+            with self.assertRaises(ValueError):
+                with _profile_run(self.config, os.path.join(tmpdir, 'unknown')):
+                    pass
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -1,10 +1,38 @@
 import re
 import os
+import ast
 import sys
+import json
+import hashlib
+import time
+import random
+import threading
+import multiprocessing
 import urllib.request, urllib.parse, urllib.error
+import csv
 import requests
-import math
-from datetime import date
+import resource
+import functools
+import cProfile
+import pstats
+import tracemalloc
+import openpyxl
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures import Future
+from xreport.cache import _load_cached_arrays
+from xreport.cache import _store_cached_arrays
+from xreport.cache import _frame_to_arrays
+from xreport.cache import _arrays_to_frame
+from xreport.cache import _get_cached_response
+from xreport.cache import _store_cached_response
+from xreport.cache import _response_cache_stats
+from datetime import datetime
+from email.utils import parsedate_to_datetime
 # ============================= INITIALIZATION ==================================== #
 
 from adsputils import setup_logging, load_config
@@ -57,26 +85,337 @@ def _make_dict(tup, key_is_int=True):
         newtup = [(int(re.sub("[^0-9]", "", e[0])), e[1]) for e in tup]        
     return dict(newtup)
 
+# Performance metrics for a run: the time spent in (and number of calls of) the profiled phases
+# (see _profile_block) and counters for API calls, bytes received, files and lines scanned etc.
+_run_metrics = {'phases': {}, 'counters': {}}
+_metrics_lock = threading.Lock()
+
+def _count(counter, n=1):
+    """
+    Increase a performance counter
+    
+    param: counter: the name of the counter
+    param: n: the amount to increase the counter with
+    """
+    with _metrics_lock:
+        _run_metrics['counters'][counter] = _run_metrics['counters'].get(counter, 0) + n
+
+def _reset_metrics():
+    """
+    Reset all performance metrics (phase timings and counters)
+    """
+    with _metrics_lock:
+        _run_metrics['phases'] = {}
+        _run_metrics['counters'] = {}
+
+def _peak_rss():
+    """
+    Return the peak resident set size (in bytes) of this process and of its (finished)
+    child processes, e.g. those used for scanning reference data
+    """
+    # On Linux, ru_maxrss is in kilobytes (on macOS in bytes)
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    }
+
+@contextmanager
+def _profile_block(conf, label):
+    """
+    Profiling hook: measure the time (and, if PROFILE_MEMORY is set, the peak memory
+    allocated) for a block of code. The code in the block can add its own statistics
+    to the dictionary that is yielded. The results are logged and, if a PROFILE_HOOK
+    function has been specified, passed on to that function
+    
+    param: conf: dictionary with configuration values
+    param: label: description of the code block being profiled
+    """
+    stats = {}
+    trace_memory = conf.get('PROFILE_MEMORY', False)
+    if trace_memory:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            # Python 3.9+ only
+            tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats['seconds'] = round(time.perf_counter() - start, 3)
+        if trace_memory:
+            stats['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        logger.info("Profile for {0}: {1}".format(label, ", ".join(["{0}={1}".format(k, v) for k, v in stats.items()])))
+        with _metrics_lock:
+            phase = _run_metrics['phases'].setdefault(label, {'calls': 0, 'seconds': 0.0})
+            phase['calls'] += 1
+            phase['seconds'] = round(phase['seconds'] + stats['seconds'], 3)
+            if 'peak_memory' in stats:
+                phase['peak_memory'] = max(phase.get('peak_memory', 0), stats['peak_memory'])
+        hook = conf.get('PROFILE_HOOK')
+        if callable(hook):
+            hook(label, stats)
+
+@contextmanager
+def _profile_run(conf, output_dir):
+    """
+    Profiling hook for a complete run (enabled by PROFILE_RUN): profile the code in the block,
+    with a sampling profiler (the stacks of all threads are sampled every PROFILE_SAMPLE_INTERVAL
+    seconds) or with cProfile (PROFILE_MODE), and trace memory allocations. Written to output_dir:
+    - stacks.folded: sampled stacks in the folded format used by flamegraph tools (sampling)
+    - profile.pstats and profile.txt: the cProfile statistics, raw and as text (cProfile)
+    - allocations.txt: the PROFILE_TOP_ALLOCATIONS code lines allocating most memory
+    Only the current process is profiled. When PROFILE_RUN is not set, this does nothing.
+    
+    param: conf: dictionary with configuration values
+    param: output_dir: the directory to write the profile files to
+    """
+    if not conf.get('PROFILE_RUN', False):
+        yield None
+        return
+    mode = conf.get('PROFILE_MODE', 'sampling')
+    if mode not in ['sampling', 'cprofile']:
+        raise ValueError('Unknown profiling mode: {0}'.format(mode))
+    os.makedirs(output_dir, exist_ok=True)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(conf.get('PROFILE_TRACE_FRAMES', 1))
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        samples = {}
+        stop = threading.Event()
+        sampler = threading.Thread(target=_sample_stacks, args=(stop, conf.get('PROFILE_SAMPLE_INTERVAL', 0.01), samples), daemon=True)
+        sampler.start()
+    try:
+        yield output_dir
+    finally:
+        if mode == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(os.path.join(output_dir, 'profile.pstats'))
+            with open(os.path.join(output_dir, 'profile.txt'), 'w') as fh:
+                pstats.Stats(profiler, stream=fh).sort_stats('cumulative').print_stats(conf.get('PROFILE_TOP_FUNCTIONS', 100))
+        else:
+            stop.set()
+            sampler.join()
+            with open(os.path.join(output_dir, 'stacks.folded'), 'w') as fh:
+                for stack, count in sorted(samples.items()):
+                    fh.write("{0} {1}\n".format(stack, count))
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')
+        ])
+        if started_tracing:
+            tracemalloc.stop()
+        with open(os.path.join(output_dir, 'allocations.txt'), 'w') as fh:
+            for stat in snapshot.statistics('traceback')[:conf.get('PROFILE_TOP_ALLOCATIONS', 25)]:
+                fh.write("{0}\n".format(stat))
+                for line in stat.traceback.format():
+                    fh.write("    {0}\n".format(line.strip()))
+        logger.info("Profile of run written to {0}".format(output_dir))
+
+def _sample_stacks(stop, interval, samples):
+    """
+    Sample the stacks of all (other) threads every interval seconds, until stop is set.
+    Stacks are counted in samples, as semicolon separated frames (outermost first)
+    
+    param: stop: event to signal that sampling should stop
+    param: interval: the time between samples (in seconds)
+    param: samples: dictionary to count the sampled stacks in
+    """
+    own = threading.get_ident()
+    while not stop.wait(interval):
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{0} ({1}:{2})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            samples[key] = samples.get(key, 0) + 1
+
+def _profiled(method):
+    """
+    Decorator for methods of report classes: every call of the method is profiled
+    (see _profile_block), with the qualified name of the method as label
+    
+    param: method: the method to profile
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with _profile_block(self.config, method.__qualname__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _write_manifest(output_file, run_info):
+    """
+    Write the performance manifest for a run (as JSON): information about the run, the
+    time spent in the profiled phases, the performance counters, the API response cache
+    statistics and the peak memory use
+    
+    param: output_file: path of the manifest file
+    param: run_info: dictionary with information about the run (e.g. collection and format)
+    """
+    with _metrics_lock:
+        manifest = {
+            'run': run_info,
+            'phases': {k: dict(v) for k, v in _run_metrics['phases'].items()},
+            'counters': dict(_run_metrics['counters'])
+        }
+    manifest['api_cache'] = dict(_response_cache_stats)
+    manifest['peak_rss'] = _peak_rss()
+    with open(output_file, 'w') as fh:
+        json.dump(manifest, fh, indent=2, default=str)
+    return manifest
+
+def _write_prometheus_textfile(output_file, manifest, labels={}):
+    """
+    Write the metrics from a performance manifest in the Prometheus text format, for the
+    textfile collector of the node exporter. The file is written under a temporary name and
+    then renamed, so that the collector never reads a partially written file
+    
+    param: output_file: path of the metrics file (should end in .prom)
+    param: manifest: the performance manifest (see _write_manifest)
+    param: labels: dictionary with labels to add to all metrics (e.g. collection and format)
+    """
+    def metric(name, value, extra={}):
+        all_labels = {**labels, **extra}
+        label_str = ",".join(['{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in all_labels.items()])
+        return "{0}{{{1}}} {2}".format(name, label_str, value) if label_str else "{0} {1}".format(name, value)
+    lines = ['# HELP xreport_phase_seconds Time spent in a phase of the report run',
+             '# TYPE xreport_phase_seconds gauge']
+    lines += [metric('xreport_phase_seconds', v['seconds'], {'phase': k}) for k, v in manifest['phases'].items()]
+    lines += ['# HELP xreport_phase_calls Number of calls of a phase of the report run',
+              '# TYPE xreport_phase_calls gauge']
+    lines += [metric('xreport_phase_calls', v['calls'], {'phase': k}) for k, v in manifest['phases'].items()]
+    lines += ['# HELP xreport_counter Performance counters of the report run (API calls, bytes received, files scanned etc.)',
+              '# TYPE xreport_counter gauge']
+    lines += [metric('xreport_counter', v, {'counter': k}) for k, v in manifest['counters'].items()]
+    lines += [metric('xreport_counter', v, {'counter': 'api_cache_{0}'.format(k)}) for k, v in manifest['api_cache'].items()]
+    lines += ['# HELP xreport_peak_rss_bytes Peak resident set size of the report run',
+              '# TYPE xreport_peak_rss_bytes gauge']
+    lines += [metric('xreport_peak_rss_bytes', v, {'process': k}) for k, v in manifest['peak_rss'].items()]
+    tmp_file = "{0}.{1}.tmp".format(output_file, os.getpid())
+    with open(tmp_file, 'w') as fh:
+        fh.write("\n".join(lines) + "\n")
+    os.replace(tmp_file, output_file)
+
+# The HTTP client used for all ADS API requests: a single pooled session per process,
+# so that connections are kept alive and reused between queries
+_session = None
+_session_lock = threading.Lock()
+
+def _get_session(conf):
+    """
+    Return the module-level HTTP session, creating it on first use
+    
+    param: conf: dictionary with configuration values
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = conf.get('API_POOL_SIZE', 10)
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept': 'application/json', 'Connection': 'keep-alive'})
+            _session = session
+    return _session
+
+def _reset_session():
+    """
+    Close the module-level HTTP session, so that the next request creates a new one
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+def _retry_delay(conf, attempt, response=None):
+    """
+    Determine how long to wait before retrying a failed API request. If the API told
+    us how long to wait (Retry-After header), that takes precedence. Otherwise we use
+    exponential backoff with (full) jitter
+    
+    param: conf: dictionary with configuration values
+    param: attempt: the number of the retry (starting at 0)
+    param: response: the response of the failed request, if any
+    """
+    max_delay = conf.get('API_BACKOFF_MAX', 60)
+    retry_after = None
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return min(max_delay, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+        try:
+            then = parsedate_to_datetime(retry_after)
+            return min(max_delay, max(0.0, (then - datetime.now(then.tzinfo)).total_seconds()))
+        except (TypeError, ValueError):
+            pass
+    delay = min(max_delay, conf.get('API_BACKOFF_FACTOR', 0.5) * (2 ** attempt))
+    return random.uniform(0, delay)
+
 def _do_query(conf, params, endpoint='search/query'):
     """
     Send of a query to the ADS API (essentially, any API defined by config values)
+    Requests go through the pooled session and are retried (with backoff) when the
+    API is temporarily unavailable or rate limiting us. Responses are served from
+    (and stored in) the API response cache, if it is enabled
     
     param: conf: dictionary with configuration values
     param: params: idctionary with query parameters
     """
+    cached = _get_cached_response(conf, endpoint, params)
+    if cached is not None:
+        return cached
+    if conf.get('API_OFFLINE', False):
+        msg = "No cached response for Search API request (offline mode): {0} {1}".format(endpoint, params)
+        logger.error(msg)
+        raise Exception(msg)
     headers = {}
     headers["Authorization"] = "Bearer:{}".format(conf['ADS_API_TOKEN'])
-    headers["Accept"] = "application/json"
     if isinstance(params, str):
         url = "{}/{}/{}".format(conf['ADS_API_URL'], endpoint, params)
     else:
-        url = "{}/{}?{}".format(conf['ADS_API_URL'], endpoint, urllib.parse.urlencode(params))
+        url = "{}/{}?{}".format(conf['ADS_API_URL'], endpoint, urllib.parse.urlencode(params, doseq=True))
+    session = _get_session(conf)
+    max_retries = conf.get('API_MAX_RETRIES', 5)
+    retry_status = conf.get('API_RETRY_STATUS', [429, 502, 503, 504])
     r_json = {}
-    try:
-        r = requests.get(url, headers=headers)
-    except Exception as err:
-        logger.error("Search API request failed: {}".format(err))
-        raise
+    attempt = 0
+    while True:
+        try:
+            r = session.get(url, headers=headers, timeout=conf.get('API_TIMEOUT', 60))
+            _count('api_calls')
+            _count('api_bytes', len(r.content))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+            if attempt >= max_retries:
+                logger.error("Search API request failed: {}".format(err))
+                raise
+            delay = _retry_delay(conf, attempt)
+            logger.warning("Search API request failed: {0}. Retrying in {1:.1f} seconds".format(err, delay))
+        except Exception as err:
+            logger.error("Search API request failed: {}".format(err))
+            raise
+        else:
+            if r.status_code not in retry_status or attempt >= max_retries:
+                break
+            delay = _retry_delay(conf, attempt, response=r)
+            logger.warning("Search API request with error code '{0}'. Retrying in {1:.1f} seconds".format(r.status_code, delay))
+        time.sleep(delay)
+        attempt += 1
     if not r.ok:
         msg = "Search API request with error code '{}'".format(r.status_code)
         logger.error(msg)
@@ -89,43 +428,373 @@ def _do_query(conf, params, endpoint='search/query'):
             logger.error(msg)
             raise Exception(msg)
         else:
+            _store_cached_response(conf, endpoint, params, r_json)
             return r_json
     return r_json
 
+def _fetch_concurrent(conf, jobs):
+    """
+    Run a set of data retrieval jobs (typically API queries) concurrently, with at most
+    MAX_API_CONCURRENCY jobs running at the same time. Results and errors are returned
+    in the order in which the jobs were specified, regardless of the order in which
+    they finish. A failing job does not affect the others.
+    
+    param: conf: dictionary with configuration values
+    param: jobs: dictionary keyed on a job identifier, with (function, args) tuples as values
+    """
+    return _run_concurrent(jobs, conf.get('MAX_API_CONCURRENCY', 1), ThreadPoolExecutor)
+
+# Memoized data (see _memo_claim) are shared between threads
+_memo_lock = threading.Lock()
+
+def _memo_claim(memo, keys):
+    """
+    Look up data in a memo (a dictionary shared by e.g. the reports made in parallel in a batch
+    run), and claim the entries that are not there yet: the caller retrieves the data for those,
+    and stores them with _memo_settle. Entries are futures, so that data being retrieved by
+    another thread are waited for instead of retrieved again. Returns the futures for all keys,
+    and those for the claimed keys
+    
+    param: memo: dictionary with futures, keyed on data identifier
+    param: keys: the identifiers of the data needed
+    """
+    futures = {}
+    claimed = {}
+    with _memo_lock:
+        for key in keys:
+            if key not in memo:
+                memo[key] = claimed[key] = Future()
+            futures[key] = memo[key]
+    return futures, claimed
+
+def _memo_settle(memo, claimed, results, errors):
+    """
+    Store the results for claimed memo entries (see _memo_claim). Entries for which retrieval
+    failed (or that were not retrieved at all) are removed, so that they can be tried again
+    
+    param: memo: dictionary with futures, keyed on data identifier
+    param: claimed: the futures for the claimed keys
+    param: results: dictionary with the data retrieved, keyed on data identifier
+    param: errors: dictionary with exceptions, keyed on data identifier
+    """
+    for key, future in claimed.items():
+        if key in results:
+            future.set_result(results[key])
+            continue
+        with _memo_lock:
+            if memo.get(key) is future:
+                del memo[key]
+        future.set_exception(errors.get(key, Exception('No data retrieved for {0}'.format(key))))
+
+def _memo_collect(futures):
+    """
+    Wait for memo entries (see _memo_claim), and return the results and errors, keyed on
+    data identifier, in the order of the futures
+    
+    param: futures: dictionary with futures, keyed on data identifier
+    """
+    results = {}
+    errors = {}
+    for key, future in futures.items():
+        try:
+            results[key] = future.result()
+        except Exception as err:
+            errors[key] = err
+    return results, errors
+
+def _scan_concurrent(conf, jobs):
+    """
+    Run a set of file scanning jobs (CPU and I/O bound) in a pool of REFERENCE_SCAN_WORKERS
+    processes. Results and errors are returned in the order in which the jobs were specified.
+    Job functions and their arguments need to be picklable (i.e. module level functions)
+    
+    param: conf: dictionary with configuration values
+    param: jobs: dictionary keyed on a job identifier, with (function, args) tuples as values
+    """
+    counted = {key: (_run_counted, (func, args)) for key, (func, args) in jobs.items()}
+    executor_class = ProcessPoolExecutor
+    if threading.active_count() > 1:
+        # Forking a process with other threads running (e.g. in a batch run) may deadlock
+        # the worker processes, so these are started fresh instead
+        executor_class = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn'))
+    max_workers = conf.get('REFERENCE_SCAN_WORKERS', 1)
+    if multiprocessing.current_process().daemon:
+        # Daemonic processes (e.g. Celery prefork workers) are not allowed to have children,
+        # so the jobs are run in this process
+        max_workers = 1
+    results, errors = _run_concurrent(counted, max_workers, executor_class)
+    for key, (result, counters, pid) in results.items():
+        results[key] = result
+        # Counters increased in worker processes are added to the ones of this process
+        if pid != os.getpid():
+            for counter, n in counters.items():
+                _count(counter, n)
+    return results, errors
+
+def _run_counted(func, args):
+    """
+    Run a job, and return its result together with the increase of the performance counters
+    while it ran and the id of the process it ran in (see _scan_concurrent)
+    
+    param: func: the job function
+    param: args: the arguments for the job function
+    """
+    before = dict(_run_metrics['counters'])
+    result = func(*args)
+    counters = {k: v - before.get(k, 0) for k, v in _run_metrics['counters'].items() if v != before.get(k, 0)}
+    return result, counters, os.getpid()
+
+def _run_concurrent(jobs, max_workers, executor_class):
+    """
+    Run a set of jobs with at most max_workers of them running at the same time, and
+    return the results and errors, keyed on job identifier, in the order of the jobs
+    
+    param: jobs: dictionary keyed on a job identifier, with (function, args) tuples as values
+    param: max_workers: the maximum number of jobs running at the same time
+    param: executor_class: the type of executor (thread or process pool) to run jobs with
+    """
+    results = {}
+    errors = {}
+    max_workers = min(max_workers or 1, len(jobs))
+    if max_workers <= 1:
+        # No need for threads or processes
+        for key, (func, args) in jobs.items():
+            try:
+                results[key] = func(*args)
+            except Exception as err:
+                errors[key] = err
+        return results, errors
+    with executor_class(max_workers=max_workers) as executor:
+        futures = [(key, executor.submit(func, *args)) for key, (func, args) in jobs.items()]
+        for key, future in futures:
+            try:
+                results[key] = future.result()
+            except Exception as err:
+                errors[key] = err
+    return results, errors
+
+def _run_dag(conf, jobs):
+    """
+    Run a set of jobs that depend on each other (a directed acyclic graph) in a pool of
+    BATCH_WORKERS threads. A job is started as soon as all jobs it depends on have finished
+    successfully, so that independent jobs run in parallel. Jobs that depend on a failed
+    job are not run, and get the error of that job
+    
+    param: conf: dictionary with configuration values
+    param: jobs: dictionary keyed on a job identifier, with (function, args, dependencies) tuples
+                 as values, where dependencies is a list of job identifiers
+    """
+    for key, (func, args, dependencies) in jobs.items():
+        unknown = [d for d in dependencies if d not in jobs]
+        if unknown:
+            raise ValueError("Job {0} depends on unknown job(s): {1}".format(key, unknown))
+    results = {}
+    errors = {}
+    pending = dict(jobs)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, conf.get('BATCH_WORKERS', 1))) as executor:
+        while pending or running:
+            for key, (func, args, dependencies) in list(pending.items()):
+                failed = [d for d in dependencies if d in errors]
+                if failed:
+                    errors[key] = errors[failed[0]]
+                    del pending[key]
+                elif all(d in results for d in dependencies):
+                    running[executor.submit(func, *args)] = key
+                    del pending[key]
+            if not running:
+                if pending:
+                    raise ValueError("Circular dependencies between jobs: {0}".format(list(pending.keys())))
+                break
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    results[key] = future.result()
+                except Exception as err:
+                    errors[key] = err
+    return results, errors
+
+def _write_rows(output_file, header, rows):
+    """
+    Write a header and rows of data to a spreadsheet (.xlsx) or CSV (.csv) file, one row at
+    a time. Spreadsheets are written with a write-only workbook, which streams the rows to
+    file instead of keeping the whole sheet in memory
+    
+    param: output_file: path of the output file (the extension determines the format)
+    param: header: the header row
+    param: rows: iterable of rows (lists or tuples of values)
+    """
+    if output_file.endswith('.csv'):
+        with open(output_file, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(output_file)
+
+# Cell colors in coverage spreadsheets: numeric values of at least 90 are green, values of 60
+# and lower red, values between 60 and 70 yellow and other values blue. Non-numeric cells are white.
+_COVERAGE_COLORS = ['FFFFFF', '6AA84F', 'F4CCCC', 'FFE599', 'CFE2F3']
+
+def _coverage_colors(rows):
+    """
+    Determine, for all cells of a coverage grid at once, the index of their color
+    in _COVERAGE_COLORS
+
+    param: rows: list of rows (all of the same length)
+    """
+    values = np.array(rows, dtype=object)
+    is_number = np.frompyfunc(lambda v: isinstance(v, (int, float, np.number)) and not isinstance(v, bool), 1, 1)(values).astype(bool)
+    numbers = np.where(is_number, values, np.nan).astype(float)
+    with np.errstate(invalid='ignore'):
+        colors = np.select([numbers >= 90, numbers <= 60, (numbers > 60) & (numbers <= 70)], [1, 2, 3], default=4)
+    return np.where(is_number, colors, 0)
+
+def _write_coverage_grid(output_file, rows):
+    """
+    Write a coverage grid to a spreadsheet with the first row and column frozen. The
+    cells are colored by their value (see _COVERAGE_COLORS), using fills that are
+    determined up front for the whole grid
+
+    param: output_file: path of the output (.xlsx) file
+    param: rows: list of rows (all of the same length), the first row being the header
+    """
+    colors = _coverage_colors(rows)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.freeze_panes = 'B2'
+    # Registering a fill with the workbook is expensive, so this is done once per color,
+    # after which cells just get the style of the corresponding template cell
+    styles = []
+    for c in _COVERAGE_COLORS:
+        template = openpyxl.cell.WriteOnlyCell(sheet)
+        template.fill = openpyxl.styles.PatternFill(fill_type='solid', fgColor=c)
+        styles.append(template._style)
+    for row, row_colors in zip(rows, colors.tolist()):
+        cells = []
+        for value, color in zip(row, row_colors):
+            if value == '' or (color == 4 and value != value):
+                # Empty strings and NaN values are written as empty cells
+                value = None
+            cell = openpyxl.cell.WriteOnlyCell(sheet, value=value)
+            cell._style = styles[color]
+            cells.append(cell)
+        sheet.append(cells)
+    workbook.save(output_file)
+
 # =============================== DATA RETRIEVAL FUNCTIONS ==================== #
 
 def _get_citations(conf, query_string):
     """
-    Get citation counts via ADS API pivot query
+    Get the total number of citations for the records matching a query: the sum of
+    their citation counts, as calculated by the Solr stats component. If no stats are
+    returned, the total is calculated from the citation count facet instead
     
     param: conf: dictionary with configuration values
-    param: query_string: the query string to execute pivot query on
+    param: query_string: the query string to get the citation total for
     """
-    # creating the date object of today's date
-    todays_date = date.today()
     params = {
-            'facet': 'true',
-            'facet.limit': 2000,
-            'facet.minCount': '1',
-            'facet.pivot': 'year,citation_count',
             'q': query_string,
-            'sort': 'citation_count desc'
+            'fl': 'id',
+            'rows': 0,
+            'stats': 'true',
+            'stats.field': 'citation_count'
         }
     query_data = _do_query(conf, params)
-    pivots_data = query_data['facet_counts']['facet_pivot'].get('year,citation_count')
-    data =[item for sublist in [p['pivot'] for p in pivots_data] for item in sublist]
-    # The total number of citations is the sum of each citation value times its multiplicity
-    total_cites = sum([e['count']*e['value'] for e in data])
+    return _citations_from_stats(conf, query_string, query_data)
+
+def _citations_from_stats(conf, query_string, query_data):
+    """
+    Get the total number of citations from the stats in the response to a query with
+    stats.field=citation_count. If no stats were returned, the total is calculated from
+    the citation count facet instead
+
+    param: conf: dictionary with configuration values
+    param: query_string: the query string the response is for
+    param: query_data: the (decoded JSON) response
+    """
+    try:
+        return int(query_data['stats']['stats_fields']['citation_count']['sum'] or 0)
+    except (KeyError, TypeError):
+        logger.warning("No citation stats returned for query {0}, using citation count facet".format(query_string))
+    return _get_citations_from_facet(conf, query_string)
+
+def _get_citations_from_facet(conf, query_string, limit=2000):
+    """
+    Get the total number of citations for the records matching a query from the citation
+    count facet: the sum of each citation value times its multiplicity. The facet values
+    are retrieved page by page, so that none are left out
+    
+    param: conf: dictionary with configuration values
+    param: query_string: the query string to get the citation total for
+    param: limit: the number of facet values per page
+    """
+    total_cites = 0
+    offset = 0
+    while True:
+        params = {
+            'q': query_string,
+            'fl': 'id',
+            'rows': 0,
+            'facet': 'on',
+            'facet.field': 'citation_count',
+            'facet.limit': limit,
+            'facet.offset': offset,
+            'facet.mincount': 1,
+            'facet.sort': 'index'
+        }
+        query_data = _do_query(conf, params)
+        data = list(_group(query_data['facet_counts']['facet_fields'].get('citation_count', []), 2))
+        total_cites += sum([int(value)*count for value, count in data])
+        if len(data) < limit:
+            break
+        offset += limit
     
     return total_cites
 
-def _get_facet_data(conf, query_string, facet):
+def _get_query_counts(conf, query_string, facet_queries={}, citations=False):
+    """
+    Get the number of records matching a query and, with the same ADS API query, the
+    numbers of those records that also match each of a set of facet queries and
+    (optionally) their total number of citations, stored under 'citnum' (see _get_citations)
+    
+    param: conf: dictionary with configuration values
+    param: query_string: the query string to count records for
+    param: facet_queries: dictionary with facet query strings, keyed on a label
+    param: citations: whether to get the total number of citations as well
+    """
+    params = {
+        'q': query_string,
+        'fl': 'id',
+        'rows': 0
+    }
+    if facet_queries:
+        params['facet'] = 'on'
+        params['facet.query'] = list(dict.fromkeys(facet_queries.values()))
+    if citations:
+        params['stats'] = 'true'
+        params['stats.field'] = 'citation_count'
+    data = _do_query(conf, params)
+    results = data.get('facet_counts', {}).get('facet_queries', {})
+    counts = {label: results.get(fq, 0) for label, fq in facet_queries.items()}
+    if citations:
+        counts['citnum'] = _citations_from_stats(conf, query_string, data)
+    return data['response']['numFound'], counts
+
+def _get_facet_data(conf, query_string, facet, limit=1000):
     """
     Do an ADS API facet query
     
     param: conf: dictionary with configuration values
     param: query_string: the query string to execute pivot query on
     param: facet: the facet to return
+    param: limit: the maximum number of facet values to return
     """
     params = {
         'q':query_string,
@@ -133,7 +802,7 @@ def _get_facet_data(conf, query_string, facet):
         'rows': 1,
         'facet':'on',
         'facet.field': facet,
-        'facet.limit': 1000,
+        'facet.limit': limit,
         'facet.mincount': 1,
         'facet.offset':0,
         'sort':'date desc'
@@ -141,8 +810,20 @@ def _get_facet_data(conf, query_string, facet):
 
     data = _do_query(conf, params)
     results = data['facet_counts']['facet_fields'].get(facet)
+    if len(results) // 2 >= limit:
+        logger.warning("Facet query for {0} returned {1} values, the maximum: results for query {2} may be incomplete".format(facet, limit, query_string))
     # Return a dictionary with facet values and associated frequencies
-    res_dict = _make_dict(list(_group(results, 2)))
+    return _facet_dict(list(_group(results, 2)), facet)
+
+def _facet_dict(tup, facet):
+    """
+    Turn a list of (facet value, frequency) tuples into a dictionary keyed on (integer)
+    facet value. Volume numbers that are really years or other large numbers are dropped
+    
+    param: tup: list of tuples
+    param: facet: the facet the values belong to
+    """
+    res_dict = _make_dict(tup)
     if facet == 'volume':
         try:
             filt_dict = {key:value for (key, value) in res_dict.items() if key < 2100}
@@ -152,6 +833,43 @@ def _get_facet_data(conf, query_string, facet):
     else:
         return res_dict
 
+def _get_pivot_data(conf, query_string, pivot, limit=1000):
+    """
+    Do an ADS API pivot query on two fields (e.g. bibstem,volume) and return the
+    frequencies of the second field for every value of the first field. If the second
+    level has as many values as the facet limit, the results for that first level value
+    may have been truncated, and they are returned as None
+    
+    param: conf: dictionary with configuration values
+    param: query_string: the query string to execute pivot query on
+    param: pivot: the pivot fields (comma separated)
+    param: limit: the maximum number of facet values returned per level
+    """
+    params = {
+        'q':query_string,
+        'fl': 'id',
+        'rows': 1,
+        'facet':'on',
+        'facet.pivot': pivot,
+        'facet.limit': limit,
+        'facet.mincount': 1,
+        'sort':'date desc'
+    }
+    data = _do_query(conf, params)
+    try:
+        pivots_data = data['facet_counts']['facet_pivot'][pivot]
+    except:
+        raise Exception('Solr returned unexpected data!')
+    facet = pivot.split(',')[1]
+    results = {}
+    for entry in pivots_data:
+        values = [(str(e['value']), e['count']) for e in entry.get('pivot', [])]
+        if len(values) >= limit:
+            results[entry['value']] = None
+        else:
+            results[entry['value']] = _facet_dict(values, facet)
+    return results
+
 def _get_records(conf, query_string, return_fields):
     """
     Do a general ADS API query
@@ -160,32 +878,57 @@ def _get_records(conf, query_string, return_fields):
     param: query_string: the query string to execute pivot query on
     param: return_fields: which Solr fields to return
     """
-    start = 0
-    rows = 1000
-    results = []
+    return list(_iter_records(conf, query_string, return_fields))
+
+def _iter_records(conf, query_string, return_fields, rows=1000, sort='id asc'):
+    """
+    Do a general ADS API query, yielding records page by page as they are retrieved. Pages
+    are retrieved with a Solr cursor (which requires the sort to end on the unique key "id"),
+    so that deep pages are as fast as the first one. If RECORDS_PREFETCH is set, the next
+    page is retrieved in the background while the records of the current page are consumed
+    
+    param: conf: dictionary with configuration values
+    param: query_string: the query string to execute pivot query on
+    param: return_fields: which Solr fields to return
+    param: rows: the number of records to retrieve per request
+    param: sort: the sort order of the records (ending on "id")
+    """
     params = {
         'q':query_string,
         'fl': return_fields,
         'rows': rows,
-        'start': start
+        'sort': sort,
+        'cursorMark': '*'
     }
-    data = _do_query(conf, params)
-    try:
-        results = data['response']['docs']
-    except:
-        raise Exception('Solr returned unexpected data!')
-    num_documents = int(data['response']['numFound'])
-    num_paginates = int(math.ceil((num_documents) / (1.0*rows))) - 1
-    start += rows
-    for i in range(num_paginates):
-        params['start'] = start
-        data = _do_query(conf, params)
+    def get_page(cursor):
+        data = _do_query(conf, dict(params, cursorMark=cursor))
         try:
-            results += data['response']['docs']
+            return data['response']['docs'], data.get('nextCursorMark')
         except:
             raise Exception('Solr returned unexpected data!')
-        start += rows
-    return results
+    executor = None
+    if conf.get('RECORDS_PREFETCH', False):
+        executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        cursor = '*'
+        docs, next_cursor = get_page(cursor)
+        while True:
+            # We are done when the cursor does not move anymore
+            more = len(docs) > 0 and bool(next_cursor) and next_cursor != cursor
+            if more and executor is not None:
+                next_page = executor.submit(get_page, next_cursor)
+            for doc in docs:
+                yield doc
+            if not more:
+                break
+            cursor = next_cursor
+            if executor is not None:
+                docs, next_cursor = next_page.result()
+            else:
+                docs, next_cursor = get_page(cursor)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
 
 def _get_usage(config, jrnls=[], bibcodes=[], udata='reads'):
     """
@@ -196,20 +939,332 @@ def _get_usage(config, jrnls=[], bibcodes=[], udata='reads'):
     param: bibcodes: a list of bibcodes, if specified
     param: udata: what type of usage data to return
     """
-    total = 0
-    recent = 0
-    index_file = config.get('CLASSIC_USAGE_INDEX')[udata]
-    # Cycle through index file and get usage data for either specific journals or bibcodes
-    with open(index_file) as fh:
-        for line in fh:
-           data = line.strip().split('\t')
-           if jrnls and data[0][4:9] not in jrnls:
-               continue
-           elif bibcodes and data[0] not in bibcodes:
-               continue
-           total += sum([int(d) for d in data[1:]])
-           recent += int(data[-1])
-    return total, recent
+    aggregate = _get_usage_aggregate(config, udata)
+    if not bibcodes:
+        # Usage for journals is the sum of the (pre-calculated) usage per journal
+        if jrnls:
+            bibstems = set(jrnls)
+        else:
+            bibstems = aggregate['journals'].keys()
+        usage = [aggregate['journals'][b] for b in bibstems if b in aggregate['journals']]
+        return sum([u[0] for u in usage]), sum([u[1] for u in usage])
+    # For bibcodes, find the rows with their usage in the (sorted) usage index
+    usage = aggregate['usage']
+    rows = _find_bibcodes(usage, bibcodes)
+    if jrnls:
+        rows = rows[np.isin(_bibstems(usage['bibcode'][rows]), [j.encode('utf-8') for j in jrnls])]
+    return int(usage['total'][rows].sum()), int(usage['recent'][rows].sum())
+
+def _get_usage_for_query(conf, query_string, udata=['reads', 'downloads'], batch_size=10000):
+    """
+    Return usage data for all records returned by a query. Bibcodes are retrieved page by page
+    and their usage is looked up in batches, while they are coming in
+    
+    param: conf: dictionary with configuration values
+    param: query_string: the query string to retrieve records for
+    param: udata: the types of usage data to return
+    param: batch_size: the number of bibcodes to look up at a time
+    """
+    usage = {}
+    totals = {}
+    for utype in udata:
+        usage[utype] = _get_usage_aggregate(conf, utype)['usage']
+        totals[utype] = [0, 0]
+    def tally(batch):
+        for utype in udata:
+            rows = _find_bibcodes(usage[utype], batch)
+            totals[utype][0] += int(usage[utype]['total'][rows].sum())
+            totals[utype][1] += int(usage[utype]['recent'][rows].sum())
+    # Keep track of the bibcodes we have seen, so that records are only counted once
+    seen = set()
+    batch = []
+    for doc in _iter_records(conf, query_string, 'bibcode'):
+        bibcode = doc.get('bibcode')
+        if not bibcode or bibcode in seen:
+            continue
+        seen.add(bibcode)
+        batch.append(bibcode)
+        if len(batch) >= batch_size:
+            tally(batch)
+            batch = []
+    if batch:
+        tally(batch)
+    return {utype: tuple(totals[utype]) for utype in udata}
+
+# Aggregated usage data, per usage index file
+_usage_aggregates = {}
+
+def _get_usage_aggregate(conf, udata='reads'):
+    """
+    Return the usage data for a Classic usage index file, together with the total and recent
+    usage per journal (bibstem). These are calculated in one pass over the usage data and kept
+    in memory, so that subsequent usage requests do not require another pass.
+    
+    param: conf: dictionary with configuration values
+    param: udata: what type of usage data to return
+    """
+    index_file = conf.get('CLASSIC_USAGE_INDEX')[udata]
+    stat = os.stat(index_file)
+    key = (os.path.realpath(index_file), stat.st_size, stat.st_mtime_ns)
+    if key not in _usage_aggregates:
+        usage = _get_usage_index(conf, udata)
+        bibstems, inverse = np.unique(_bibstems(usage['bibcode']), return_inverse=True)
+        totals = np.bincount(inverse, weights=usage['total'], minlength=len(bibstems))
+        recents = np.bincount(inverse, weights=usage['recent'], minlength=len(bibstems))
+        journals = {}
+        for bibstem, total, recent in zip(bibstems, totals, recents):
+            journals[bibstem.decode('utf-8')] = (int(total), int(recent))
+        _usage_aggregates[key] = {'usage': usage, 'journals': journals}
+    return _usage_aggregates[key]
+
+def _find_bibcodes(usage, bibcodes):
+    """
+    Return the positions of a set of bibcodes in usage data (as returned by _get_usage_index),
+    using binary search on the sorted bibcodes. A bibcode occurring more than once in the usage
+    data gets all its positions returned
+    
+    param: usage: usage data, with bibcodes sorted
+    param: bibcodes: a list of bibcodes
+    """
+    wanted = np.array(sorted([b.encode('utf-8') for b in set(bibcodes)]), dtype='S')
+    if len(wanted) == 0:
+        return np.array([], dtype='int64')
+    first = np.searchsorted(usage['bibcode'], wanted, side='left')
+    last = np.searchsorted(usage['bibcode'], wanted, side='right')
+    counts = last - first
+    # Expand the [first, last) ranges into positions
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(first, counts) + offsets
+
+def _get_usage_index(conf, udata='reads'):
+    """
+    Load a Classic usage index file into arrays with the bibcodes, the total usage and
+    the recent usage for every record. The arrays are sorted on bibcode, which allows for
+    binary search on bibcodes. When they come from the cache, the arrays are memory mapped.
+    
+    param: conf: dictionary with configuration values
+    param: udata: what type of usage data to return
+    """
+    index_file = conf.get('CLASSIC_USAGE_INDEX')[udata]
+    usage = _load_cached_arrays(conf, 'usage_{0}'.format(udata), index_file, mmap_mode='r')
+    if usage is not None:
+        _count('index_cache_hits')
+        return usage
+    _count('index_cache_misses')
+    bibcodes = []
+    totals = []
+    recents = []
+    with _profile_block(conf, 'Classic {0} index'.format(udata)) as stats:
+        with open(index_file) as fh:
+            for line in fh:
+                data = line.strip().split('\t')
+                bibcodes.append(data[0])
+                totals.append(sum([int(d) for d in data[1:]]))
+                recents.append(int(data[-1]))
+        # Bibcodes are stored as fixed width byte strings, in sorted order
+        bibcodes = np.array(bibcodes, dtype='S')
+        order = np.argsort(bibcodes, kind='stable')
+        usage = {
+            'bibcode': bibcodes[order],
+            'total': np.array(totals, dtype='int64')[order],
+            'recent': np.array(recents, dtype='int64')[order]
+        }
+        stats['rows'] = len(bibcodes)
+    _store_cached_arrays(conf, 'usage_{0}'.format(udata), index_file, usage)
+    return usage
+
+def _bibstems(bibcodes):
+    """
+    Return the bibstems (characters 5-9) for an array of bibcodes (as byte strings)
+    
+    param: bibcodes: numpy array of bibcodes
+    """
+    if len(bibcodes) == 0:
+        return np.array([], dtype='S5')
+    # Truncate to the first 9 characters and take the last 5 of those
+    chars = np.ascontiguousarray(bibcodes.astype('S9')).view('S1').reshape(-1, 9)
+    return np.ascontiguousarray(chars[:, 4:9]).view('S5').ravel()
+
+def _get_fulltext_index(conf, journals):
+    """
+    Load the Classic full text index for a set of journals into a Pandas frame, with
+    the bibstem, volume and source of full text for every record. The index file is
+    parsed in chunks, so that memory use stays limited to (roughly) the size of the
+    resulting frame. Bibstem and source are stored as categoricals.
+    
+    param: conf: dictionary with configuration values
+    param: journals: the bibstems (as they occur in bibcodes) to include
+    """
+    include = set(journals)
+    year_is_vol = conf.get("YEAR_IS_VOL", {})
+    # The parsed index depends on the journals included, and the journals for which the year is the volume
+    cache_key = [sorted(include), sorted(year_is_vol.keys())]
+    cached = _load_cached_arrays(conf, 'fulltext', conf.get("CLASSIC_FULLTEXT_INDEX"), extra=cache_key)
+    if cached is not None:
+        _count('index_cache_hits')
+        return _arrays_to_frame(cached)
+    _count('index_cache_misses')
+    frames = []
+    with _profile_block(conf, 'Classic full text index') as stats:
+        reader = pd.read_csv(conf.get("CLASSIC_FULLTEXT_INDEX"), sep='\t', header=None,
+                             names=['bibcode', 'ftfile', 'source'], usecols=['bibcode', 'source'],
+                             dtype=str, na_filter=False, quoting=csv.QUOTE_NONE,
+                             chunksize=conf.get('FULLTEXT_INDEX_CHUNKSIZE', 500000))
+        lines = 0
+        for chunk in reader:
+            lines += len(chunk)
+            bibcodes = chunk['bibcode'].str.strip()
+            bibstems = bibcodes.str[4:9]
+            keep = bibstems.isin(include)
+            bibcodes = bibcodes[keep]
+            bibstems = bibstems[keep]
+            # Since we report per journal volume, we do not want tmp bibcodes
+            volumes = bibcodes.str[9:13].str.replace('.', '', regex=False)
+            keep = volumes != 'tmp'
+            bibcodes = bibcodes[keep]
+            bibstems = bibstems[keep]
+            volumes = volumes[keep]
+            valid = volumes.str.isdecimal()
+            for bibcode in bibcodes[~valid]:
+                logger.info("Processing Classic fulltext index. Cannot get volume for: {0}. Skipping...".format(bibcode))
+            bibcodes = bibcodes[valid]
+            bibstems = bibstems[valid]
+            volumes = volumes[valid].astype('int32')
+            # For some journals the publication year serves as volume
+            year_vol = bibstems.isin(year_is_vol.keys())
+            if year_vol.any():
+                volumes[year_vol] = bibcodes[year_vol].str[0:4].astype('int32')
+            # ApJ Letters have their own bibstem in the reports
+            bibstems = bibstems.mask((bibstems == 'ApJ..') & (bibcodes.str[13] == 'L'), 'ApJL')
+            frames.append(pd.DataFrame({
+                'bibstem': bibstems,
+                'volume': volumes,
+                'source': chunk['source'].str.strip()[bibcodes.index].str.lower()
+            }))
+        if frames:
+            ft_index = pd.concat(frames, ignore_index=True)
+        else:
+            ft_index = pd.DataFrame({'bibstem': pd.Series(dtype=str), 'volume': pd.Series(dtype='int32'),
+                                     'source': pd.Series(dtype=str)})
+        ft_index['bibstem'] = ft_index['bibstem'].astype('category')
+        ft_index['source'] = ft_index['source'].astype('category')
+        stats['lines'] = lines
+        stats['rows'] = len(ft_index)
+        stats['frame_memory'] = int(ft_index.memory_usage(deep=True).sum())
+    _store_cached_arrays(conf, 'fulltext', conf.get("CLASSIC_FULLTEXT_INDEX"), _frame_to_arrays(ft_index), extra=cache_key)
+    return ft_index
+
+# Every entry in the reference resolver results files starts with a score: 0 or 5, if no match
+# was found, or 1, if a match was found successfully
+_RESOLVER_SCORE = re.compile(rb'^[ \t\r\f\v]*([015])', re.MULTILINE)
+
+# Reference resolver results files for Crossref reference data have this suffix;
+# all other results files contain publisher reference data
+_CROSSREF_SUFFIX = '.xref.xml.result'
+
+def _get_reference_directory(basedir, jrnl, volno):
+    """
+    Return the directory with reference resolver results files for a particular volume
+    of a given journal, and the letter that the volume part of the bibcodes of the files
+    in that directory should have (or None, if all files are to be included)
+    
+    param: basedir: root directory for reference data
+    param: jrnl: bibstem
+    param: volno: journal volume number
+    """
+    # Transform journal bibstem to conform with reference data conventions
+    jrnl = jrnl.replace('.','').replace('&','+')
+    # Transform volume number to conform with reference data conventions
+    vol = str(volno).zfill(4)
+    # Some idiosyncracies for A&A reference data
+    if jrnl == 'A+A' and int(vol) < 317:
+        jrnl = 'A&A'
+    if jrnl == 'A+AS' and int(vol) < 121:
+        jrnl = 'A&AS'
+    # Special treatment for ApJL
+    if jrnl == 'ApJL' and (int(vol) > 888 or int(vol) < 474):
+        return "%s/ApJ/%s" % (basedir, vol), 'L'
+    return "%s/%s/%s" % (basedir,jrnl,vol), None
+
+def _tally_resolver_results(resfiles):
+    """
+    Tally how many references in a set of reference resolver results files were successfully
+    and not successfully matched to ADS records. Files are read in one go, as bytes, and the
+    scores are picked up with a regular expression, instead of decoding and splitting every line
+    
+    param: resfiles: list of results files
+    """
+    ok = fail = 0
+    for resfile in resfiles:
+        with open(resfile, 'rb') as refdata:
+            data = refdata.read()
+        scores = b''.join(_RESOLVER_SCORE.findall(data))
+        _count('reference_files')
+        _count('reference_lines', data.count(b'\n'))
+        matches = scores.count(b'1')
+        ok += matches
+        fail += len(scores) - matches
+    return [ok, fail]
+
+def _list_reference_files(basedir, jrnl, volno):
+    """
+    List the reference resolver results files for a particular volume of a given journal,
+    per source of reference data. The volume directory is listed once. Also returns a
+    signature of the results files (names, sizes and modification times), which changes
+    whenever the contents of the volume directory change
+    
+    param: basedir: root directory for reference data
+    param: jrnl: bibstem
+    param: volno: journal volume number
+    """
+    voldir, letter = _get_reference_directory(basedir, jrnl, volno)
+    resfiles = {'publisher': [], 'crossref': []}
+    fingerprint = []
+    try:
+        entries = list(os.scandir(voldir))
+    except FileNotFoundError:
+        entries = []
+    for entry in sorted(entries, key=lambda e: e.name):
+        if entry.name.startswith('.') or not entry.name.endswith('.result'):
+            continue
+        if letter and entry.name[13:14] != letter:
+            continue
+        source = 'crossref' if entry.name.endswith(_CROSSREF_SUFFIX) else 'publisher'
+        resfiles[source].append(entry.path)
+        stat = entry.stat()
+        fingerprint.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    signature = hashlib.sha1(json.dumps(fingerprint).encode('utf-8')).hexdigest()
+    return resfiles, signature
+
+def _get_reference_matching(basedir, jrnl, volno):
+    """
+    For a particular volume of a given journal, find the results files generated
+    by the reference resolver and tally how many references were successfully and
+    not successfully matched to ADS records, per source of reference data. Every
+    results file is read once
+    
+    param: basedir: root directory for reference data
+    param: jrnl: bibstem
+    param: volno: journal volume number
+    """
+    resfiles, signature = _list_reference_files(basedir, jrnl, volno)
+    return {source: _tally_resolver_results(files) for source, files in resfiles.items()}
+
+def _update_reference_matching(basedir, jrnl, volno, known=None):
+    """
+    Like _get_reference_matching, but with previously calculated tallies for the volume.
+    These are returned as they are, if the results files did not change since. Returns
+    the signature of the results files and the tallies
+    
+    param: basedir: root directory for reference data
+    param: jrnl: bibstem
+    param: volno: journal volume number
+    param: known: previously calculated (signature, tallies), if any
+    """
+    resfiles, signature = _list_reference_files(basedir, jrnl, volno)
+    if known and known[0] == signature:
+        return signature, known[1]
+    return signature, {source: _tally_resolver_results(files) for source, files in resfiles.items()}
 
 def _get_journal_coverage(conf, jrnl):
     """
@@ -222,4 +1277,35 @@ def _get_journal_coverage(conf, jrnl):
     data = _do_query(conf, jrnl, endpoint='journals/summary')
     
     return data
+
+def _get_journal_completeness(conf, jrnl):
+    """
+    Get the metadata completeness (percentage) per volume from the Journals Database
+    for a given journal, as a Pandas series indexed on volume (as listed in the
+    Journals Database, e.g. '950' or '950L')
+    
+    param: conf: dictionary with configuration values
+    param: jrnl: a journal abbreviation (bibstem)
+    """
+    data = _get_journal_coverage(conf, jrnl)
+    try:
+        details = data['summary']['master'].get('completeness_details', [])
+    except (KeyError, TypeError, AttributeError):
+        details = []
+    # The completeness details may come as a (JSON or Python literal) string
+    if isinstance(details, str):
+        try:
+            details = json.loads(details)
+        except ValueError:
+            try:
+                details = ast.literal_eval(details)
+            except (ValueError, SyntaxError):
+                details = []
+    completeness = {}
+    try:
+        for entry in details:
+            completeness[str(entry['volume'])] = round(100*entry['completeness_fraction'], 1)
+    except (KeyError, TypeError):
+        completeness = {}
+    return pd.Series(completeness, dtype='float64')
     